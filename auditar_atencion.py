@@ -10,8 +10,8 @@ Uso:
     python auditar_atencion.py  (modo interactivo)
 
 Outputs:
-    - JSON: output/atencion_[gestion]_[internacion]_YYYYMMDD_HHMMSS.json
-    - HTML: output/atencion_[gestion]_[internacion]_YYYYMMDD_HHMMSS.html
+    - JSON: output/atencion_[gestion]_[internacion]_[id]_YYYYMMDD_HHMMSS.json
+    - HTML: output/atencion_[gestion]_[internacion]_[id]_YYYYMMDD_HHMMSS.html
     - Resumen en consola
 
 Autor: Sistema de Auditoría Médica
@@ -22,6 +22,7 @@ import sys
 import json
 import os
 import argparse
+import threading
 from datetime import datetime
 from dotenv import load_dotenv
 
@@ -41,19 +42,39 @@ from main import (
     MCPClient,
     AuditorLLM,
     AuditoriaUrgenciaResultado,
-    formatear_atencion_para_llm
+    construir_historial_llm,
+    configurar_logging
 )
+from utils.render import Fragmentos, items_lista
 
 
 class AuditorAtencionEspecifica:
     """Auditor para una atención específica"""
 
-    def __init__(self):
+    def __init__(self, usar_cache_llm=None):
         load_dotenv()
         self.mcp_client = MCPClient()
-        self.auditor_llm = AuditorLLM()
+        self.auditor_llm = AuditorLLM(cache_resultados=usar_cache_llm)
+        self.max_tokens_historial = int(os.getenv("LLM_MAX_TOKENS_HISTORIAL", "60000"))
+        # Nombres de outputs ya asignados (servicio_auditoria.py audita en paralelo)
+        self._lock_nombres = threading.Lock()
+        self._nombres_reservados = set()
         print("✅ Conectado a MySQL y servicios de IA")
 
+    def nombre_salida(self, gestion, internacion, id):
+        """
+        Ruta base (sin extensión) de los outputs de la atención. Si otra auditoría ya usó el
+        mismo nombre en el mismo segundo, agrega un sufijo (_2, _3, ...).
+        """
+        base = f"output/atencion_{gestion}_{internacion}_{id}_{datetime.now():%Y%m%d_%H%M%S}"
+        with self._lock_nombres:
+            nombre, sufijo = base, 1
+            while nombre in self._nombres_reservados or os.path.exists(f"{nombre}.json"):
+                sufijo += 1
+                nombre = f"{base}_{sufijo}"
+            self._nombres_reservados.add(nombre)
+        return nombre
+
     def parsear_cuenta(self, cuenta_str):
         """
         Parsea el formato de cuenta
@@ -132,24 +153,41 @@ class AuditorAtencionEspecifica:
 
     def auditar(self, gestion, internacion, id=1):
         """Ejecuta la auditoría completa de una atención específica"""
+        ejecucion = self.ejecutar(gestion, internacion, id)
+        if not ejecucion:
+            return None
+
+        resultado, _, _ = ejecucion
+        # Mostrar resumen en consola
+        self.mostrar_resumen_consola(resultado)
+
+        return resultado
+
+    def ejecutar(self, gestion, internacion, id=1, usar_cache=True, informar=print):
+        """
+        Audita la atención y genera sus outputs sin mostrar el resumen final.
+        Retorna (resultado, archivo_json, archivo_html), o None si la cuenta no existe,
+        no tiene evoluciones o falló el LLM. `informar` recibe los mensajes de progreso
+        (servicio_auditoria.py los envía al log en lugar de la consola).
+        """
 
         cuenta_formato = f"{gestion}/{internacion}"
-        print(f"\n{'='*80}")
-        print(f"AUDITORÍA DE ATENCIÓN ESPECÍFICA")
-        print(f"{'='*80}")
-        print(f"📋 Cuenta: {cuenta_formato}")
-        print()
+        informar(f"\n{'='*80}")
+        informar(f"AUDITORÍA DE ATENCIÓN ESPECÍFICA")
+        informar(f"{'='*80}")
+        informar(f"📋 Cuenta: {cuenta_formato}")
+        informar()
 
         # Paso 1: Obtener información básica
-        print("🔍 Obteniendo información de la atención...")
+        informar("🔍 Obteniendo información de la atención...")
         info_basica = self.obtener_informacion_basica(gestion, internacion)
 
         if not info_basica:
-            print(f"❌ ERROR: No se encontró la cuenta {cuenta_formato}")
-            print("\n💡 Verifique que:")
-            print("   • La gestión sea correcta (ej: 2025)")
-            print("   • El número de internación sea correcto")
-            print("   • La atención esté registrada en el sistema")
+            informar(f"❌ ERROR: No se encontró la cuenta {cuenta_formato}")
+            informar("\n💡 Verifique que:")
+            informar("   • La gestión sea correcta (ej: 2025)")
+            informar("   • El número de internación sea correcto")
+            informar("   • La atención esté registrada en el sistema")
             return None
 
         persona_numero = info_basica['id_persona_paciente']
@@ -158,14 +196,14 @@ class AuditorAtencionEspecifica:
         id_medico = info_basica['id_medico']
         fecha_atencion = str(info_basica['fecha_atencion'])
 
-        print(f"  ✅ Atención encontrada")
-        print(f"  👤 Paciente: {nombre_paciente}")
-        print(f"  👨‍⚕️ Médico: {nombre_medico}")
-        print(f"  📅 Fecha: {fecha_atencion}")
-        print()
+        informar(f"  ✅ Atención encontrada")
+        informar(f"  👤 Paciente: {nombre_paciente}")
+        informar(f"  👨‍⚕️ Médico: {nombre_medico}")
+        informar(f"  📅 Fecha: {fecha_atencion}")
+        informar()
 
         # Paso 2: Obtener detalle completo
-        print("📄 Obteniendo historial clínico completo...")
+        informar("📄 Obteniendo historial clínico completo...")
         detalle = self.mcp_client.get_detalle_atencion(
             persona_numero=persona_numero,
             cuenta_gestion=gestion,
@@ -174,31 +212,34 @@ class AuditorAtencionEspecifica:
         )
 
         if not detalle or not detalle.get('evoluciones_clinicas'):
-            print(f"⚠️  ADVERTENCIA: La cuenta {cuenta_formato} no tiene evoluciones registradas")
-            print("   No se puede realizar la auditoría sin datos clínicos")
+            informar(f"⚠️  ADVERTENCIA: La cuenta {cuenta_formato} no tiene evoluciones registradas")
+            informar("   No se puede realizar la auditoría sin datos clínicos")
             return None
 
         # Contar evoluciones
         evoluciones_raw = detalle.get('evoluciones_clinicas', '')
         num_evoluciones = evoluciones_raw.count('---EVOLUCION---') + 1 if evoluciones_raw else 0
 
-        print(f"  ✅ Historial obtenido")
-        print(f"  📋 Evoluciones registradas: {num_evoluciones}")
-        print()
+        informar(f"  ✅ Historial obtenido")
+        informar(f"  📋 Evoluciones registradas: {num_evoluciones}")
+        informar()
 
         # Paso 3: Formatear para LLM
-        historial_formateado = formatear_atencion_para_llm(detalle)
+        historial = construir_historial_llm(detalle, self.max_tokens_historial)
+        for recorte in historial.recortes:
+            estado = "omitida" if recorte.omitida else f"{recorte.tokens_originales} -> {recorte.tokens_finales} tokens"
+            informar(f"  ✂️  Historial recortado por límite de tokens: {recorte.seccion} ({estado})")
 
         # Paso 4: Auditar con IA
-        print("🤖 Ejecutando auditoría con IA (Claude Sonnet 4.5)...")
-        print("   ⏳ Esto puede tomar 30-60 segundos...")
-        print()
+        informar("🤖 Ejecutando auditoría con IA (Claude Sonnet 4.5)...")
+        informar("   ⏳ Esto puede tomar 30-60 segundos...")
+        informar()
 
         # Extraer diagnósticos del historial formateado si están disponibles
         diagnosticos = "Diagnóstico de urgencia - Ver evoluciones clínicas"
 
         resultado = self.auditor_llm.auditar_atencion(
-            historial=historial_formateado,
+            historial=historial.texto,
             id_evolucion=0,  # No relevante para atención individual
             fecha_atencion=fecha_atencion,
             diagnostico=diagnosticos,
@@ -207,40 +248,41 @@ class AuditorAtencionEspecifica:
             nombre_medico=nombre_medico,
             nombre_paciente=nombre_paciente,
             cuenta_gestion=gestion,
-            cuenta_internacion=internacion
+            cuenta_internacion=internacion,
+            recortes_historial=historial.recortes,
+            usar_cache=usar_cache
         )
 
         if not resultado:
-            print(f"❌ ERROR: Falló la auditoría con IA")
-            print("\n💡 Verifique:")
-            print("   • API key de OpenRouter válida en .env")
-            print("   • Conectividad a internet")
-            print("   • Saldo disponible en OpenRouter")
+            informar(f"❌ ERROR: Falló la auditoría con IA")
+            informar("\n💡 Verifique:")
+            informar("   • API key de OpenRouter válida en .env")
+            informar("   • Conectividad a internet")
+            informar("   • Saldo disponible en OpenRouter")
             return None
 
-        print(f"  ✅ Auditoría completada")
-        print(f"  📊 Score de calidad: {resultado.score_calidad}/100")
-        print(f"  {'✅' if resultado.cumple_guias.lower() in ['sí', 'si'] else '❌'} Cumple guías: {resultado.cumple_guias}")
-        print()
+        informar(f"  ✅ Auditoría completada")
+        informar(f"  📊 Score de calidad: {resultado.score_calidad}/100")
+        informar(f"  {'✅' if resultado.cumple_guias.lower() in ['sí', 'si'] else '❌'} Cumple guías: {resultado.cumple_guias}")
+        informar()
 
         # Paso 5: Generar outputs
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        nombre = self.nombre_salida(gestion, internacion, id)
 
         # JSON
-        json_filename = f"output/atencion_{gestion}_{internacion}_{timestamp}.json"
+        json_filename = f"{nombre}.json"
         self.generar_json(resultado, detalle, num_evoluciones, json_filename)
-        print(f"  💾 JSON generado: {json_filename}")
+        with self._lock_nombres:
+            self._nombres_reservados.discard(nombre)  # desde aquí lo protege os.path.exists
+        informar(f"  💾 JSON generado: {json_filename}")
 
         # HTML
-        html_filename = f"output/atencion_{gestion}_{internacion}_{timestamp}.html"
+        html_filename = f"{nombre}.html"
         self.generar_html(resultado, detalle, num_evoluciones, html_filename)
-        print(f"  📄 HTML generado: {html_filename}")
-        print()
+        informar(f"  📄 HTML generado: {html_filename}")
+        informar()
 
-        # Mostrar resumen en consola
-        self.mostrar_resumen_consola(resultado)
-
-        return resultado
+        return resultado, json_filename, html_filename
 
     def generar_json(self, resultado: AuditoriaUrgenciaResultado, detalle: dict, num_evoluciones: int, archivo: str):
         """Genera archivo JSON con metadata completa"""
@@ -306,7 +348,8 @@ class AuditorAtencionEspecifica:
         for en, es in meses.items():
             fecha_auditoria = fecha_auditoria.replace(en, es)
 
-        html = f"""<!DOCTYPE html>
+        html = Fragmentos()
+        html += f"""<!DOCTYPE html>
 <html lang="es">
 <head>
     <meta charset="UTF-8">
@@ -616,8 +659,7 @@ class AuditorAtencionEspecifica:
             <ul style="margin-left: 25px; line-height: 2;">
 """
 
-        for guia in resultado.guias_aplicables:
-            html += f"                <li><strong>{guia}</strong></li>\n"
+        html += items_lista((f"<strong>{guia}</strong>" for guia in resultado.guias_aplicables), sangria=16)
 
         html += """
             </ul>
@@ -633,11 +675,9 @@ class AuditorAtencionEspecifica:
                     <ul>
 """
 
-        if resultado.criterios_cumplidos:
-            for criterio in resultado.criterios_cumplidos:
-                html += f"                        <li>{criterio}</li>\n"
-        else:
-            html += "                        <li><em>No se registraron criterios cumplidos</em></li>\n"
+        html += items_lista(
+            resultado.criterios_cumplidos, sangria=24, vacio="<em>No se registraron criterios cumplidos</em>"
+        )
 
         html += """
                     </ul>
@@ -648,11 +688,9 @@ class AuditorAtencionEspecifica:
                     <ul>
 """
 
-        if resultado.criterios_no_cumplidos:
-            for criterio in resultado.criterios_no_cumplidos:
-                html += f"                        <li>{criterio}</li>\n"
-        else:
-            html += "                        <li><em>Todos los criterios fueron cumplidos</em></li>\n"
+        html += items_lista(
+            resultado.criterios_no_cumplidos, sangria=24, vacio="<em>Todos los criterios fueron cumplidos</em>"
+        )
 
         html += """
                     </ul>
@@ -669,8 +707,7 @@ class AuditorAtencionEspecifica:
             <h2 style="color: #991b1b;">🚨 Hallazgos Críticos</h2>
             <ol style="margin-left: 25px; line-height: 2;">
 """
-            for hallazgo in resultado.hallazgos_criticos:
-                html += f"                <li>{hallazgo}</li>\n"
+            html += items_lista(resultado.hallazgos_criticos, sangria=16)
 
             html += """
             </ol>
@@ -685,8 +722,7 @@ class AuditorAtencionEspecifica:
             <h2>💡 Recomendaciones</h2>
             <ol style="margin-left: 25px; line-height: 2;">
 """
-            for recomendacion in resultado.recomendaciones:
-                html += f"                <li>{recomendacion}</li>\n"
+            html += items_lista(resultado.recomendaciones, sangria=16)
 
             html += """
             </ol>
@@ -738,8 +774,7 @@ class AuditorAtencionEspecifica:
 """
 
         os.makedirs("output", exist_ok=True)
-        with open(archivo, 'w', encoding='utf-8') as f:
-            f.write(html)
+        html.escribir(archivo)
 
     def mostrar_resumen_consola(self, resultado: AuditoriaUrgenciaResultado):
         """Muestra resumen detallado en consola"""
@@ -768,11 +803,12 @@ def main():
 Ejemplos de uso:
   python auditar_atencion.py 2025/140954
   python auditar_atencion.py --gestion 2025 --internacion 140954
+  python auditar_atencion.py 2025/140954 --sin-cache  (ignora la caché local del LLM)
   python auditar_atencion.py  (modo interactivo)
 
 Outputs:
-  - JSON: output/atencion_[gestion]_[internacion]_YYYYMMDD_HHMMSS.json
-  - HTML: output/atencion_[gestion]_[internacion]_YYYYMMDD_HHMMSS.html
+  - JSON: output/atencion_[gestion]_[internacion]_[id]_YYYYMMDD_HHMMSS.json
+  - HTML: output/atencion_[gestion]_[internacion]_[id]_YYYYMMDD_HHMMSS.html
   - Resumen en consola
         """
     )
@@ -798,12 +834,18 @@ Outputs:
         default=1,
         help='ID de la cuenta (por defecto: 1)'
     )
+    parser.add_argument(
+        '--sin-cache',
+        action='store_true',
+        help='No usar la caché local de resultados del LLM (fuerza una auditoría nueva)'
+    )
 
     args = parser.parse_args()
+    configurar_logging()
 
     try:
         # Inicializar auditor
-        auditor = AuditorAtencionEspecifica()
+        auditor = AuditorAtencionEspecifica(usar_cache_llm=False if args.sin_cache else None)
 
         # Determinar cuenta a auditar
         if args.cuenta:
@@ -0,0 +1,119 @@
+"""
+Benchmark del Arranque de los Scripts
+=====================================
+
+Mide cuánto tarda en arrancar cada script del proyecto: el tiempo de importar el
+módulo (según `python -X importtime`) y el tiempo de pared de `python script.py --help`.
+Sirve para detectar dependencias pesadas (litellm, pymysql, requests) que vuelven a
+importarse al cargar el módulo en lugar de en su primer uso.
+
+No requiere MySQL ni OpenRouter: cada medición corre en un proceso nuevo y no ejecuta
+ninguna auditoría.
+
+Uso:
+    python benchmark_importtime.py
+    python benchmark_importtime.py --repeticiones 5
+    python benchmark_importtime.py --modulos main auditar_atencion --top 15
+
+Salida:
+    - Tabla con tiempo de import y de --help de cada script (mediana de las repeticiones)
+    - Paquetes de primer nivel más pesados que importa cada script
+"""
+
+import os
+import re
+import sys
+import time
+import argparse
+import statistics
+import subprocess
+
+MODULOS = ["main", "auditar_atencion", "ver_historial_raw", "generar_reporte", "benchmark_reporte", "comparar_query_24h"]
+
+# Scripts que no aceptan --help (parsean sys.argv a mano): solo se mide el import
+SIN_HELP = {"ver_historial_raw", "comparar_query_24h"}
+
+# Línea de -X importtime: "import time:  self [us] | cumulative | nombre" (el nombre se indenta según la profundidad)
+_LINEA_IMPORTTIME = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|( *)(\S+)")
+
+DIRECTORIO = os.path.dirname(os.path.abspath(__file__))
+
+
+def _entorno():
+    """Entorno de los procesos medidos: sin descarga del mapa de costos de litellm"""
+    entorno = dict(os.environ)
+    entorno.setdefault("LITELLM_LOCAL_MODEL_COST_MAP", "True")
+    return entorno
+
+
+def medir_import(modulo):
+    """
+    Importa el módulo en un proceso nuevo con -X importtime.
+    Retorna (segundos totales, {paquete de primer nivel: segundos acumulados}).
+    """
+    proceso = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {modulo}"],
+        cwd=DIRECTORIO, env=_entorno(), capture_output=True, text=True
+    )
+    if proceso.returncode != 0:
+        raise RuntimeError(f"No se pudo importar {modulo}: {proceso.stderr.strip().splitlines()[-1]}")
+
+    total = 0
+    paquetes = {}
+    for linea in proceso.stderr.splitlines():
+        coincidencia = _LINEA_IMPORTTIME.match(linea)
+        if not coincidencia:
+            continue
+        acumulado, sangria, nombre = int(coincidencia.group(2)), coincidencia.group(3), coincidencia.group(4)
+        if nombre == modulo:
+            total = acumulado
+        elif len(sangria) <= 3:
+            # Imports directos del intérprete o del módulo: se agrupan por paquete de primer nivel
+            paquete = nombre.split(".")[0]
+            paquetes[paquete] = paquetes.get(paquete, 0) + acumulado
+    return total / 1e6, {paquete: us / 1e6 for paquete, us in paquetes.items()}
+
+
+def medir_help(modulo):
+    """Segundos de pared de `python modulo.py --help` en un proceso nuevo"""
+    inicio = time.perf_counter()
+    subprocess.run(
+        [sys.executable, f"{modulo}.py", "--help"],
+        cwd=DIRECTORIO, env=_entorno(), capture_output=True
+    )
+    return time.perf_counter() - inicio
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del tiempo de arranque de los scripts")
+    parser.add_argument("--modulos", nargs="+", default=MODULOS, help="Scripts a medir (sin .py)")
+    parser.add_argument("--repeticiones", type=int, default=3, help="Mediciones por script; se informa la mediana (por defecto: 3)")
+    parser.add_argument("--top", type=int, default=5, help="Paquetes más pesados a listar por script (por defecto: 5)")
+    args = parser.parse_args()
+
+    print(f"{'Script':<20} | {'Import':>8} | {'--help':>8} | Paquetes más pesados")
+    print("-" * 96)
+
+    for modulo in args.modulos:
+        try:
+            mediciones = [medir_import(modulo) for _ in range(args.repeticiones)]
+        except RuntimeError as e:
+            print(f"{modulo:<20} | {'error':>8} | {'-':>8} | {e}")
+            continue
+
+        t_import = statistics.median(total for total, _ in mediciones)
+        _, paquetes = min(mediciones, key=lambda medicion: medicion[0])
+        t_help = "-"
+        if modulo not in SIN_HELP:
+            t_help = f"{statistics.median(medir_help(modulo) for _ in range(args.repeticiones)):.2f}s"
+
+        pesados = sorted(paquetes.items(), key=lambda item: item[1], reverse=True)[:args.top]
+        detalle = ", ".join(f"{paquete} {segundos:.2f}s" for paquete, segundos in pesados)
+        print(f"{modulo:<20} | {t_import:>7.2f}s | {t_help:>8} | {detalle}")
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        sys.exit(1)
@@ -0,0 +1,133 @@
+"""
+Benchmark del Reporte HTML
+==========================
+
+Mide cuánto tarda generar_reporte.py (análisis + renderizado + escritura) y cuánta
+memoria pico usa, para distintos volúmenes de atenciones sintéticas. Sirve para
+verificar que el costo crece de forma lineal con el número de atenciones.
+
+No requiere MySQL ni OpenRouter: genera JSONL sintéticos en un directorio temporal
+con la misma estructura que produce main.py.
+
+Uso:
+    python benchmark_reporte.py
+    python benchmark_reporte.py --atenciones 1000 5000 10000 20000
+    python benchmark_reporte.py --sin-memoria   # sin tracemalloc (tiempos más realistas)
+    python benchmark_reporte.py --modo cliente  # reporte con datos embebidos y renderizado en el navegador
+
+Salida:
+    - Tabla con tiempo de análisis, renderizado y escritura, tamaño del HTML,
+      memoria pico y microsegundos por atención de cada volumen
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import tracemalloc
+from datetime import datetime, timedelta
+
+from generar_reporte import MODOS_REPORTE, FuenteRegistros, analizar_datos, renderizar_html
+
+GUIAS = [
+    "WHO - Manejo de sepsis", "AHA 2020 - Soporte vital cardiovascular avanzado",
+    "NICE NG51 - Sepsis", "ERC 2021 - Resucitación", "ACEP Clinical Policy - Dolor torácico",
+    "ACS ATLS - Trauma", "GINA 2023 - Asma"
+]
+
+
+def generar_jsonl(archivo, cantidad, semilla):
+    """Escribe `cantidad` auditorías sintéticas con la estructura de AuditoriaUrgenciaResultado"""
+    rnd = random.Random(semilla)
+    inicio = datetime(2025, 10, 1)
+    with open(archivo, "w", encoding="utf-8") as f:
+        for i in range(cantidad):
+            medico = rnd.randint(1, 40)
+            registro = {
+                "id_medico": medico,
+                "nombre_medico": f"Médico {medico}",
+                "id_persona_paciente": rnd.randint(1, cantidad),
+                "nombre_paciente": f"Paciente {i}",
+                "id_evolucion": i,
+                "fecha_atencion": (inicio + timedelta(minutes=rnd.randint(0, 60 * 24 * 30))).strftime("%Y-%m-%d %H:%M:%S"),
+                "cuenta_gestion": 2025,
+                "cuenta_internacion": 100000 + i,
+                "diagnostico_urgencia": f"R{i % 90:02d} - Diagnóstico sintético",
+                "cumple_guias": rnd.choice(["Sí", "No"]),
+                "score_calidad": rnd.randint(20, 100),
+                "guias_aplicables": rnd.sample(GUIAS, 2),
+                "criterios_cumplidos": [f"Criterio cumplido {n}" for n in range(rnd.randint(0, 4))],
+                "criterios_no_cumplidos": [f"Criterio no cumplido {n}" for n in range(rnd.randint(0, 3))],
+                "tratamiento_adecuado": "Adecuado según guías",
+                "tiempo_atencion": "Adecuado",
+                "estudios_solicitados": "Apropiados",
+                "medicacion_apropiada": "Apropiada",
+                "hallazgos_criticos": [f"Hallazgo {rnd.randint(1, 50)}" for _ in range(rnd.randint(0, 2))],
+                "recomendaciones": [f"Recomendación {rnd.randint(1, 50)}" for _ in range(rnd.randint(1, 3))],
+                "comentarios_adicionales": "Comentario sintético del auditor. " * 5
+            }
+            f.write(json.dumps(registro, ensure_ascii=False) + "\n")
+
+
+def medir(archivo_jsonl, archivo_html, medir_memoria, modo):
+    if medir_memoria:
+        tracemalloc.start()
+
+    inicio = time.perf_counter()
+    data = FuenteRegistros([archivo_jsonl])
+    analisis = analizar_datos(data)
+    t_analisis = time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    html = renderizar_html(data, analisis, modo)
+    t_render = time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    html.escribir(archivo_html)
+    t_escritura = time.perf_counter() - inicio
+
+    pico = 0
+    if medir_memoria:
+        pico = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    return analisis["total"], t_analisis, t_render, t_escritura, os.path.getsize(archivo_html), pico
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de generación del reporte HTML")
+    parser.add_argument("--atenciones", type=int, nargs="+", default=[1000, 5000, 10000],
+                        help="Volúmenes a medir (por defecto: 1000 5000 10000)")
+    parser.add_argument("--semilla", type=int, default=42, help="Semilla de datos sintéticos (por defecto: 42)")
+    parser.add_argument("--sin-memoria", action="store_true",
+                        help="No medir memoria pico (tracemalloc agrega overhead a los tiempos)")
+    parser.add_argument("--modo", choices=MODOS_REPORTE, default="completo", help="Modo del reporte (por defecto: completo)")
+    args = parser.parse_args()
+
+    print(f"{'Atenciones':>10} | {'Análisis':>9} | {'Render':>8} | {'Escritura':>9} | {'Total':>8} | "
+          f"{'HTML':>8} | {'Mem. pico':>9} | {'µs/atención':>11}")
+    print("-" * 96)
+
+    with tempfile.TemporaryDirectory(prefix="benchmark_reporte_") as directorio:
+        for cantidad in args.atenciones:
+            archivo_jsonl = os.path.join(directorio, f"auditoria_{cantidad}.jsonl")
+            archivo_html = os.path.join(directorio, f"auditoria_{cantidad}.html")
+            generar_jsonl(archivo_jsonl, cantidad, args.semilla)
+
+            total, t_analisis, t_render, t_escritura, tamano, pico = medir(
+                archivo_jsonl, archivo_html, not args.sin_memoria, args.modo
+            )
+            t_total = t_analisis + t_render + t_escritura
+            memoria = f"{pico / 1e6:.0f} MB" if pico else "-"
+            print(f"{total:>10} | {t_analisis:>8.2f}s | {t_render:>7.2f}s | {t_escritura:>8.2f}s | {t_total:>7.2f}s | "
+                  f"{tamano / 1e6:>5.1f} MB | {memoria:>9} | {t_total / total * 1e6:>11.0f}")
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        sys.exit(1)
@@ -0,0 +1,335 @@
+"""
+Comparador de Queries - Listado de Atenciones 24h
+=================================================
+
+Verifica que queries/get_atenciones_urgencias.sql con la ventana de 24h (una
+sola pasada, sin subconsultas correlacionadas) devuelve EXACTAMENTE las mismas
+filas que la versión anterior (queries/get_todas_atenciones_24h_correlacionada.sql) y
+reporta la diferencia de tiempos.
+
+Se ejecuta contra una base de datos sintética (fixture) que el script crea,
+llena y elimina en el servidor MySQL configurado en .env. Requiere MySQL 8.0+
+y un usuario con permiso CREATE/DROP DATABASE. NUNCA usa MYSQL_DATABASE.
+
+Uso:
+    python comparar_query_24h.py
+    python comparar_query_24h.py --cuentas 5000 --repeticiones 10
+    python comparar_query_24h.py --fixture-db auditoria_fixture --conservar
+
+Salida:
+    - Resultado de la comparación fila a fila (código de salida 1 si difieren)
+    - Tiempos (mínimo / mediana) de cada versión y factor de mejora
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+import statistics
+from datetime import timedelta
+from dotenv import load_dotenv
+import pymysql
+from pymysql.cursors import DictCursor
+
+QUERY_ACTUAL = os.path.join("queries", "get_atenciones_urgencias.sql")
+# Los mismos parámetros que MCPClient.get_todas_atenciones_24h
+PARAMETROS_24H = {"desde": "DATE_SUB(NOW(), INTERVAL 24 HOUR)", "hasta": "NULL", "cerradas_desde": "NULL"}
+QUERY_REFERENCIA = os.path.join("queries", "get_todas_atenciones_24h_correlacionada.sql")
+
+FECHA_NO_ELIMINADO = "1000-01-01 00:00:00"
+
+TABLAS_FIXTURE = [
+    """
+    CREATE TABLE persona (
+        PersonaNumero INT PRIMARY KEY,
+        PersonaNombreCompleto VARCHAR(120),
+        PersonaSexo CHAR(1),
+        PersonaFechaNacimiento DATE
+    )
+    """,
+    """
+    CREATE TABLE usuario (
+        UsuarioCodigo VARCHAR(20) PRIMARY KEY,
+        UsuarioPersonaCodigo INT
+    )
+    """,
+    """
+    CREATE TABLE turno (
+        TurnoNumero INT PRIMARY KEY,
+        TurnoTipo CHAR(1)
+    )
+    """,
+    """
+    CREATE TABLE cie9cm (
+        CIE9CMCodigo VARCHAR(10) PRIMARY KEY,
+        CIE9CMDescripcion VARCHAR(120)
+    )
+    """,
+    """
+    CREATE TABLE pacienteevolucion (
+        EvolucionAutonumerico INT AUTO_INCREMENT PRIMARY KEY,
+        PersonaNumero INT,
+        PacienteEvolucionGestion INT,
+        PacienteEvolucionNroInter INT,
+        PacienteEvolucionNroIntId INT,
+        PacienteEvolucionFechaHora DATETIME,
+        PacienteEvolucionBFecha DATETIME,
+        PacienteEvolucionSector INT,
+        TurnoNumero INT,
+        PacienteEvolucionMUsuario VARCHAR(20),
+        PacienteEvolucionTipo INT DEFAULT 1,
+        taCodTipoAlta INT DEFAULT 0,
+        KEY idx_cuenta (PersonaNumero, PacienteEvolucionGestion, PacienteEvolucionNroInter, PacienteEvolucionNroIntId),
+        KEY idx_sector_fecha (PacienteEvolucionSector, PacienteEvolucionFechaHora),
+        KEY idx_persona_fecha (PersonaNumero, PacienteEvolucionFechaHora)
+    )
+    """,
+    """
+    CREATE TABLE pacienteevoluciondiagnostico (
+        PersonaNumero INT,
+        PacienteEvolucionFechaHora DATETIME,
+        CIE9CMCodigo VARCHAR(10),
+        KEY idx_evolucion (PersonaNumero, PacienteEvolucionFechaHora)
+    )
+    """,
+]
+
+
+def leer_query(ruta):
+    """Lee un archivo .sql"""
+    with open(ruta, "r", encoding="utf-8") as f:
+        return f.read()
+
+
+def conectar(database=None):
+    """Conexión con las credenciales de .env (sin base por defecto)"""
+    return pymysql.connect(
+        host=os.getenv("MYSQL_HOST", "127.0.0.1"),
+        port=int(os.getenv("MYSQL_PORT", "3306")),
+        user=os.getenv("MYSQL_USER"),
+        password=os.getenv("MYSQL_PASSWORD"),
+        database=database,
+        cursorclass=DictCursor,
+        connect_timeout=10,
+        autocommit=True
+    )
+
+
+def generar_fixture(cursor, num_cuentas, max_evoluciones, semilla):
+    """
+    Llena las tablas con datos sintéticos que cubren los casos borde de la query:
+    evoluciones dentro y fuera de la ventana de 24h, otros sectores y tipos de
+    turno, evoluciones eliminadas, usuarios sin persona, cuentas sin diagnósticos,
+    varias cuentas por paciente, diagnósticos repetidos entre evoluciones y
+    evoluciones con fecha futura (desfase de reloj).
+    """
+    rnd = random.Random(semilla)
+
+    cursor.execute("SELECT NOW() AS ahora")
+    ahora = cursor.fetchone()["ahora"]
+
+    num_pacientes = max(1, int(num_cuentas * 0.8))
+    num_medicos = max(5, num_cuentas // 20)
+
+    personas = [
+        (n, f"PACIENTE {n}", rnd.choice("MF"), f"19{rnd.randint(30, 99)}-0{rnd.randint(1, 9)}-1{rnd.randint(0, 9)}")
+        for n in range(1, num_pacientes + 1)
+    ]
+    medicos = [
+        (100000 + n, f"MEDICO {n}", rnd.choice("MF"), "1980-01-01")
+        for n in range(1, num_medicos + 1)
+    ]
+    cursor.executemany("INSERT INTO persona VALUES (%s, %s, %s, %s)", personas + medicos)
+
+    # ~10% de usuarios apuntan a una persona inexistente
+    usuarios = [
+        (f"USR{n}", medico[0] if rnd.random() > 0.1 else 900000 + n)
+        for n, medico in enumerate(medicos, 1)
+    ]
+    cursor.executemany("INSERT INTO usuario VALUES (%s, %s)", usuarios)
+
+    turnos = [(n, rnd.choices("EPS", weights=[8, 1, 1])[0]) for n in range(1, num_cuentas * 2 + 1)]
+    cursor.executemany("INSERT INTO turno VALUES (%s, %s)", turnos)
+
+    codigos = [(f"{n:03d}.{rnd.randint(0, 9)}", f"DIAGNOSTICO {n}") for n in range(1, 201)]
+    cursor.executemany("INSERT INTO cie9cm VALUES (%s, %s)", codigos)
+
+    evoluciones = []
+    diagnosticos = []
+    for cuenta in range(1, num_cuentas + 1):
+        persona = rnd.randint(1, num_pacientes)
+        gestion = rnd.choice([2024, 2025])
+        internacion = 100000 + cuenta
+        cuenta_id = rnd.choice([1, 1, 1, 2])
+        # Inicio entre 40h atrás y ahora: parte de las cuentas queda fuera de la ventana
+        inicio = ahora - timedelta(minutes=rnd.randint(1, 40 * 60))
+        # Segundos distintos por evolución: el "primer médico" no depende del desempate
+        for n in range(rnd.randint(1, max_evoluciones)):
+            fecha = inicio + timedelta(minutes=25 * n, seconds=cuenta % 60 + n)
+            if fecha > ahora:
+                break
+            eliminada = rnd.random() < 0.05
+            evoluciones.append((
+                persona, gestion, internacion, cuenta_id, fecha,
+                "2025-01-01 00:00:00" if eliminada else FECHA_NO_ELIMINADO,
+                50 if rnd.random() < 0.85 else 3,
+                rnd.randint(1, len(turnos)),
+                rnd.choice(usuarios)[0] if rnd.random() > 0.03 else "SIN_USUARIO",
+            ))
+            for _ in range(rnd.choice([0, 1, 1, 2, 3])):
+                diagnosticos.append((persona, fecha, rnd.choice(codigos[:60])[0]))
+        # ~2% de las cuentas tiene además una evolución con fecha posterior a NOW()
+        if rnd.random() < 0.02:
+            evoluciones.append((
+                persona, gestion, internacion, cuenta_id,
+                ahora + timedelta(minutes=rnd.randint(1, 120), seconds=cuenta % 60),
+                FECHA_NO_ELIMINADO, 50, rnd.randint(1, len(turnos)), rnd.choice(usuarios)[0],
+            ))
+
+    cursor.executemany(
+        """
+        INSERT INTO pacienteevolucion (
+            PersonaNumero, PacienteEvolucionGestion, PacienteEvolucionNroInter,
+            PacienteEvolucionNroIntId, PacienteEvolucionFechaHora, PacienteEvolucionBFecha,
+            PacienteEvolucionSector, TurnoNumero, PacienteEvolucionMUsuario
+        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+        """,
+        evoluciones
+    )
+    cursor.executemany("INSERT INTO pacienteevoluciondiagnostico VALUES (%s, %s, %s)", diagnosticos)
+    cursor.execute("ANALYZE TABLE pacienteevolucion, pacienteevoluciondiagnostico, persona, usuario, turno")
+    cursor.fetchall()
+
+    return len(evoluciones), len(diagnosticos)
+
+
+def ejecutar(cursor, query):
+    """Ejecuta la query y retorna (filas, segundos)"""
+    inicio = time.perf_counter()
+    cursor.execute(query)
+    filas = cursor.fetchall()
+    return filas, time.perf_counter() - inicio
+
+
+def comparar_filas(filas_referencia, filas_actual):
+    """
+    Compara ambos resultados sobre las columnas de la versión de referencia.
+    Retorna (iguales, lista de diferencias para mostrar).
+    """
+    if not filas_referencia and not filas_actual:
+        return True, []
+
+    columnas = list((filas_referencia or filas_actual)[0].keys())
+    faltantes = [c for c in columnas if filas_actual and c not in filas_actual[0]]
+    if faltantes:
+        return False, [f"Columnas ausentes en la versión actual: {faltantes}"]
+
+    def normalizar(filas):
+        return sorted(tuple(str(f[c]) for c in columnas) for f in filas)
+
+    referencia = normalizar(filas_referencia)
+    actual = normalizar(filas_actual)
+
+    diferencias = []
+    if len(referencia) != len(actual):
+        diferencias.append(f"Cantidad de filas: referencia={len(referencia)}, actual={len(actual)}")
+
+    solo_referencia = set(referencia) - set(actual)
+    solo_actual = set(actual) - set(referencia)
+    for fila in sorted(solo_referencia)[:5]:
+        diferencias.append(f"Solo en referencia: {dict(zip(columnas, fila))}")
+    for fila in sorted(solo_actual)[:5]:
+        diferencias.append(f"Solo en actual:     {dict(zip(columnas, fila))}")
+
+    # Ambas versiones ordenan por fecha_atencion DESC
+    fechas = [f["fecha_atencion"] for f in filas_actual]
+    if fechas != sorted(fechas, reverse=True):
+        diferencias.append("La versión actual no respeta ORDER BY fecha_atencion DESC")
+
+    return not diferencias, diferencias
+
+
+def main():
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(
+        description="Compara la query de atenciones 24h contra su versión correlacionada"
+    )
+    parser.add_argument("--fixture-db", default="auditoria_fixture_24h",
+                        help="Base de datos temporal a crear (por defecto: auditoria_fixture_24h)")
+    parser.add_argument("--cuentas", type=int, default=2000, help="Cuentas sintéticas a generar (por defecto: 2000)")
+    parser.add_argument("--max-evoluciones", type=int, default=8, help="Máximo de evoluciones por cuenta (por defecto: 8)")
+    parser.add_argument("--repeticiones", type=int, default=5, help="Ejecuciones medidas por query (por defecto: 5)")
+    parser.add_argument("--semilla", type=int, default=42, help="Semilla de datos sintéticos (por defecto: 42)")
+    parser.add_argument("--conservar", action="store_true", help="No eliminar la base de datos fixture al terminar")
+    args = parser.parse_args()
+
+    if args.fixture_db == os.getenv("MYSQL_DATABASE"):
+        print(f"❌ ERROR: --fixture-db no puede ser la base de producción ({args.fixture_db})")
+        sys.exit(1)
+
+    query_actual = leer_query(QUERY_ACTUAL).format(**PARAMETROS_24H)
+    query_referencia = leer_query(QUERY_REFERENCIA)
+
+    connection = conectar()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT VERSION() AS version")
+            print(f"Servidor MySQL: {cursor.fetchone()['version']}")
+
+            cursor.execute(f"DROP DATABASE IF EXISTS `{args.fixture_db}`")
+            cursor.execute(f"CREATE DATABASE `{args.fixture_db}` CHARACTER SET utf8mb4")
+            cursor.execute(f"USE `{args.fixture_db}`")
+            for ddl in TABLAS_FIXTURE:
+                cursor.execute(ddl)
+
+            print(f"Generando fixture en '{args.fixture_db}' ({args.cuentas} cuentas)...")
+            num_evoluciones, num_diagnosticos = generar_fixture(
+                cursor, args.cuentas, args.max_evoluciones, args.semilla
+            )
+            print(f"  [OK] {num_evoluciones} evoluciones, {num_diagnosticos} diagnósticos")
+
+            # Calentamiento + verificación de equivalencia
+            filas_referencia, _ = ejecutar(cursor, query_referencia)
+            filas_actual, _ = ejecutar(cursor, query_actual)
+            iguales, diferencias = comparar_filas(filas_referencia, filas_actual)
+
+            tiempos = {"referencia": [], "actual": []}
+            for _ in range(args.repeticiones):
+                tiempos["referencia"].append(ejecutar(cursor, query_referencia)[1])
+                tiempos["actual"].append(ejecutar(cursor, query_actual)[1])
+    finally:
+        if not args.conservar:
+            with connection.cursor() as cursor:
+                cursor.execute(f"DROP DATABASE IF EXISTS `{args.fixture_db}`")
+        connection.close()
+
+    print(f"\n{'='*70}")
+    print("EQUIVALENCIA")
+    print('='*70)
+    print(f"  Filas referencia: {len(filas_referencia)}")
+    print(f"  Filas actual:     {len(filas_actual)}")
+    if iguales:
+        print("  [OK] Ambas versiones devuelven exactamente las mismas filas")
+    else:
+        print("  [ERROR] Los resultados difieren:")
+        for diferencia in diferencias:
+            print(f"    - {diferencia}")
+
+    print(f"\n{'='*70}")
+    print(f"TIEMPOS ({args.repeticiones} repeticiones)")
+    print('='*70)
+    for nombre, valores in tiempos.items():
+        print(f"  {nombre:<11} min: {min(valores)*1000:8.1f} ms   mediana: {statistics.median(valores)*1000:8.1f} ms")
+    mediana_ref = statistics.median(tiempos["referencia"])
+    mediana_act = statistics.median(tiempos["actual"])
+    if mediana_act > 0:
+        print(f"  Mejora (mediana): x{mediana_ref / mediana_act:.1f}")
+    print('='*70)
+
+    sys.exit(0 if iguales else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,128 +1,884 @@
 import json
 import os
+import hashlib
 from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 
+from utils.render import Fragmentos, items_lista
+
 # Cargar datos
-def cargar_datos(archivo):
-    """Carga datos desde archivo JSONL"""
+def iterar_registros(archivo):
+    """Itera los registros de un archivo JSONL sin cargarlo completo en memoria"""
     if not os.path.exists(archivo):
         raise FileNotFoundError(f"No se encontró el archivo: {archivo}")
 
-    with open(archivo, 'r', encoding='utf-8') as f:
-        return [json.loads(line) for line in f]
+    with open(archivo, 'r', encoding='utf-8') as f:
+        for numero, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                # Solo la última línea puede estar incompleta (auditoría aún escribiendo o cortada)
+                if line.endswith('\n'):
+                    raise ValueError(f"Línea {numero} inválida en {archivo}")
+                print(f"[ADVERTENCIA] Se ignora la última línea incompleta de {archivo}")
+
+
+class FuenteRegistros:
+    """
+    Registros de uno o varios archivos JSONL (ej: todos los diarios de una semana o un mes).
+    Se puede recorrer varias veces: cada recorrido vuelve a leer los archivos en streaming.
+    """
+    def __init__(self, archivos):
+        self.archivos = list(archivos)
+        for archivo in self.archivos:
+            if not os.path.exists(archivo):
+                raise FileNotFoundError(f"No se encontró el archivo: {archivo}")
+
+    def __iter__(self):
+        for archivo in self.archivos:
+            yield from iterar_registros(archivo)
+
+
+def cargar_datos(archivo):
+    """Carga datos desde archivo JSONL"""
+    return list(iterar_registros(archivo))
+
+# Análisis de datos mejorado
+ORGANIZACIONES_GUIAS = ['WHO', 'AHA', 'NICE', 'ERC', 'ACEP', 'ASCRS', 'ACS']
+
+
+def es_cumplimiento(valor):
+    return valor.lower() in ['sí', 'si', 'yes']
+
+
+class AcumuladorAnalisis:
+    """
+    Calcula todas las métricas del reporte en una sola pasada sobre los registros.
+    La memoria no depende del número de atenciones: por médico se guardan contadores
+    y extremos, no la lista de atenciones.
+    """
+    def __init__(self):
+        self.total = 0
+        self.suma_scores = 0
+        self.cumplen = 0
+        self.score_max = None
+        self.score_min = None
+        self.fecha_min = None
+        self.fecha_max = None
+        self.medicos = {}
+        self.guias = Counter()
+        self.hallazgos = Counter()
+        self.recomendaciones = Counter()
+        self.pacientes = set()
+        self.distribucion_scores = {'excelente': 0, 'bueno': 0, 'regular': 0, 'deficiente': 0}
+
+    def agregar(self, d):
+        score = d['score_calidad']
+        cumple = es_cumplimiento(d['cumple_guias'])
+
+        self.total += 1
+        self.suma_scores += score
+        self.cumplen += cumple
+        self.score_max = score if self.score_max is None else max(self.score_max, score)
+        self.score_min = score if self.score_min is None else min(self.score_min, score)
+
+        fecha = datetime.strptime(d['fecha_atencion'], '%Y-%m-%d %H:%M:%S')
+        self.fecha_min = fecha if self.fecha_min is None else min(self.fecha_min, fecha)
+        self.fecha_max = fecha if self.fecha_max is None else max(self.fecha_max, fecha)
+
+        # Por médico
+        medico = self.medicos.get(d['id_medico'])
+        if medico is None:
+            medico = self.medicos[d['id_medico']] = {
+                'nombre': d['nombre_medico'],
+                'num_atenciones': 0,
+                'suma_scores': 0,
+                'score_min': score,
+                'score_max': score,
+                'cumplen': 0
+            }
+        medico['num_atenciones'] += 1
+        medico['suma_scores'] += score
+        medico['score_min'] = min(medico['score_min'], score)
+        medico['score_max'] = max(medico['score_max'], score)
+        medico['cumplen'] += cumple
+
+        self.guias.update(d['guias_aplicables'])
+        self.hallazgos.update(d['hallazgos_criticos'])
+        self.recomendaciones.update(d['recomendaciones'])
+        self.pacientes.add(d['id_persona_paciente'])
+
+        # Distribución de scores
+        if score >= 80:
+            self.distribucion_scores['excelente'] += 1
+        elif score >= 60:
+            self.distribucion_scores['bueno'] += 1
+        elif score >= 40:
+            self.distribucion_scores['regular'] += 1
+        else:
+            self.distribucion_scores['deficiente'] += 1
+
+    def resultado(self):
+        if not self.total:
+            raise ValueError("No hay datos para analizar")
+
+        for medico in self.medicos.values():
+            medico['score_promedio'] = medico['suma_scores'] / medico['num_atenciones']
+            medico['porcentaje_cumplimiento'] = medico['cumplen'] / medico['num_atenciones'] * 100
+
+        # Contadores de guías por organización
+        guias_por_org = {org: 0 for org in ORGANIZACIONES_GUIAS}
+        guias_por_org['Otras'] = 0
+        for guia, cantidad in self.guias.items():
+            guia_upper = guia.upper()
+            encontradas = [org for org in ORGANIZACIONES_GUIAS if org in guia_upper]
+            for org in encontradas:
+                guias_por_org[org] += cantidad
+            if not encontradas:
+                guias_por_org['Otras'] += cantidad
+
+        return {
+            'total': self.total,
+            'score_promedio': self.suma_scores / self.total,
+            'cumplen': self.cumplen,
+            'medicos': self.medicos,
+            'guias': self.guias,
+            'guias_por_org': guias_por_org,
+            'hallazgos': self.hallazgos,
+            'recomendaciones': self.recomendaciones,
+            'score_max': self.score_max,
+            'score_min': self.score_min,
+            'pacientes_unicos': len(self.pacientes),
+            'distribucion_scores': self.distribucion_scores,
+            'fecha_min': self.fecha_min,
+            'fecha_max': self.fecha_max
+        }
+
+
+def analizar_datos(data):
+    """Analiza los datos de auditorías de urgencia en una sola pasada (acepta cualquier iterable)"""
+    acumulador = AcumuladorAnalisis()
+    for d in data:
+        acumulador.agregar(d)
+    return acumulador.resultado()
+
+# Helper para generar botones de filtro
+def generar_botones_filtro(analisis):
+    """Genera HTML de botones de filtrado por médico"""
+    total = analisis['total']
+    medicos = analisis['medicos']
+
+    html = Fragmentos()
+    html += f'            <button class="btn-filtro active" data-medico-id="todos" onclick="filtrarPorMedico(\'todos\')">📊 TODOS ({total})</button>\n'
+
+    # Ordenar médicos por nombre
+    medicos_ordenados = sorted(medicos.items(), key=lambda x: x[1]['nombre'])
+
+    for medico_id, info in medicos_ordenados:
+        nombre = info['nombre']
+        count = info['num_atenciones']
+        html += f'            <button class="btn-filtro" data-medico-id="{medico_id}" onclick="filtrarPorMedico(\'{medico_id}\')">👨‍⚕️ {nombre} ({count})</button>\n'
+
+    return html.render()
+
+# Fragmentos por atención (modo completo: renderizados en el servidor)
+def renderizar_filas_resumen(data):
+    """Filas de la tabla resumen, una por atención"""
+    html = Fragmentos()
+    for atencion in data:
+        score = atencion['score_calidad']
+
+        # Badge de score
+        if score >= 80:
+            badge_class = "score-excelente"
+        elif score >= 60:
+            badge_class = "score-bueno"
+        elif score >= 40:
+            badge_class = "score-regular"
+        else:
+            badge_class = "score-deficiente"
+
+        # Guías - TODAS las guías sin cortar
+        guias_texto = ""
+        if atencion['guias_aplicables']:
+            guias_list = []
+            for g in atencion['guias_aplicables']:
+                # Extraer solo el nombre de la organización (ej: "WHO - xxx" -> "WHO")
+                org = g.split(' - ')[0] if ' - ' in g else g.split(':')[0] if ':' in g else g[:30]
+                guias_list.append(f"• {org}")
+            guias_texto = "<br>".join(guias_list)
+        else:
+            guias_texto = "<em>No especificado</em>"
+
+        # Resumen de atención COMPLETO - sin cortar y sin "Dx:"
+        resumen_atencion = atencion.get('comentarios_adicionales', atencion['diagnostico_urgencia'])
+        if not resumen_atencion or resumen_atencion.strip() == "":
+            resumen_atencion = atencion['diagnostico_urgencia']
+
+        # Formatear cuenta (Gestión/Internación)
+        cuenta_formato = f"{atencion.get('cuenta_gestion', 'N/A')}/{atencion.get('cuenta_internacion', 'N/A')}"
+
+        # Nombre del paciente
+        nombre_paciente = atencion.get('nombre_paciente', 'No especificado')
+
+        html += f"""
+                    <tr data-medico-id="{atencion['id_medico']}" data-medico-nombre="{atencion['nombre_medico']}">
+                        <td style="font-size: 0.8em;">{atencion['fecha_atencion'].split(' ')[0]}<br><span style="color: #64748b;">{atencion['fecha_atencion'].split(' ')[1] if len(atencion['fecha_atencion'].split(' ')) > 1 else ''}</span></td>
+                        <td style="text-align: center; font-weight: 600; color: #1e40af; font-size: 0.85em;">{atencion['id_evolucion']}</td>
+                        <td style="font-size: 0.8em; font-weight: 500; color: #1e40af;">{cuenta_formato}</td>
+                        <td style="font-size: 0.8em;">{nombre_paciente}</td>
+                        <td style="font-size: 0.8em;">{atencion['nombre_medico']}</td>
+                        <td style="text-align: center;"><span class="score-badge {badge_class}" style="font-size: 0.8em; padding: 4px 10px;">{score}</span></td>
+                        <td style="font-size: 0.8em; line-height: 1.4;">{guias_texto}</td>
+                        <td style="font-size: 0.85em; line-height: 1.6;">{resumen_atencion}</td>
+                    </tr>
+"""
+
+    return html.render()
+
+
+def renderizar_tarjetas_detalle(data):
+    """Tarjetas de detalle, una por atención"""
+    html = Fragmentos()
+    for i, atencion in enumerate(data, 1):
+        score = atencion['score_calidad']
+
+        # Badge y color según score
+        if score >= 80:
+            badge_class = "score-excelente"
+            progress_color = "#10b981"
+        elif score >= 60:
+            badge_class = "score-bueno"
+            progress_color = "#3b82f6"
+        elif score >= 40:
+            badge_class = "score-regular"
+            progress_color = "#f59e0b"
+        else:
+            badge_class = "score-deficiente"
+            progress_color = "#ef4444"
+
+        cuenta_formato = f"{atencion.get('cuenta_gestion', 'N/A')}/{atencion.get('cuenta_internacion', 'N/A')}"
+        nombre_paciente = atencion.get('nombre_paciente', 'No especificado')
+
+        html += f"""
+            <div class="atencion-card" data-medico-id="{atencion['id_medico']}">
+                <div class="atencion-header">
+                    <div>
+                        <h3 style="margin: 0; color: #1e40af;">Caso #{i} - {atencion['nombre_medico']}</h3>
+                        <div class="atencion-meta">
+                            📅 {atencion['fecha_atencion']} |
+                            👤 Paciente: {nombre_paciente} |
+                            🏥 Cuenta: {cuenta_formato} |
+                            📋 Evolución: {atencion['id_evolucion']}
+                        </div>
+                    </div>
+                    <div>
+                        <span class="score-badge {badge_class}" style="font-size: 1.2em;">{score} pts</span>
+                    </div>
+                </div>
+
+                <div style="margin: 15px 0;">
+                    <strong style="color: #1e40af;">Diagnóstico:</strong> {atencion['diagnostico_urgencia']}
+                </div>
+
+                <div style="margin: 15px 0;">
+                    <strong style="color: #64748b; font-size: 0.9em;">Progreso de Calidad:</strong>
+                    <div class="progress-bar">
+                        <div class="progress-fill" style="width: {score}%; background: {progress_color};"></div>
+                    </div>
+                </div>
+
+                <div style="margin: 20px 0;">
+                    <h4 style="color: #1e40af; margin-bottom: 10px;">📚 Guías Aplicables</h4>
+                    <ul style="margin-left: 25px; color: #475569;">
+"""
+
+        html += items_lista(atencion['guias_aplicables'], sangria=24)
+
+        html += """
+                    </ul>
+                </div>
+
+                <div class="criterios-grid">
+                    <div class="criterios-columna criterios-cumplidos">
+                        <h4>✅ Criterios Cumplidos</h4>
+                        <ul>
+"""
+
+        html += items_lista(
+            atencion['criterios_cumplidos'], sangria=28, vacio="<em>No se registraron criterios cumplidos</em>"
+        )
+
+        html += """
+                        </ul>
+                    </div>
+
+                    <div class="criterios-columna criterios-no-cumplidos">
+                        <h4>❌ Criterios No Cumplidos</h4>
+                        <ul>
+"""
+
+        html += items_lista(
+            atencion['criterios_no_cumplidos'], sangria=28, vacio="<em>Todos los criterios fueron cumplidos</em>"
+        )
+
+        html += """
+                        </ul>
+                    </div>
+                </div>
+
+                <div style="margin: 20px 0;">
+                    <h4 style="color: #1e40af; margin-bottom: 10px;">🔍 Evaluaciones Específicas</h4>
+
+                    <div style="display: grid; grid-template-columns: 1fr 1fr; gap: 15px; margin-top: 10px;">
+"""
+
+        # Evaluación de tratamiento
+        tratamiento_icon = "✅" if "adecuado" in atencion.get('tratamiento_adecuado', '').lower() or "sí" in atencion.get('tratamiento_adecuado', '').lower() else "⚠️"
+        html += f"""
+                        <div style="padding: 12px; background: #f8fafc; border-radius: 6px; border-left: 3px solid #3b82f6;">
+                            <strong style="color: #64748b; font-size: 0.9em;">💊 Tratamiento:</strong><br>
+                            <span style="color: #1e293b;">{tratamiento_icon} {atencion.get('tratamiento_adecuado', 'No especificado')}</span>
+                        </div>
+"""
+
+        # Evaluación de tiempo
+        tiempo_icon = "✅" if "adecuado" in atencion.get('tiempo_atencion', '').lower() or "normal" in atencion.get('tiempo_atencion', '').lower() else "⚠️"
+        html += f"""
+                        <div style="padding: 12px; background: #f8fafc; border-radius: 6px; border-left: 3px solid #3b82f6;">
+                            <strong style="color: #64748b; font-size: 0.9em;">⏱️ Tiempo de Atención:</strong><br>
+                            <span style="color: #1e293b;">{tiempo_icon} {atencion.get('tiempo_atencion', 'No especificado')}</span>
+                        </div>
+"""
+
+        # Evaluación de estudios
+        estudios_icon = "✅" if "apropiado" in atencion.get('estudios_solicitados', '').lower() or "adecuado" in atencion.get('estudios_solicitados', '').lower() else "⚠️"
+        html += f"""
+                        <div style="padding: 12px; background: #f8fafc; border-radius: 6px; border-left: 3px solid #3b82f6;">
+                            <strong style="color: #64748b; font-size: 0.9em;">🔬 Estudios Solicitados:</strong><br>
+                            <span style="color: #1e293b;">{estudios_icon} {atencion.get('estudios_solicitados', 'No especificado')}</span>
+                        </div>
+"""
+
+        # Evaluación de medicación
+        medicacion_icon = "✅" if "apropiada" in atencion.get('medicacion_apropiada', '').lower() or "adecuada" in atencion.get('medicacion_apropiada', '').lower() else "⚠️"
+        html += f"""
+                        <div style="padding: 12px; background: #f8fafc; border-radius: 6px; border-left: 3px solid #3b82f6;">
+                            <strong style="color: #64748b; font-size: 0.9em;">💉 Medicación:</strong><br>
+                            <span style="color: #1e293b;">{medicacion_icon} {atencion.get('medicacion_apropiada', 'No especificado')}</span>
+                        </div>
+"""
+
+        html += """
+                    </div>
+                </div>
+"""
+
+        # Hallazgos críticos
+        if atencion.get('hallazgos_criticos') and len(atencion['hallazgos_criticos']) > 0:
+            html += """
+                <div class="info-box critico">
+                    <h4 style="margin-bottom: 10px; color: #991b1b;">🚨 Hallazgos Críticos</h4>
+                    <ul style="margin-left: 20px;">
+"""
+            html += items_lista(atencion['hallazgos_criticos'], sangria=24)
+
+            html += """
+                    </ul>
+                </div>
+"""
+
+        # Recomendaciones
+        if atencion.get('recomendaciones') and len(atencion['recomendaciones']) > 0:
+            html += """
+                <div class="info-box info">
+                    <h4 style="margin-bottom: 10px; color: #1e40af;">💡 Recomendaciones</h4>
+                    <ol style="margin-left: 25px;">
+"""
+            html += items_lista(atencion['recomendaciones'], sangria=24)
+
+            html += """
+                    </ol>
+                </div>
+"""
+
+        # Comentarios adicionales
+        if atencion.get('comentarios_adicionales') and atencion['comentarios_adicionales'].strip():
+            html += f"""
+                <div style="margin-top: 15px; padding: 12px; background: #f1f5f9; border-radius: 6px; border-left: 3px solid #64748b;">
+                    <strong style="color: #64748b;">📝 Comentarios del Auditor:</strong><br>
+                    <span style="color: #475569; font-style: italic;">{atencion['comentarios_adicionales']}</span>
+                </div>
+"""
+
+        html += """
+            </div>
+"""
+
+    return html.render()
+
+# Modo cliente: datos embebidos como JSON compacto y renderizado paginado en el navegador
+MODOS_REPORTE = ("completo", "cliente")
+
+# Columnas del JSON compacto (cada atención es un arreglo en este orden)
+CAMPOS_MODO_CLIENTE = [
+    "id_medico", "fecha_atencion", "id_evolucion", "cuenta", "nombre_paciente", "score_calidad",
+    "diagnostico_urgencia", "guias_aplicables", "criterios_cumplidos", "criterios_no_cumplidos",
+    "tratamiento_adecuado", "tiempo_atencion", "estudios_solicitados", "medicacion_apropiada",
+    "hallazgos_criticos", "recomendaciones", "comentarios_adicionales"
+]
+
+
+def datos_compactos(data):
+    """
+    Serializa las atenciones como JSON compacto para embeber en el reporte: los nombres de campo
+    van una sola vez, cada atención es un arreglo y los nombres de médico van en un diccionario aparte.
+    Los '<' se escapan para que el contenido no pueda cerrar el <script> que lo contiene.
+    """
+    medicos = {}
+    filas = []
+    for atencion in data:
+        medicos.setdefault(str(atencion['id_medico']), atencion['nombre_medico'])
+        filas.append(json.dumps([
+            str(atencion['id_medico']),
+            atencion['fecha_atencion'],
+            atencion['id_evolucion'],
+            f"{atencion.get('cuenta_gestion', 'N/A')}/{atencion.get('cuenta_internacion', 'N/A')}",
+            atencion.get('nombre_paciente', 'No especificado'),
+            atencion['score_calidad'],
+            atencion['diagnostico_urgencia'],
+            atencion['guias_aplicables'],
+            atencion['criterios_cumplidos'],
+            atencion['criterios_no_cumplidos'],
+            atencion.get('tratamiento_adecuado', 'No especificado'),
+            atencion.get('tiempo_atencion', 'No especificado'),
+            atencion.get('estudios_solicitados', 'No especificado'),
+            atencion.get('medicacion_apropiada', 'No especificado'),
+            atencion.get('hallazgos_criticos') or [],
+            atencion.get('recomendaciones') or [],
+            atencion.get('comentarios_adicionales') or ""
+        ], ensure_ascii=False, separators=(',', ':')))
+
+    encabezado = json.dumps({"campos": CAMPOS_MODO_CLIENTE, "medicos": medicos}, ensure_ascii=False, separators=(',', ':'))
+    return f'{encabezado[:-1]},"filas":[{",".join(filas)}]}}'.replace("<", "\\u003c")
+
+
+ESTILOS_MODO_CLIENTE = """
+        .paginacion {
+            display: flex;
+            justify-content: center;
+            align-items: center;
+            gap: 12px;
+            margin-top: 15px;
+            color: #475569;
+            font-size: 0.9em;
+        }
+
+        .paginacion:empty {
+            display: none;
+        }
+
+        .btn-pagina {
+            background: white;
+            border: 1px solid #cbd5e1;
+            border-radius: 6px;
+            padding: 6px 14px;
+            color: #1e40af;
+            cursor: pointer;
+        }
+
+        .btn-pagina:disabled {
+            color: #cbd5e1;
+            cursor: default;
+        }
+"""
+
+SCRIPT_MODO_CLIENTE = r"""
+    const DATOS = JSON.parse(document.getElementById('datos-auditoria').textContent);
+    const CAMPO = Object.fromEntries(DATOS.campos.map((campo, i) => [campo, i]));
+    const ATENCIONES = DATOS.filas.map((fila, i) => ({ fila: fila, caso: i + 1 }));
+    const FILAS_POR_PAGINA = 100;
+    const TARJETAS_POR_PAGINA = 25;
+    const COLOR_SCORE = {
+        'score-excelente': '#10b981', 'score-bueno': '#3b82f6',
+        'score-regular': '#f59e0b', 'score-deficiente': '#ef4444'
+    };
+
+    let seleccion = ATENCIONES;
+    const paginas = { tabla: 1, detalle: 1 };
+
+    function esc(valor) {
+        return String(valor ?? '').replace(/[&<>"']/g, c => (
+            { '&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&#39;' }[c]
+        ));
+    }
+
+    function campo(atencion, nombre) {
+        return atencion.fila[CAMPO[nombre]];
+    }
+
+    function claseScore(score) {
+        if (score >= 80) return 'score-excelente';
+        if (score >= 60) return 'score-bueno';
+        if (score >= 40) return 'score-regular';
+        return 'score-deficiente';
+    }
+
+    function organizacion(guia) {
+        // Solo el nombre de la organización (ej: "WHO - xxx" -> "WHO")
+        if (guia.includes(' - ')) return guia.split(' - ')[0];
+        if (guia.includes(':')) return guia.split(':')[0];
+        return guia.slice(0, 30);
+    }
+
+    function items(lista, vacio) {
+        if (!lista.length && vacio) return `<li>${vacio}</li>`;
+        return lista.map(item => `<li>${esc(item)}</li>`).join('');
+    }
+
+    function icono(texto, claves) {
+        const t = String(texto).toLowerCase();
+        return claves.some(clave => t.includes(clave)) ? '✅' : '⚠️';
+    }
+
+    function evaluacion(titulo, texto, claves) {
+        return `
+                        <div style="padding: 12px; background: #f8fafc; border-radius: 6px; border-left: 3px solid #3b82f6;">
+                            <strong style="color: #64748b; font-size: 0.9em;">${titulo}</strong><br>
+                            <span style="color: #1e293b;">${icono(texto, claves)} ${esc(texto)}</span>
+                        </div>`;
+    }
+
+    function renderFila(atencion) {
+        const score = campo(atencion, 'score_calidad');
+        const fecha = String(campo(atencion, 'fecha_atencion')).split(' ');
+        const guias = campo(atencion, 'guias_aplicables');
+        const guiasTexto = guias.length
+            ? guias.map(guia => `• ${esc(organizacion(guia))}`).join('<br>')
+            : '<em>No especificado</em>';
+        const comentarios = campo(atencion, 'comentarios_adicionales');
+        const resumen = comentarios.trim() ? comentarios : campo(atencion, 'diagnostico_urgencia');
+        const medico = DATOS.medicos[campo(atencion, 'id_medico')];
+        return `
+                    <tr>
+                        <td style="font-size: 0.8em;">${esc(fecha[0])}<br><span style="color: #64748b;">${esc(fecha[1] || '')}</span></td>
+                        <td style="text-align: center; font-weight: 600; color: #1e40af; font-size: 0.85em;">${esc(campo(atencion, 'id_evolucion'))}</td>
+                        <td style="font-size: 0.8em; font-weight: 500; color: #1e40af;">${esc(campo(atencion, 'cuenta'))}</td>
+                        <td style="font-size: 0.8em;">${esc(campo(atencion, 'nombre_paciente'))}</td>
+                        <td style="font-size: 0.8em;">${esc(medico)}</td>
+                        <td style="text-align: center;"><span class="score-badge ${claseScore(score)}" style="font-size: 0.8em; padding: 4px 10px;">${score}</span></td>
+                        <td style="font-size: 0.8em; line-height: 1.4;">${guiasTexto}</td>
+                        <td style="font-size: 0.85em; line-height: 1.6;">${esc(resumen)}</td>
+                    </tr>`;
+    }
+
+    function renderTarjeta(atencion) {
+        const score = campo(atencion, 'score_calidad');
+        const clase = claseScore(score);
+        const hallazgos = campo(atencion, 'hallazgos_criticos');
+        const recomendaciones = campo(atencion, 'recomendaciones');
+        const comentarios = campo(atencion, 'comentarios_adicionales');
+        let html = `
+            <div class="atencion-card">
+                <div class="atencion-header">
+                    <div>
+                        <h3 style="margin: 0; color: #1e40af;">Caso #${atencion.caso} - ${esc(DATOS.medicos[campo(atencion, 'id_medico')])}</h3>
+                        <div class="atencion-meta">
+                            📅 ${esc(campo(atencion, 'fecha_atencion'))} |
+                            👤 Paciente: ${esc(campo(atencion, 'nombre_paciente'))} |
+                            🏥 Cuenta: ${esc(campo(atencion, 'cuenta'))} |
+                            📋 Evolución: ${esc(campo(atencion, 'id_evolucion'))}
+                        </div>
+                    </div>
+                    <div>
+                        <span class="score-badge ${clase}" style="font-size: 1.2em;">${score} pts</span>
+                    </div>
+                </div>
+
+                <div style="margin: 15px 0;">
+                    <strong style="color: #1e40af;">Diagnóstico:</strong> ${esc(campo(atencion, 'diagnostico_urgencia'))}
+                </div>
+
+                <div style="margin: 15px 0;">
+                    <strong style="color: #64748b; font-size: 0.9em;">Progreso de Calidad:</strong>
+                    <div class="progress-bar">
+                        <div class="progress-fill" style="width: ${score}%; background: ${COLOR_SCORE[clase]};"></div>
+                    </div>
+                </div>
+
+                <div style="margin: 20px 0;">
+                    <h4 style="color: #1e40af; margin-bottom: 10px;">📚 Guías Aplicables</h4>
+                    <ul style="margin-left: 25px; color: #475569;">${items(campo(atencion, 'guias_aplicables'))}</ul>
+                </div>
+
+                <div class="criterios-grid">
+                    <div class="criterios-columna criterios-cumplidos">
+                        <h4>✅ Criterios Cumplidos</h4>
+                        <ul>${items(campo(atencion, 'criterios_cumplidos'), '<em>No se registraron criterios cumplidos</em>')}</ul>
+                    </div>
+
+                    <div class="criterios-columna criterios-no-cumplidos">
+                        <h4>❌ Criterios No Cumplidos</h4>
+                        <ul>${items(campo(atencion, 'criterios_no_cumplidos'), '<em>Todos los criterios fueron cumplidos</em>')}</ul>
+                    </div>
+                </div>
+
+                <div style="margin: 20px 0;">
+                    <h4 style="color: #1e40af; margin-bottom: 10px;">🔍 Evaluaciones Específicas</h4>
+
+                    <div style="display: grid; grid-template-columns: 1fr 1fr; gap: 15px; margin-top: 10px;">
+                        ${evaluacion('💊 Tratamiento:', campo(atencion, 'tratamiento_adecuado'), ['adecuado', 'sí'])}
+                        ${evaluacion('⏱️ Tiempo de Atención:', campo(atencion, 'tiempo_atencion'), ['adecuado', 'normal'])}
+                        ${evaluacion('🔬 Estudios Solicitados:', campo(atencion, 'estudios_solicitados'), ['apropiado', 'adecuado'])}
+                        ${evaluacion('💉 Medicación:', campo(atencion, 'medicacion_apropiada'), ['apropiada', 'adecuada'])}
+                    </div>
+                </div>`;
+
+        if (hallazgos.length) {
+            html += `
+                <div class="info-box critico">
+                    <h4 style="margin-bottom: 10px; color: #991b1b;">🚨 Hallazgos Críticos</h4>
+                    <ul style="margin-left: 20px;">${items(hallazgos)}</ul>
+                </div>`;
+        }
+        if (recomendaciones.length) {
+            html += `
+                <div class="info-box info">
+                    <h4 style="margin-bottom: 10px; color: #1e40af;">💡 Recomendaciones</h4>
+                    <ol style="margin-left: 25px;">${items(recomendaciones)}</ol>
+                </div>`;
+        }
+        if (comentarios.trim()) {
+            html += `
+                <div style="margin-top: 15px; padding: 12px; background: #f1f5f9; border-radius: 6px; border-left: 3px solid #64748b;">
+                    <strong style="color: #64748b;">📝 Comentarios del Auditor:</strong><br>
+                    <span style="color: #475569; font-style: italic;">${esc(comentarios)}</span>
+                </div>`;
+        }
+        return html + `
+            </div>`;
+    }
+
+    function renderPaginacion(seccion, pagina, porPagina) {
+        const total = seleccion.length;
+        const totalPaginas = Math.ceil(total / porPagina);
+        if (totalPaginas <= 1) return '';
+        const desde = (pagina - 1) * porPagina + 1;
+        const hasta = Math.min(total, pagina * porPagina);
+        return `
+            <button class="btn-pagina" onclick="irAPagina('${seccion}', ${pagina - 1})" ${pagina === 1 ? 'disabled' : ''}>← Anterior</button>
+            <span>Atenciones ${desde}-${hasta} de ${total} (página ${pagina} de ${totalPaginas})</span>
+            <button class="btn-pagina" onclick="irAPagina('${seccion}', ${pagina + 1})" ${pagina === totalPaginas ? 'disabled' : ''}>Siguiente →</button>`;
+    }
+
+    function renderPagina(seccion) {
+        // Solo se construye el DOM de la página visible: el costo no depende del total de atenciones
+        const [porPagina, contenedor, render] = seccion === 'tabla'
+            ? [FILAS_POR_PAGINA, 'tabla-atenciones', renderFila]
+            : [TARJETAS_POR_PAGINA, 'detalle-atenciones', renderTarjeta];
+        const inicio = (paginas[seccion] - 1) * porPagina;
+        document.getElementById(contenedor).innerHTML =
+            seleccion.slice(inicio, inicio + porPagina).map(render).join('');
+        document.getElementById(`paginacion-${seccion}`).innerHTML =
+            renderPaginacion(seccion, paginas[seccion], porPagina);
+    }
+
+    function irAPagina(seccion, pagina) {
+        paginas[seccion] = pagina;
+        renderPagina(seccion);
+        document.getElementById(seccion === 'tabla' ? 'filtros-tabla' : 'filtros-detalle').scrollIntoView();
+    }
+
+    function renderTop10(contenedor, nombreCampo, encabezado, colorIndice, sinDatos) {
+        const conteo = new Map();
+        ATENCIONES.forEach(atencion => campo(atencion, nombreCampo).forEach(item => {
+            conteo.set(item, (conteo.get(item) || 0) + 1);
+        }));
+        const total = [...conteo.values()].reduce((a, b) => a + b, 0);
+        const top = [...conteo.entries()].sort((a, b) => b[1] - a[1]).slice(0, 10);
+        if (!top.length) {
+            document.getElementById(contenedor).innerHTML = sinDatos;
+            return;
+        }
+        const filas = top.map(([item, cantidad], i) => `
+                    <tr>
+                        <td style="text-align: center; font-weight: 600; color: ${colorIndice};">${i + 1}</td>
+                        <td>${esc(item)}</td>
+                        <td style="text-align: center; font-weight: 600; color: #1e40af;">${cantidad}</td>
+                        <td style="text-align: center;">${(cantidad / total * 100).toFixed(1)}%</td>
+                    </tr>`).join('');
+        document.getElementById(contenedor).innerHTML = `
+            <table>
+                <thead>
+                    <tr>
+                        <th style="width: 10%; text-align: center;">#</th>
+                        <th style="width: 60%;">${encabezado}</th>
+                        <th style="width: 15%; text-align: center;">Frecuencia</th>
+                        <th style="width: 15%; text-align: center;">% del Total</th>
+                    </tr>
+                </thead>
+                <tbody>${filas}
+                </tbody>
+            </table>`;
+    }
+
+    function filtrarPorMedico(medicoId) {
+        // Actualizar todos los botones (ambos sets)
+        document.querySelectorAll('.btn-filtro').forEach(btn => {
+            btn.classList.toggle('active', btn.dataset.medicoId === medicoId);
+        });
+
+        // Filtrar sobre los datos y volver a la primera página de cada sección
+        seleccion = medicoId === 'todos'
+            ? ATENCIONES
+            : ATENCIONES.filter(atencion => campo(atencion, 'id_medico') === medicoId);
+        paginas.tabla = 1;
+        paginas.detalle = 1;
+        renderPagina('tabla');
+        renderPagina('detalle');
+    }
+
+    renderPagina('tabla');
+    renderPagina('detalle');
+    renderTop10('top-hallazgos', 'hallazgos_criticos', 'Hallazgo Crítico', '#dc2626', `
+            <div class="info-box exito">
+                <strong>✅ Excelente:</strong> No se identificaron hallazgos críticos durante el período auditado.
+            </div>`);
+    renderTop10('top-recomendaciones', 'recomendaciones', 'Recomendación', '#3b82f6', `
+            <div class="info-box info">
+                <strong>Nota:</strong> No se registraron recomendaciones específicas durante el período auditado.
+            </div>`);
+"""
+
+
+def renderizar_atenciones(data, analisis, modo):
+    """Secciones por atención: tabla resumen y tarjetas de detalle, con sus botones de filtro"""
+    html = Fragmentos()
+
+    # TABLA RESUMEN DE ATENCIONES
+    html += """
+        <!-- TABLA RESUMEN DE ATENCIONES -->
+        <div class="seccion">
+            <h2>📋 Resumen Ejecutivo de Atenciones</h2>
+
+            <p style="margin-bottom: 15px; color: #475569; font-size: 0.95em;">
+                Vista consolidada de todas las atenciones evaluadas. Use los filtros para ver casos específicos por médico.
+            </p>
 
-# Análisis de datos mejorado
-def analizar_datos(data):
-    """Analiza los datos de auditorías de urgencia con mayor detalle"""
-    if not data:
-        raise ValueError("No hay datos para analizar")
+            <!-- BOTONES DE FILTRO - SET 1 -->
+            <div id="filtros-tabla" class="filtros-medicos">
+"""
 
-    total = len(data)
-    score_promedio = sum(d['score_calidad'] for d in data) / total
-    cumplen = sum(1 for d in data if d['cumple_guias'].lower() in ['sí', 'si', 'yes'])
+    # Insertar botones del Set 1
+    html += generar_botones_filtro(analisis)
 
-    # Por médico
-    medicos = {}
-    for d in data:
-        medico_id = d['id_medico']
-        if medico_id not in medicos:
-            medicos[medico_id] = {
-                'nombre': d['nombre_medico'],
-                'atenciones': [],
-                'scores': [],
-                'cumplimientos': [],
-                'diagnosticos': [],
-                'guias_usadas': [],
-                'hallazgos_criticos_total': [],
-                'recomendaciones_total': []
-            }
+    html += """
+            </div>
+            <!-- FIN BOTONES -->
 
-        medicos[medico_id]['atenciones'].append(d)
-        medicos[medico_id]['scores'].append(d['score_calidad'])
-        medicos[medico_id]['cumplimientos'].append(d['cumple_guias'])
-        medicos[medico_id]['diagnosticos'].append(d['diagnostico_urgencia'])
-        medicos[medico_id]['guias_usadas'].extend(d['guias_aplicables'])
-        medicos[medico_id]['hallazgos_criticos_total'].extend(d['hallazgos_criticos'])
-        medicos[medico_id]['recomendaciones_total'].extend(d['recomendaciones'])
+            <div class="tabla-scroll">
+                <table>
+                    <thead>
+                        <tr>
+                            <th style="width: 100px;">Fecha</th>
+                            <th style="width: 80px;">ID</th>
+                            <th style="width: 100px;">Cuenta</th>
+                            <th style="width: 150px;">Paciente</th>
+                            <th style="width: 200px;">Médico</th>
+                            <th style="width: 80px; text-align: center;">Score</th>
+                            <th style="width: 180px;">Guías Aplicadas</th>
+                            <th style="width: auto;">Resumen de Atención</th>
+                        </tr>
+                    </thead>
+"""
 
-    # Guías clínicas utilizadas
-    todas_guias = []
-    for d in data:
-        todas_guias.extend(d['guias_aplicables'])
-
-    # Contadores de guías por organización
-    guias_counter = Counter(todas_guias)
-    guias_por_org = {
-        'WHO': sum(v for k, v in guias_counter.items() if 'WHO' in k.upper()),
-        'AHA': sum(v for k, v in guias_counter.items() if 'AHA' in k.upper()),
-        'NICE': sum(v for k, v in guias_counter.items() if 'NICE' in k.upper()),
-        'ERC': sum(v for k, v in guias_counter.items() if 'ERC' in k.upper()),
-        'ACEP': sum(v for k, v in guias_counter.items() if 'ACEP' in k.upper()),
-        'ASCRS': sum(v for k, v in guias_counter.items() if 'ASCRS' in k.upper()),
-        'ACS': sum(v for k, v in guias_counter.items() if 'ACS' in k.upper()),
-        'Otras': sum(v for k, v in guias_counter.items()
-                    if not any(org in k.upper() for org in ['WHO', 'AHA', 'NICE', 'ERC', 'ACEP', 'ASCRS', 'ACS']))
-    }
+    if modo == "cliente":
+        # Las filas se renderizan en el navegador, una página a la vez
+        html += '                    <tbody id="tabla-atenciones">\n'
+    else:
+        html += "                    <tbody>\n"
+        html += renderizar_filas_resumen(data)
 
-    # Tratamientos y hallazgos
-    todos_hallazgos = []
-    todas_recomendaciones = []
-    for d in data:
-        todos_hallazgos.extend(d['hallazgos_criticos'])
-        todas_recomendaciones.extend(d['recomendaciones'])
-
-    # Distribución de scores
-    distribucion_scores = {
-        'excelente': sum(1 for d in data if d['score_calidad'] >= 80),
-        'bueno': sum(1 for d in data if 60 <= d['score_calidad'] < 80),
-        'regular': sum(1 for d in data if 40 <= d['score_calidad'] < 60),
-        'deficiente': sum(1 for d in data if d['score_calidad'] < 40)
-    }
+    html += """
+                </tbody>
+                </table>
+            </div>
+"""
+    if modo == "cliente":
+        html += '            <div class="paginacion" id="paginacion-tabla"></div>\n'
 
-    return {
-        'total': total,
-        'score_promedio': score_promedio,
-        'cumplen': cumplen,
-        'medicos': medicos,
-        'guias': guias_counter,
-        'guias_por_org': guias_por_org,
-        'hallazgos': Counter(todos_hallazgos),
-        'recomendaciones': Counter(todas_recomendaciones),
-        'score_max': max(d['score_calidad'] for d in data),
-        'score_min': min(d['score_calidad'] for d in data),
-        'pacientes_unicos': len(set(d['id_persona_paciente'] for d in data)),
-        'distribucion_scores': distribucion_scores
-    }
+    html += """        </div>
+"""
 
-# Helper para generar botones de filtro
-def generar_botones_filtro(analisis):
-    """Genera HTML de botones de filtrado por médico"""
-    total = analisis['total']
-    medicos = analisis['medicos']
+    # DETALLE DE ATENCIONES
+    html += """
+        <!-- DETALLE DE ATENCIONES -->
+        <div class="seccion">
+            <h2>📄 Detalle de Atenciones Auditadas</h2>
 
-    html = f'            <button class="btn-filtro active" data-medico-id="todos" onclick="filtrarPorMedico(\'todos\')">📊 TODOS ({total})</button>\n'
+            <p style="margin-bottom: 20px; color: #475569; font-size: 1.05em;">
+                Revisión detallada de cada caso. Use los filtros para enfocarse en un médico específico.
+            </p>
 
-    # Ordenar médicos por nombre
-    medicos_ordenados = sorted(medicos.items(), key=lambda x: x[1]['nombre'])
+            <!-- BOTONES DE FILTRO - SET 2 -->
+            <div id="filtros-detalle" class="filtros-medicos">
+"""
 
-    for medico_id, info in medicos_ordenados:
-        nombre = info['nombre']
-        count = len(info['atenciones'])
-        html += f'            <button class="btn-filtro" data-medico-id="{medico_id}" onclick="filtrarPorMedico(\'{medico_id}\')">👨‍⚕️ {nombre} ({count})</button>\n'
+    # Insertar botones del Set 2
+    html += generar_botones_filtro(analisis)
+
+    html += """
+            </div>
+            <!-- FIN BOTONES -->
+"""
+
+    if modo == "cliente":
+        html += """
+            <div id="detalle-atenciones"></div>
+            <div class="paginacion" id="paginacion-detalle"></div>
+"""
+    else:
+        html += renderizar_tarjetas_detalle(data)
+
+    html += """
+        </div>
+"""
+
+    return html.render()
 
-    return html
 
 # Generar HTML mejorado
-def generar_html(data, analisis, archivo_salida):
+def generar_html(data, analisis, archivo_salida, modo="completo"):
     """Genera el reporte HTML de auditoría de emergencia - Versión Ejecutiva"""
+    return renderizar_html(data, analisis, modo).render()
+
+
+def renderizar_html(data, analisis, modo="completo", enlaces_medicos=None):
+    """
+    Arma el reporte como fragmentos (se unen una sola vez o se escriben directo al archivo).
+
+    modo="completo": todas las filas y tarjetas se emiten como HTML (archivo autocontenido y estático).
+    modo="cliente": los datos se embeben una sola vez como JSON compacto y el navegador renderiza
+    filas, tarjetas y top 10 página por página (el DOM es constante; el archivo sigue creciendo
+    con el número de atenciones, aunque ~15 veces menos que en modo completo).
+
+    Con `enlaces_medicos` ({id_medico: archivo}) se arma la página índice de los reportes por médico:
+    solo KPIs y análisis globales (no usa `data`), con cada médico enlazado a su página.
+    """
+    if modo not in MODOS_REPORTE:
+        raise ValueError(f"Modo de reporte desconocido: {modo} (opciones: {', '.join(MODOS_REPORTE)})")
+    if enlaces_medicos is not None:
+        # El índice se renderiza completo en el servidor: los top 10 salen del análisis global
+        modo = "completo"
 
     fecha_reporte = datetime.now().strftime("%d de %B de %Y")
 
-    # Calcular rango de fechas del periodo analizado
-    fechas = [datetime.strptime(d['fecha_atencion'], '%Y-%m-%d %H:%M:%S') for d in data]
-    fecha_min = min(fechas)
-    fecha_max = max(fechas)
+    # Rango de fechas del periodo analizado
+    fecha_min = analisis['fecha_min']
+    fecha_max = analisis['fecha_max']
 
     # Traducir mes al español
     meses = {
@@ -139,7 +895,8 @@ def generar_html(data, analisis, archivo_salida):
 
     periodo_texto = f"Del {fecha_min_str} al {fecha_max_str}"
 
-    html = f"""<!DOCTYPE html>
+    html = Fragmentos()
+    html += f"""<!DOCTYPE html>
 <html lang="es">
 <head>
     <meta charset="UTF-8">
@@ -639,7 +1396,12 @@ def generar_html(data, analisis, archivo_salida):
             color: #1e40af;
             border-bottom-color: #3b82f6;
         }}
-    </style>
+"""
+
+    if modo == "cliente":
+        html += ESTILOS_MODO_CLIENTE
+
+    html += """    </style>
 </head>
 <body>
     <div class="container">
@@ -802,397 +1564,102 @@ def generar_html(data, analisis, archivo_salida):
                     </tr>
                     <tr>
                         <td><strong>ACS</strong><br><span style="font-size: 0.85em; color: #64748b;">American College of Surgeons</span></td>
-                        <td>Colegio Americano de Cirujanos</td>
-                        <td>Trauma, Atención quirúrgica de emergencia, ATLS</td>
-                        <td style="text-align: center; font-weight: 600; color: #1e40af; font-size: 1.2em;">{referencias_acs}</td>
-                    </tr>
-"""
-
-    if referencias_otras > 0:
-        html += f"""
-                    <tr>
-                        <td><strong>Otras</strong></td>
-                        <td>Guías especializadas adicionales</td>
-                        <td>Áreas específicas según patología</td>
-                        <td style="text-align: center; font-weight: 600; color: #1e40af; font-size: 1.2em;">{referencias_otras}</td>
-                    </tr>
-"""
-
-    html += """
-                </tbody>
-            </table>
-
-            <div class="info-box info" style="margin-top: 20px;">
-                <strong>Nota Metodológica:</strong> La columna "Referencias" indica el número de veces que se aplicaron guías de cada organización
-                durante la evaluación. Una misma atención puede requerir múltiples guías según la complejidad del caso.
-            </div>
-        </div>
-"""
-
-    # ANÁLISIS POR MÉDICO
-    medicos_ordenados = sorted(
-        analisis['medicos'].items(),
-        key=lambda x: sum(x[1]['scores']) / len(x[1]['scores']),
-        reverse=True
-    )
-
-    html += """
-        <!-- ANÁLISIS POR MÉDICO -->
-        <div class="seccion">
-            <h2>👨‍⚕️ Análisis de Desempeño por Médico</h2>
-
-            <p style="margin-bottom: 20px; color: #475569; font-size: 1.05em;">
-                Evaluación comparativa del desempeño de cada profesional médico durante el período auditado.
-            </p>
-
-            <table>
-                <thead>
-                    <tr>
-                        <th>Médico</th>
-                        <th style="text-align: center;">Atenciones</th>
-                        <th style="text-align: center;">Score Promedio</th>
-                        <th style="text-align: center;">Score Min/Max</th>
-                        <th style="text-align: center;">% Cumplimiento</th>
-                    </tr>
-                </thead>
-                <tbody>
-"""
-
-    for medico_id, info in medicos_ordenados:
-        score_prom = sum(info['scores']) / len(info['scores'])
-        score_min = min(info['scores'])
-        score_max = max(info['scores'])
-        cumplimientos = sum(1 for c in info['cumplimientos'] if c.lower() in ['sí', 'si', 'yes'])
-        porcentaje_cump = (cumplimientos / len(info['cumplimientos']) * 100) if info['cumplimientos'] else 0
-
-        # Badge de score
-        if score_prom >= 80:
-            badge_class = "score-excelente"
-        elif score_prom >= 60:
-            badge_class = "score-bueno"
-        elif score_prom >= 40:
-            badge_class = "score-regular"
-        else:
-            badge_class = "score-deficiente"
-
-        html += f"""
-                    <tr>
-                        <td><strong>{info['nombre']}</strong></td>
-                        <td style="text-align: center;">{len(info['atenciones'])}</td>
-                        <td style="text-align: center;"><span class="score-badge {badge_class}">{score_prom:.1f}</span></td>
-                        <td style="text-align: center;">{score_min} - {score_max}</td>
-                        <td style="text-align: center;"><strong>{porcentaje_cump:.1f}%</strong></td>
-                    </tr>
-"""
-
-    html += """
-                </tbody>
-            </table>
-        </div>
-"""
-
-    # TABLA RESUMEN DE ATENCIONES
-    html += """
-        <!-- TABLA RESUMEN DE ATENCIONES -->
-        <div class="seccion">
-            <h2>📋 Resumen Ejecutivo de Atenciones</h2>
-
-            <p style="margin-bottom: 15px; color: #475569; font-size: 0.95em;">
-                Vista consolidada de todas las atenciones evaluadas. Use los filtros para ver casos específicos por médico.
-            </p>
-
-            <!-- BOTONES DE FILTRO - SET 1 -->
-            <div id="filtros-tabla" class="filtros-medicos">
-"""
-
-    # Insertar botones del Set 1
-    html += generar_botones_filtro(analisis)
-
-    html += """
-            </div>
-            <!-- FIN BOTONES -->
-
-            <div class="tabla-scroll">
-                <table>
-                    <thead>
-                        <tr>
-                            <th style="width: 100px;">Fecha</th>
-                            <th style="width: 80px;">ID</th>
-                            <th style="width: 100px;">Cuenta</th>
-                            <th style="width: 150px;">Paciente</th>
-                            <th style="width: 200px;">Médico</th>
-                            <th style="width: 80px; text-align: center;">Score</th>
-                            <th style="width: 180px;">Guías Aplicadas</th>
-                            <th style="width: auto;">Resumen de Atención</th>
-                        </tr>
-                    </thead>
-                    <tbody>
-"""
-
-    for atencion in data:
-        score = atencion['score_calidad']
-
-        # Badge de score
-        if score >= 80:
-            badge_class = "score-excelente"
-        elif score >= 60:
-            badge_class = "score-bueno"
-        elif score >= 40:
-            badge_class = "score-regular"
-        else:
-            badge_class = "score-deficiente"
-
-        # Guías - TODAS las guías sin cortar
-        guias_texto = ""
-        if atencion['guias_aplicables']:
-            guias_list = []
-            for g in atencion['guias_aplicables']:
-                # Extraer solo el nombre de la organización (ej: "WHO - xxx" -> "WHO")
-                org = g.split(' - ')[0] if ' - ' in g else g.split(':')[0] if ':' in g else g[:30]
-                guias_list.append(f"• {org}")
-            guias_texto = "<br>".join(guias_list)
-        else:
-            guias_texto = "<em>No especificado</em>"
-
-        # Resumen de atención COMPLETO - sin cortar y sin "Dx:"
-        resumen_atencion = atencion.get('comentarios_adicionales', atencion['diagnostico_urgencia'])
-        if not resumen_atencion or resumen_atencion.strip() == "":
-            resumen_atencion = atencion['diagnostico_urgencia']
-
-        # Formatear cuenta (Gestión/Internación)
-        cuenta_formato = f"{atencion.get('cuenta_gestion', 'N/A')}/{atencion.get('cuenta_internacion', 'N/A')}"
-
-        # Nombre del paciente
-        nombre_paciente = atencion.get('nombre_paciente', 'No especificado')
-
-        html += f"""
-                    <tr data-medico-id="{atencion['id_medico']}" data-medico-nombre="{atencion['nombre_medico']}">
-                        <td style="font-size: 0.8em;">{atencion['fecha_atencion'].split(' ')[0]}<br><span style="color: #64748b;">{atencion['fecha_atencion'].split(' ')[1] if len(atencion['fecha_atencion'].split(' ')) > 1 else ''}</span></td>
-                        <td style="text-align: center; font-weight: 600; color: #1e40af; font-size: 0.85em;">{atencion['id_evolucion']}</td>
-                        <td style="font-size: 0.8em; font-weight: 500; color: #1e40af;">{cuenta_formato}</td>
-                        <td style="font-size: 0.8em;">{nombre_paciente}</td>
-                        <td style="font-size: 0.8em;">{atencion['nombre_medico']}</td>
-                        <td style="text-align: center;"><span class="score-badge {badge_class}" style="font-size: 0.8em; padding: 4px 10px;">{score}</span></td>
-                        <td style="font-size: 0.8em; line-height: 1.4;">{guias_texto}</td>
-                        <td style="font-size: 0.85em; line-height: 1.6;">{resumen_atencion}</td>
+                        <td>Colegio Americano de Cirujanos</td>
+                        <td>Trauma, Atención quirúrgica de emergencia, ATLS</td>
+                        <td style="text-align: center; font-weight: 600; color: #1e40af; font-size: 1.2em;">{referencias_acs}</td>
+                    </tr>
+"""
+
+    if referencias_otras > 0:
+        html += f"""
+                    <tr>
+                        <td><strong>Otras</strong></td>
+                        <td>Guías especializadas adicionales</td>
+                        <td>Áreas específicas según patología</td>
+                        <td style="text-align: center; font-weight: 600; color: #1e40af; font-size: 1.2em;">{referencias_otras}</td>
                     </tr>
 """
 
     html += """
                 </tbody>
-                </table>
+            </table>
+
+            <div class="info-box info" style="margin-top: 20px;">
+                <strong>Nota Metodológica:</strong> La columna "Referencias" indica el número de veces que se aplicaron guías de cada organización
+                durante la evaluación. Una misma atención puede requerir múltiples guías según la complejidad del caso.
             </div>
         </div>
 """
 
-    # DETALLE DE ATENCIONES
+    # ANÁLISIS POR MÉDICO
+    medicos_ordenados = sorted(
+        analisis['medicos'].items(),
+        key=lambda x: x[1]['score_promedio'],
+        reverse=True
+    )
+
     html += """
-        <!-- DETALLE DE ATENCIONES -->
+        <!-- ANÁLISIS POR MÉDICO -->
         <div class="seccion">
-            <h2>📄 Detalle de Atenciones Auditadas</h2>
+            <h2>👨‍⚕️ Análisis de Desempeño por Médico</h2>
 
             <p style="margin-bottom: 20px; color: #475569; font-size: 1.05em;">
-                Revisión detallada de cada caso. Use los filtros para enfocarse en un médico específico.
+                Evaluación comparativa del desempeño de cada profesional médico durante el período auditado.
             </p>
 
-            <!-- BOTONES DE FILTRO - SET 2 -->
-            <div id="filtros-detalle" class="filtros-medicos">
-"""
-
-    # Insertar botones del Set 2
-    html += generar_botones_filtro(analisis)
-
-    html += """
-            </div>
-            <!-- FIN BOTONES -->
+            <table>
+                <thead>
+                    <tr>
+                        <th>Médico</th>
+                        <th style="text-align: center;">Atenciones</th>
+                        <th style="text-align: center;">Score Promedio</th>
+                        <th style="text-align: center;">Score Min/Max</th>
+                        <th style="text-align: center;">% Cumplimiento</th>
+                    </tr>
+                </thead>
+                <tbody>
 """
 
-    for i, atencion in enumerate(data, 1):
-        score = atencion['score_calidad']
+    for medico_id, info in medicos_ordenados:
+        score_prom = info['score_promedio']
+        score_min = info['score_min']
+        score_max = info['score_max']
+        porcentaje_cump = info['porcentaje_cumplimiento']
 
-        # Badge y color según score
-        if score >= 80:
+        # Badge de score
+        if score_prom >= 80:
             badge_class = "score-excelente"
-            progress_color = "#10b981"
-        elif score >= 60:
+        elif score_prom >= 60:
             badge_class = "score-bueno"
-            progress_color = "#3b82f6"
-        elif score >= 40:
+        elif score_prom >= 40:
             badge_class = "score-regular"
-            progress_color = "#f59e0b"
         else:
             badge_class = "score-deficiente"
-            progress_color = "#ef4444"
-
-        cuenta_formato = f"{atencion.get('cuenta_gestion', 'N/A')}/{atencion.get('cuenta_internacion', 'N/A')}"
-        nombre_paciente = atencion.get('nombre_paciente', 'No especificado')
-
-        html += f"""
-            <div class="atencion-card" data-medico-id="{atencion['id_medico']}">
-                <div class="atencion-header">
-                    <div>
-                        <h3 style="margin: 0; color: #1e40af;">Caso #{i} - {atencion['nombre_medico']}</h3>
-                        <div class="atencion-meta">
-                            📅 {atencion['fecha_atencion']} |
-                            👤 Paciente: {nombre_paciente} |
-                            🏥 Cuenta: {cuenta_formato} |
-                            📋 Evolución: {atencion['id_evolucion']}
-                        </div>
-                    </div>
-                    <div>
-                        <span class="score-badge {badge_class}" style="font-size: 1.2em;">{score} pts</span>
-                    </div>
-                </div>
-
-                <div style="margin: 15px 0;">
-                    <strong style="color: #1e40af;">Diagnóstico:</strong> {atencion['diagnostico_urgencia']}
-                </div>
-
-                <div style="margin: 15px 0;">
-                    <strong style="color: #64748b; font-size: 0.9em;">Progreso de Calidad:</strong>
-                    <div class="progress-bar">
-                        <div class="progress-fill" style="width: {score}%; background: {progress_color};"></div>
-                    </div>
-                </div>
-
-                <div style="margin: 20px 0;">
-                    <h4 style="color: #1e40af; margin-bottom: 10px;">📚 Guías Aplicables</h4>
-                    <ul style="margin-left: 25px; color: #475569;">
-"""
-
-        for guia in atencion['guias_aplicables']:
-            html += f"                        <li>{guia}</li>\n"
-
-        html += """
-                    </ul>
-                </div>
-
-                <div class="criterios-grid">
-                    <div class="criterios-columna criterios-cumplidos">
-                        <h4>✅ Criterios Cumplidos</h4>
-                        <ul>
-"""
-
-        if atencion['criterios_cumplidos']:
-            for criterio in atencion['criterios_cumplidos']:
-                html += f"                            <li>{criterio}</li>\n"
-        else:
-            html += "                            <li><em>No se registraron criterios cumplidos</em></li>\n"
-
-        html += """
-                        </ul>
-                    </div>
-
-                    <div class="criterios-columna criterios-no-cumplidos">
-                        <h4>❌ Criterios No Cumplidos</h4>
-                        <ul>
-"""
-
-        if atencion['criterios_no_cumplidos']:
-            for criterio in atencion['criterios_no_cumplidos']:
-                html += f"                            <li>{criterio}</li>\n"
-        else:
-            html += "                            <li><em>Todos los criterios fueron cumplidos</em></li>\n"
 
-        html += """
-                        </ul>
-                    </div>
-                </div>
-
-                <div style="margin: 20px 0;">
-                    <h4 style="color: #1e40af; margin-bottom: 10px;">🔍 Evaluaciones Específicas</h4>
-
-                    <div style="display: grid; grid-template-columns: 1fr 1fr; gap: 15px; margin-top: 10px;">
-"""
-
-        # Evaluación de tratamiento
-        tratamiento_icon = "✅" if "adecuado" in atencion.get('tratamiento_adecuado', '').lower() or "sí" in atencion.get('tratamiento_adecuado', '').lower() else "⚠️"
-        html += f"""
-                        <div style="padding: 12px; background: #f8fafc; border-radius: 6px; border-left: 3px solid #3b82f6;">
-                            <strong style="color: #64748b; font-size: 0.9em;">💊 Tratamiento:</strong><br>
-                            <span style="color: #1e293b;">{tratamiento_icon} {atencion.get('tratamiento_adecuado', 'No especificado')}</span>
-                        </div>
-"""
-
-        # Evaluación de tiempo
-        tiempo_icon = "✅" if "adecuado" in atencion.get('tiempo_atencion', '').lower() or "normal" in atencion.get('tiempo_atencion', '').lower() else "⚠️"
-        html += f"""
-                        <div style="padding: 12px; background: #f8fafc; border-radius: 6px; border-left: 3px solid #3b82f6;">
-                            <strong style="color: #64748b; font-size: 0.9em;">⏱️ Tiempo de Atención:</strong><br>
-                            <span style="color: #1e293b;">{tiempo_icon} {atencion.get('tiempo_atencion', 'No especificado')}</span>
-                        </div>
-"""
-
-        # Evaluación de estudios
-        estudios_icon = "✅" if "apropiado" in atencion.get('estudios_solicitados', '').lower() or "adecuado" in atencion.get('estudios_solicitados', '').lower() else "⚠️"
-        html += f"""
-                        <div style="padding: 12px; background: #f8fafc; border-radius: 6px; border-left: 3px solid #3b82f6;">
-                            <strong style="color: #64748b; font-size: 0.9em;">🔬 Estudios Solicitados:</strong><br>
-                            <span style="color: #1e293b;">{estudios_icon} {atencion.get('estudios_solicitados', 'No especificado')}</span>
-                        </div>
-"""
+        nombre = info['nombre']
+        if enlaces_medicos is not None:
+            nombre = f'<a href="{enlaces_medicos[str(medico_id)]}">{nombre}</a>'
 
-        # Evaluación de medicación
-        medicacion_icon = "✅" if "apropiada" in atencion.get('medicacion_apropiada', '').lower() or "adecuada" in atencion.get('medicacion_apropiada', '').lower() else "⚠️"
         html += f"""
-                        <div style="padding: 12px; background: #f8fafc; border-radius: 6px; border-left: 3px solid #3b82f6;">
-                            <strong style="color: #64748b; font-size: 0.9em;">💉 Medicación:</strong><br>
-                            <span style="color: #1e293b;">{medicacion_icon} {atencion.get('medicacion_apropiada', 'No especificado')}</span>
-                        </div>
-"""
-
-        html += """
-                    </div>
-                </div>
-"""
-
-        # Hallazgos críticos
-        if atencion.get('hallazgos_criticos') and len(atencion['hallazgos_criticos']) > 0:
-            html += """
-                <div class="info-box critico">
-                    <h4 style="margin-bottom: 10px; color: #991b1b;">🚨 Hallazgos Críticos</h4>
-                    <ul style="margin-left: 20px;">
-"""
-            for hallazgo in atencion['hallazgos_criticos']:
-                html += f"                        <li>{hallazgo}</li>\n"
-
-            html += """
-                    </ul>
-                </div>
-"""
-
-        # Recomendaciones
-        if atencion.get('recomendaciones') and len(atencion['recomendaciones']) > 0:
-            html += """
-                <div class="info-box info">
-                    <h4 style="margin-bottom: 10px; color: #1e40af;">💡 Recomendaciones</h4>
-                    <ol style="margin-left: 25px;">
-"""
-            for recomendacion in atencion['recomendaciones']:
-                html += f"                        <li>{recomendacion}</li>\n"
-
-            html += """
-                    </ol>
-                </div>
-"""
-
-        # Comentarios adicionales
-        if atencion.get('comentarios_adicionales') and atencion['comentarios_adicionales'].strip():
-            html += f"""
-                <div style="margin-top: 15px; padding: 12px; background: #f1f5f9; border-radius: 6px; border-left: 3px solid #64748b;">
-                    <strong style="color: #64748b;">📝 Comentarios del Auditor:</strong><br>
-                    <span style="color: #475569; font-style: italic;">{atencion['comentarios_adicionales']}</span>
-                </div>
-"""
-
-        html += """
-            </div>
+                    <tr>
+                        <td><strong>{nombre}</strong></td>
+                        <td style="text-align: center;">{info['num_atenciones']}</td>
+                        <td style="text-align: center;"><span class="score-badge {badge_class}">{score_prom:.1f}</span></td>
+                        <td style="text-align: center;">{score_min} - {score_max}</td>
+                        <td style="text-align: center;"><strong>{porcentaje_cump:.1f}%</strong></td>
+                    </tr>
 """
 
     html += """
+                </tbody>
+            </table>
         </div>
 """
 
+    # ATENCIONES (tabla resumen y detalle); la página índice de los reportes por médico no las incluye
+    if enlaces_medicos is None:
+        html += renderizar_atenciones(data, analisis, modo)
+
     # HALLAZGOS CRÍTICOS GLOBALES
     html += """
         <!-- HALLAZGOS CRÍTICOS GLOBALES -->
@@ -1206,7 +1673,11 @@ def generar_html(data, analisis, archivo_salida):
 
     hallazgos_top = analisis['hallazgos'].most_common(10)
 
-    if hallazgos_top:
+    if modo == "cliente":
+        html += """
+            <div id="top-hallazgos"></div>
+"""
+    elif hallazgos_top:
         html += """
             <table>
                 <thead>
@@ -1261,7 +1732,11 @@ def generar_html(data, analisis, archivo_salida):
 
     recomendaciones_top = analisis['recomendaciones'].most_common(10)
 
-    if recomendaciones_top:
+    if modo == "cliente":
+        html += """
+            <div id="top-recomendaciones"></div>
+"""
+    elif recomendaciones_top:
         html += """
             <table>
                 <thead>
@@ -1327,7 +1802,7 @@ def generar_html(data, analisis, archivo_salida):
     # Identificar mejor médico
     if medicos_ordenados:
         mejor_medico = medicos_ordenados[0]
-        mejor_score = sum(mejor_medico[1]['scores']) / len(mejor_medico[1]['scores'])
+        mejor_score = mejor_medico[1]['score_promedio']
         html += f"                    <li><strong>Desempeño destacado del Dr./Dra. {mejor_medico[1]['nombre']}</strong> con score promedio de {mejor_score:.1f}.</li>\n"
 
     html += """
@@ -1402,7 +1877,25 @@ def generar_html(data, analisis, archivo_salida):
         </div>
 
     </div>
+"""
+
+    if modo == "cliente":
+        html += """
+    <!-- Datos de la auditoría (una sola vez, formato compacto) -->
+    <script type="application/json" id="datos-auditoria">"""
+        html += datos_compactos(data)
+        html += """</script>
+
+    <!-- JavaScript para paginación y filtrado por médico -->
+    <script>"""
+        html += SCRIPT_MODO_CLIENTE
+        html += """    </script>
+</body>
+</html>
+"""
+        return html
 
+    html += f"""
     <!-- JavaScript para filtrado por médico -->
     <script>
     function filtrarPorMedico(medicoId) {{
@@ -1443,33 +1936,167 @@ def generar_html(data, analisis, archivo_salida):
 
     return html
 
-if __name__ == "__main__":
-    import sys
 
-    if len(sys.argv) < 2:
-        print("Uso: python generar_reporte_v2.py <archivo_jsonl>")
-        sys.exit(1)
+# Reporte por médico: una página liviana por médico más un índice con los KPIs globales
+ARCHIVO_INDICE_SHARDS = "index.html"
+ARCHIVO_MANIFIESTO_SHARDS = "manifiesto.json"
+
+
+def _huella_plantilla():
+    """Huella del código de este módulo: si cambia la plantilla, todas las páginas se regeneran"""
+    with open(__file__, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
 
-    archivo_entrada = sys.argv[1]
 
+def _escribir_atomico(fragmentos, ruta):
+    temporal = f"{ruta}.tmp"
+    fragmentos.escribir(temporal)
+    os.replace(temporal, ruta)
+
+
+def _renderizar_pagina_medico(tarea):
+    """Worker del pool de procesos: renderiza y escribe la página de un médico"""
+    registros, ruta, modo = tarea
+    _escribir_atomico(renderizar_html(registros, analizar_datos(registros), modo), ruta)
+    return ruta
+
+
+def generar_reporte_por_medico(archivos, directorio, modo="completo", procesos=None):
+    """
+    Escribe en `directorio` una página por médico (`medico_<id>.html`) y un `index.html` con los
+    KPIs globales y enlaces a cada página.
+
+    Las páginas se renderizan en paralelo (un proceso por página) y solo se regeneran las de
+    médicos cuyos registros cambiaron: `manifiesto.json` guarda la huella (SHA-256) de los
+    registros de cada médico, del modo y de la plantilla. El índice se regenera siempre (no
+    contiene atenciones, es barato).
+
+    Returns:
+        (analisis global, lista de ids de médico regenerados)
+    """
+    os.makedirs(directorio, exist_ok=True)
+    ruta_manifiesto = os.path.join(directorio, ARCHIVO_MANIFIESTO_SHARDS)
     try:
-        print("Cargando datos...")
-        data = cargar_datos(archivo_entrada)
-        print(f"  [OK] {len(data)} atenciones cargadas")
+        with open(ruta_manifiesto, "r", encoding="utf-8") as f:
+            manifiesto = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        manifiesto = {}
+
+    # Una sola pasada: análisis global, agrupación por médico y huella de sus registros
+    prefijo_huella = f"{_huella_plantilla()}\x00{modo}\x00".encode("utf-8")
+    acumulador = AcumuladorAnalisis()
+    por_medico = {}
+    huellas = {}
+    for d in FuenteRegistros(archivos):
+        acumulador.agregar(d)
+        clave = str(d['id_medico'])
+        por_medico.setdefault(clave, []).append(d)
+        if clave not in huellas:
+            huellas[clave] = hashlib.sha256(prefijo_huella)
+        huellas[clave].update(json.dumps(d, sort_keys=True, ensure_ascii=False).encode("utf-8") + b"\n")
+    analisis = acumulador.resultado()
+
+    archivos_medico = {clave: f"medico_{clave}.html" for clave in por_medico}
+    nuevo_manifiesto = {
+        clave: {"archivo": archivos_medico[clave], "huella": huellas[clave].hexdigest()}
+        for clave in por_medico
+    }
+    pendientes = [
+        clave for clave, entrada in nuevo_manifiesto.items()
+        if manifiesto.get(clave, {}).get("huella") != entrada["huella"]
+        or not os.path.exists(os.path.join(directorio, entrada["archivo"]))
+    ]
+
+    tareas = [(por_medico[clave], os.path.join(directorio, archivos_medico[clave]), modo) for clave in pendientes]
+    if len(tareas) > 1:
+        with ProcessPoolExecutor(max_workers=procesos) as pool:
+            list(pool.map(_renderizar_pagina_medico, tareas))
+    else:
+        for tarea in tareas:
+            _renderizar_pagina_medico(tarea)
+
+    # Páginas de médicos que ya no aparecen en los datos
+    for clave, entrada in manifiesto.items():
+        if clave not in nuevo_manifiesto:
+            try:
+                os.remove(os.path.join(directorio, entrada["archivo"]))
+            except FileNotFoundError:
+                pass
+
+    _escribir_atomico(
+        renderizar_html(None, analisis, enlaces_medicos=archivos_medico),
+        os.path.join(directorio, ARCHIVO_INDICE_SHARDS)
+    )
+
+    temporal = f"{ruta_manifiesto}.tmp"
+    with open(temporal, "w", encoding="utf-8") as f:
+        json.dump(nuevo_manifiesto, f, ensure_ascii=False, indent=2)
+    os.replace(temporal, ruta_manifiesto)
 
-        print("Analizando datos...")
-        analisis = analizar_datos(data)
-        print(f"  [OK] Análisis completado")
+    return analisis, pendientes
 
-        # Generar nombre de archivo de salida
-        archivo_salida = archivo_entrada.replace('.jsonl', '.html')
 
-        print("Generando reporte HTML...")
-        html = generar_html(data, analisis, archivo_salida)
+if __name__ == "__main__":
+    import sys
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Genera el reporte HTML de auditoría de urgencias a partir de uno o varios JSONL",
+        epilog="Ej: python generar_reporte.py output/auditoria_urgencias_202510*.jsonl --salida output/reporte_octubre.html"
+    )
+    parser.add_argument("archivos", nargs="+", help="Archivo(s) JSONL de auditoría (ej: todos los diarios de una semana)")
+    parser.add_argument("--salida", help="Archivo HTML de salida (por defecto: el mismo nombre del JSONL con .html); "
+                                         "con --por-medico, directorio de salida")
+    parser.add_argument("--modo", choices=MODOS_REPORTE, default="completo",
+                        help="completo: todo el HTML renderizado (por defecto); "
+                             "cliente: datos embebidos como JSON y renderizado paginado en el navegador")
+    parser.add_argument("--por-medico", action="store_true",
+                        help="Una página por médico más index.html con los KPIs globales; "
+                             "solo se regeneran las páginas de médicos con datos nuevos")
+    parser.add_argument("--procesos", type=int, default=None,
+                        help="Procesos para renderizar las páginas por médico (por defecto: núcleos disponibles)")
+    args = parser.parse_args()
+
+    archivo_entrada = args.archivos[0]
 
-        # Escribir archivo HTML
-        with open(archivo_salida, 'w', encoding='utf-8') as f:
-            f.write(html)
+    try:
+        if args.por_medico:
+            # Un directorio estable por entrada, para que las ejecuciones siguientes reutilicen las páginas
+            if args.salida:
+                archivo_salida = args.salida
+            elif len(args.archivos) == 1:
+                archivo_salida = archivo_entrada.replace('.jsonl', '_por_medico')
+            else:
+                archivo_salida = os.path.join(os.path.dirname(archivo_entrada), "reporte_por_medico")
+
+            print("Generando reporte por médico...")
+            analisis, regenerados = generar_reporte_por_medico(
+                args.archivos, archivo_salida, args.modo, args.procesos
+            )
+            print(f"  [OK] {analisis['total']} atenciones analizadas ({len(args.archivos)} archivo(s))")
+            print(f"  [OK] {len(regenerados)} de {len(analisis['medicos'])} página(s) de médico regeneradas")
+            archivo_salida = os.path.join(archivo_salida, ARCHIVO_INDICE_SHARDS)
+        else:
+            print("Analizando datos...")
+            # Streaming: los registros se leen archivo por archivo, sin cargarlos todos en memoria
+            data = FuenteRegistros(args.archivos)
+            analisis = analizar_datos(data)
+            print(f"  [OK] {analisis['total']} atenciones analizadas ({len(args.archivos)} archivo(s))")
+
+            # Generar nombre de archivo de salida
+            if args.salida:
+                archivo_salida = args.salida
+            elif len(args.archivos) == 1:
+                archivo_salida = archivo_entrada.replace('.jsonl', '.html')
+            else:
+                archivo_salida = os.path.join(
+                    os.path.dirname(archivo_entrada),
+                    f"reporte_consolidado_{datetime.now():%Y%m%d_%H%M%S}.html"
+                )
+
+            print("Generando reporte HTML...")
+            # Los fragmentos se escriben directo al archivo, sin unirlos en un único string
+            renderizar_html(data, analisis, args.modo).escribir(archivo_salida)
 
         print(f"\n{'='*60}")
         print(f"REPORTE GENERADO EXITOSAMENTE")
@@ -1,28 +1,88 @@
 import os
+import re
+import sys
 import json
+import hashlib
+import math
 import time
 import logging
-from datetime import datetime
+import queue
+import argparse
+import asyncio
+import threading
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
 from dotenv import load_dotenv
 from pydantic import BaseModel, Field, ValidationError
-from typing import List, Optional, Dict, Any
-import litellm
-import pymysql
-from pymysql.cursors import DictCursor
-
-# Configurar logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(f'logs/auditoria_{datetime.now():%Y%m%d}.log', encoding='utf-8'),
-        logging.StreamHandler()
-    ]
-)
+from typing import List, Optional, Dict, Any, Tuple
+
+from generar_reporte import AcumuladorAnalisis, iterar_registros, renderizar_html
+from utils.reparar_json import cargar_json_tolerante
+
+# litellm, pymysql y requests se importan en el primer uso: importar main (auditar_atencion.py,
+# ver_historial_raw.py, --help) no paga el import de litellm, que tarda varios segundos.
+# El logging lo configuran los puntos de entrada con configurar_logging().
 logger = logging.getLogger(__name__)
 
+
+def configurar_logging(archivo: bool = True):
+    """Logging de los scripts: consola y, con archivo=True, logs/auditoria_YYYYMMDD.log"""
+    handlers = [logging.StreamHandler()]
+    if archivo:
+        os.makedirs("logs", exist_ok=True)
+        handlers.insert(0, logging.FileHandler(f'logs/auditoria_{datetime.now():%Y%m%d}.log', encoding='utf-8'))
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=handlers
+    )
+
+
+_litellm = None
+
+
+def cargar_litellm():
+    """Importa y configura litellm la primera vez que se necesita (llamadas al LLM)"""
+    global _litellm
+    if _litellm is None:
+        import litellm
+        litellm.drop_params = True
+        litellm.set_verbose = False
+        _litellm = litellm
+    return _litellm
+
 # --- 1. Modelo de Datos Pydantic para Auditoría de Urgencia ---
 
+class MetricasAuditoria(BaseModel):
+    """Métricas de la llamada LLM que produjo una auditoría (no las genera el LLM)"""
+    modelo: str = Field(description="Modelo que respondió")
+    latencia_segundos: float = Field(default=0.0, description="Duración de la llamada exitosa")
+    tokens_entrada: int = Field(default=0, description="Tokens de entrada (incluye los leídos de caché)")
+    tokens_salida: int = Field(default=0, description="Tokens generados")
+    tokens_cacheados: int = Field(default=0, description="Tokens de entrada leídos desde la caché del proveedor")
+    tokens_escritos_cache: int = Field(default=0, description="Tokens de entrada escritos en la caché del proveedor")
+    cache_hit: bool = Field(default=False, description="True si el prompt de sistema se leyó desde caché")
+    solicitud_cobertura: bool = Field(
+        default=False, description="True si se lanzó una solicitud paralela al modelo de fallback (hedging)"
+    )
+    resultado_cacheado: bool = Field(default=False, description="True si el resultado salió de la caché local (sin llamar al LLM)")
+    resultado_lote: bool = Field(default=False, description="True si la auditoría se obtuvo de un lote (Message Batches)")
+    tamano_paquete: int = Field(
+        default=1, description="Atenciones auditadas en la misma llamada (1 = individual; los tokens se reparten entre ellas)"
+    )
+
+
+class RecorteHistorial(BaseModel):
+    """Sección del historial recortada (u omitida) para respetar el presupuesto de tokens del prompt"""
+    seccion: str = Field(description="Clave de la sección (ej: notas_enfermeria)")
+    tokens_originales: int = Field(description="Tokens estimados de la sección completa")
+    tokens_finales: int = Field(description="Tokens estimados enviados al LLM")
+    omitida: bool = Field(default=False, description="True si la sección se omitió completa")
+
+
 class AuditoriaUrgenciaResultado(BaseModel):
     id_medico: int = Field(description="ID del médico auditado")
     nombre_medico: str = Field(description="Nombre completo del médico")
@@ -73,40 +133,165 @@ class AuditoriaUrgenciaResultado(BaseModel):
         description="Contexto adicional relevante para la auditoría"
     )
 
+    metricas: Optional[MetricasAuditoria] = Field(
+        default=None,
+        description="Métricas de uso del LLM (tokens, caché, latencia)"
+    )
+    recortes_historial: List[RecorteHistorial] = Field(
+        default_factory=list,
+        description="Secciones del historial recortadas por el presupuesto de tokens (vacío = historial completo)"
+    )
+
 
 # --- 2. Componente: Cliente MySQL ---
 
-class MCPClient:
-    """Cliente para interactuar con MySQL"""
-    def __init__(self, query_dir: str = "queries"):
-        self.query_dir = query_dir
-        self.connection = None
-        self._connect()
+class PoolConexionesMySQL:
+    """
+    Pool de conexiones MySQL seguro entre hilos.
+
+    Mantiene entre min_conexiones y max_conexiones abiertas. Cada conexión se
+    configura una sola vez al crearse y se verifica con ping al entregarla.
+    """
+    def __init__(self, min_conexiones: int = 1, max_conexiones: int = 8, timeout_espera: float = 30):
+        self.min_conexiones = max(0, min_conexiones)
+        self.max_conexiones = max(1, max_conexiones, self.min_conexiones)
+        self.timeout_espera = timeout_espera
+        # LIFO: se reutiliza primero la conexión usada más recientemente
+        self._libres = queue.LifoQueue()
+        self._creadas = 0
+        self._lock = threading.Lock()
+
+        for _ in range(self.min_conexiones):
+            self._libres.put(self._crear_conexion())
+            self._creadas += 1
+
+        logger.info(
+            f"Pool MySQL listo ({self.min_conexiones}-{self.max_conexiones} conexiones, "
+            f"group_concat_max_len configurado a 10MB)"
+        )
+
+    def _crear_conexion(self):
+        """Abre y configura una nueva conexión con MySQL"""
+        import pymysql
+        from pymysql.cursors import DictCursor
 
-    def _connect(self):
-        """Establece conexión con MySQL"""
         try:
-            self.connection = pymysql.connect(
+            connection = pymysql.connect(
                 host=os.getenv("MYSQL_HOST", "127.0.0.1"),
                 port=int(os.getenv("MYSQL_PORT", "3306")),
                 user=os.getenv("MYSQL_USER"),
                 password=os.getenv("MYSQL_PASSWORD"),
                 database=os.getenv("MYSQL_DATABASE"),
                 cursorclass=DictCursor,
-                connect_timeout=10
+                connect_timeout=10,
+                # Solo lectura: sin autocommit una conexión reutilizada seguiría viendo
+                # el snapshot de su primera transacción
+                autocommit=True
             )
 
             # CRÍTICO: Aumentar límite de GROUP_CONCAT para capturar evoluciones completas
             # El límite por defecto (1024 bytes) trunca las evoluciones clínicas con JSON
             # Configurar a 10MB (10485760 bytes) para manejar historiales extensos
-            with self.connection.cursor() as cursor:
+            with connection.cursor() as cursor:
                 cursor.execute("SET SESSION group_concat_max_len = 10485760")
 
-            logger.info("Conectado a MySQL (group_concat_max_len configurado a 10MB)")
+            return connection
         except Exception as e:
             logger.error(f"Error al conectar con MySQL: {e}")
             raise
 
+    @staticmethod
+    def _esta_sana(connection) -> bool:
+        """Health check: ping sin reconexión (una reconexión perdería la configuración de sesión)"""
+        try:
+            connection.ping(reconnect=False)
+            return True
+        except Exception:
+            return False
+
+    def _descartar(self, connection):
+        with self._lock:
+            self._creadas -= 1
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def obtener(self):
+        """Entrega una conexión sana, creando una nueva si hay cupo o esperando si no lo hay"""
+        while True:
+            try:
+                connection = self._libres.get_nowait()
+            except queue.Empty:
+                connection = None
+
+            if connection is None:
+                with self._lock:
+                    hay_cupo = self._creadas < self.max_conexiones
+                    if hay_cupo:
+                        self._creadas += 1
+                if hay_cupo:
+                    try:
+                        return self._crear_conexion()
+                    except Exception:
+                        with self._lock:
+                            self._creadas -= 1
+                        raise
+                try:
+                    connection = self._libres.get(timeout=self.timeout_espera)
+                except queue.Empty:
+                    raise TimeoutError(
+                        f"No hay conexiones MySQL disponibles tras {self.timeout_espera}s "
+                        f"(máximo: {self.max_conexiones})"
+                    )
+
+            if self._esta_sana(connection):
+                return connection
+
+            logger.warning("Conexión MySQL inválida en el pool. Se descarta.")
+            self._descartar(connection)
+
+    def devolver(self, connection, descartar: bool = False):
+        """Devuelve una conexión al pool (o la cierra si quedó inutilizable)"""
+        if descartar or not connection.open:
+            self._descartar(connection)
+        else:
+            self._libres.put(connection)
+
+    @contextmanager
+    def conexion(self):
+        """Uso: with pool.conexion() as connection: ..."""
+        import pymysql
+
+        connection = self.obtener()
+        descartar = False
+        try:
+            yield connection
+        except (pymysql.err.OperationalError, pymysql.err.InterfaceError):
+            descartar = True
+            raise
+        finally:
+            self.devolver(connection, descartar=descartar)
+
+    def cerrar(self):
+        """Cierra todas las conexiones libres del pool"""
+        while True:
+            try:
+                connection = self._libres.get_nowait()
+            except queue.Empty:
+                break
+            self._descartar(connection)
+
+
+class MCPClient:
+    """Cliente para interactuar con MySQL"""
+    def __init__(self, query_dir: str = "queries", pool: Optional[PoolConexionesMySQL] = None):
+        self.query_dir = query_dir
+        self.pool = pool or PoolConexionesMySQL(
+            min_conexiones=int(os.getenv("MYSQL_POOL_MIN", "1")),
+            max_conexiones=int(os.getenv("MYSQL_POOL_MAX", "8"))
+        )
+
     def _load_query(self, query_name: str) -> str:
         """Carga una plantilla de query SQL desde un archivo .sql."""
         path = os.path.join(self.query_dir, f"{query_name}.sql")
@@ -119,22 +304,39 @@ class MCPClient:
     def _execute_query(self, query: str) -> Optional[List[Dict[str, Any]]]:
         """Ejecuta una query contra MySQL"""
         try:
-            if not self.connection or not self.connection.open:
-                self._connect()
-
-            with self.connection.cursor() as cursor:
-                cursor.execute(query)
-                results = cursor.fetchall()
-                return results if results else []
+            with self.pool.conexion() as connection:
+                with connection.cursor() as cursor:
+                    cursor.execute(query)
+                    results = cursor.fetchall()
+                    return results if results else []
 
         except Exception as e:
             logger.error(f"Error al ejecutar query: {e}")
             return None
 
+    def _get_atenciones_urgencias(
+        self, desde: str = "NULL", hasta: str = "NULL", cerradas_desde: str = "NULL"
+    ) -> Optional[List[Dict]]:
+        """
+        Lista las atenciones de urgencias con queries/get_atenciones_urgencias.sql. Los parámetros
+        son expresiones SQL (fecha entre comillas o NOW()); NULL deja el filtro sin aplicar.
+        """
+        query_template = self._load_query("get_atenciones_urgencias")
+        return self._execute_query(query_template.format(desde=desde, hasta=hasta, cerradas_desde=cerradas_desde))
+
     def get_todas_atenciones_24h(self) -> Optional[List[Dict]]:
-        """Obtiene TODAS las atenciones de urgencias de las últimas 24 horas"""
-        query_template = self._load_query("get_todas_atenciones_24h")
-        return self._execute_query(query_template)
+        """Obtiene TODAS las atenciones de urgencias de las últimas 24 horas (según el reloj de MySQL)"""
+        # Sin límite superior: las evoluciones con fecha posterior a NOW() (desfase de reloj o carga
+        # con hora futura) se siguen listando, como en la query original
+        return self._get_atenciones_urgencias(desde="DATE_SUB(NOW(), INTERVAL 24 HOUR)")
+
+    def get_atenciones_rango(self, desde: str, hasta: str) -> Optional[List[Dict]]:
+        """Obtiene las atenciones de urgencias con actividad en [desde, hasta) (backfill por bloques)"""
+        return self._get_atenciones_urgencias(desde=f"'{desde}'", hasta=f"'{hasta}'")
+
+    def get_atenciones_cerradas(self, desde: str) -> Optional[List[Dict]]:
+        """Obtiene las atenciones de urgencias con epicrisis o alta posterior a `desde` (modo continuo)"""
+        return self._get_atenciones_urgencias(cerradas_desde=f"'{desde}'")
 
     def get_detalle_atencion(
         self, persona_numero: int, cuenta_gestion: int, cuenta_internacion: int, cuenta_id: int
@@ -153,46 +355,117 @@ class MCPClient:
             return results[0]
         return None
 
-    def __del__(self):
-        """Cierra la conexión al destruir el objeto"""
-        if self.connection and self.connection.open:
-            self.connection.close()
-
+    # Secciones del detalle que se obtienen en lote: (query, columna, clave de agrupación)
+    # La clave indica con qué columnas cada query identifica a la cuenta.
+    SECCIONES_DETALLE_LOTE = [
+        ("get_detalle_lote_evoluciones", "evoluciones_clinicas", "cuenta"),
+        ("get_detalle_lote_signos_vitales", "signos_vitales", "cuenta_persona"),
+        ("get_detalle_lote_ejecuciones_medicamentos", "ejecuciones_medicamentos", "internacion"),
+        ("get_detalle_lote_notas_enfermeria", "notas_enfermeria", "cuenta_persona"),
+        ("get_detalle_lote_laboratorios", "laboratorios", "cuenta_persona"),
+        ("get_detalle_lote_estudios_imagen", "estudios_imagen", "cuenta_persona"),
+        ("get_detalle_lote_solicitudes_laboratorio", "solicitudes_laboratorio", "internacion_persona"),
+        ("get_detalle_lote_solicitudes_imagen", "solicitudes_imagen", "cuenta_persona"),
+    ]
 
-# --- 3. Componente: Auditor LLM con OpenRouter ---
+    @staticmethod
+    def _llave_seccion(clave: str, persona, gestion, internacion, cuenta_id) -> Tuple[int, ...]:
+        """Construye la llave con la que una sección en lote identifica a la cuenta"""
+        if clave == "cuenta":
+            return (int(gestion), int(internacion), int(cuenta_id))
+        if clave == "cuenta_persona":
+            return (int(persona), int(gestion), int(internacion), int(cuenta_id))
+        if clave == "internacion":
+            return (int(gestion), int(internacion))
+        return (int(persona), int(gestion), int(internacion))
+
+    def get_detalles_atenciones(
+        self, cuentas: List[Tuple[int, int, int, int]]
+    ) -> Optional[Dict[Tuple[int, int, int], Dict]]:
+        """
+        Obtiene el detalle completo de varias atenciones con una query set-based por sección.
 
-class AuditorLLM:
-    """Auditor médico usando Claude Sonnet 4.5/4 a través de OpenRouter con LiteLLM"""
-    def __init__(self, reintentos: int = 3):
-        self.api_key = os.getenv("OPENROUTER_API_KEY")
-        os.environ["OPENROUTER_API_KEY"] = self.api_key
+        Entrada: lista de tuplas (persona_numero, cuenta_gestion, cuenta_internacion, cuenta_id)
+        Salida: dict {(cuenta_gestion, cuenta_internacion, cuenta_id): detalle}, con el mismo
+        formato que get_detalle_atencion. Retorna None si alguna query falla.
+        """
+        if not cuentas:
+            return {}
 
-        model_base = os.getenv("DEFAULT_MODEL")
-        model_fallback = os.getenv("FALLBACK_MODEL")
+        cuentas = [tuple(int(v) for v in c) for c in cuentas]
+
+        # Listas de tuplas para los IN (...) de cada tipo de clave
+        valores = {
+            "cuenta": sorted({(g, i, c) for _, g, i, c in cuentas}),
+            "cuenta_persona": sorted(set(cuentas)),
+            "internacion": sorted({(g, i) for _, g, i, _ in cuentas}),
+            "internacion_persona": sorted({(p, g, i) for p, g, i, _ in cuentas}),
+        }
+        parametros = {
+            nombre: ", ".join("(" + ", ".join(str(v) for v in tupla) + ")" for tupla in tuplas)
+            for nombre, tuplas in valores.items()
+        }
+
+        # Detalle vacío por cuenta, con la misma forma que la query individual
+        detalles = {}
+        for persona, gestion, internacion, cuenta_id in cuentas:
+            detalle = {
+                "persona_numero": str(persona),
+                "cuenta_gestion": str(gestion),
+                "cuenta_internacion": str(internacion),
+                "cuenta_id": str(cuenta_id),
+                "triage_info": None,
+            }
+            for _, columna, _ in self.SECCIONES_DETALLE_LOTE:
+                detalle[columna] = None
+            detalles[(gestion, internacion, cuenta_id)] = detalle
+
+        def ejecutar_seccion(query_name: str) -> Optional[List[Dict[str, Any]]]:
+            query_sql = self._load_query(query_name).format(
+                cuentas=parametros["cuenta"],
+                cuentas_persona=parametros["cuenta_persona"],
+                internaciones=parametros["internacion"],
+                internaciones_persona=parametros["internacion_persona"]
+            )
+            return self._execute_query(query_sql)
+
+        # Las secciones son independientes: se consultan en paralelo con conexiones del pool
+        trabajadores = min(len(self.SECCIONES_DETALLE_LOTE), self.pool.max_conexiones)
+        with ThreadPoolExecutor(max_workers=trabajadores, thread_name_prefix="detalle") as ejecutor:
+            filas_por_seccion = list(ejecutor.map(
+                ejecutar_seccion, [query_name for query_name, _, _ in self.SECCIONES_DETALLE_LOTE]
+            ))
+
+        for (query_name, columna, clave), filas in zip(self.SECCIONES_DETALLE_LOTE, filas_por_seccion):
+            if filas is None:
+                logger.error(f"Error al obtener la sección '{columna}' en lote")
+                return None
+
+            valores_seccion = {
+                self._llave_seccion(
+                    clave, fila.get("persona_numero"), fila["cuenta_gestion"],
+                    fila["cuenta_internacion"], fila.get("cuenta_id")
+                ): fila[columna]
+                for fila in filas
+            }
+            for persona, gestion, internacion, cuenta_id in cuentas:
+                llave = self._llave_seccion(clave, persona, gestion, internacion, cuenta_id)
+                detalles[(gestion, internacion, cuenta_id)][columna] = valores_seccion.get(llave)
+
+        return detalles
 
-        self.model_principal = f"openrouter/{model_base}"
-        self.model_fallback = f"openrouter/{model_fallback}"
-        self.reintentos = reintentos
+    def __del__(self):
+        """Cierra las conexiones del pool al destruir el objeto"""
+        pool = getattr(self, "pool", None)
+        if pool is not None:
+            pool.cerrar()
 
-        litellm.drop_params = True
-        litellm.set_verbose = False
 
-    def auditar_atencion(
-        self,
-        historial: str,
-        id_evolucion: int,
-        fecha_atencion: str,
-        diagnostico: str,
-        id_persona: int,
-        id_medico: int,
-        nombre_medico: str,
-        nombre_paciente: str,  # NUEVO
-        cuenta_gestion: int,   # NUEVO
-        cuenta_internacion: int  # NUEVO
-    ) -> Optional[AuditoriaUrgenciaResultado]:
-        """Audita una atención de urgencias según guías internacionales"""
+# --- 3. Componente: Auditor LLM con OpenRouter ---
 
-        prompt_sistema = """
+# Prompt de sistema FIJO: se marca como cacheable en el proveedor (prompt caching),
+# por lo que cualquier cambio en su texto invalida la caché. No interpolar datos aquí.
+PROMPT_SISTEMA = """
         Eres un experto auditor médico especializado en medicina de urgencias.
         Tu tarea es evaluar si la atención de urgencias proporcionada cumple con guías clínicas
         internacionales reconocidas como:
@@ -276,21 +549,10 @@ class AuditorLLM:
         - Frases clave que indican internación: "INDICA INTERNACIÓN", "PASA A PISO", "TRASLADO A PISO", "INGRESA A PISO"
         """
 
-        prompt_usuario = f"""
-        Analiza la siguiente atención de urgencias y auditala según guías médicas internacionales.
 
-        **Información de la atención:**
-        - ID Evolución: {id_evolucion}
-        - Fecha de atención: {fecha_atencion}
-        - Diagnóstico registrado: {diagnostico}
-        - ID Paciente: {id_persona}
-        - ID Médico: {id_medico}
-        - Médico tratante: {nombre_medico}
-
-        **Historial Clínico del Paciente:**
-        {historial}
-
-        **Instrucciones de Evaluación:**
+# Instrucciones de evaluación y campos de la respuesta del prompt de usuario (compartidos por la
+# auditoría individual y la empaquetada). Cambiar su texto cambia la clave de la caché local.
+INSTRUCCIONES_EVALUACION = """        **Instrucciones de Evaluación:**
 
         1. Identifica las guías internacionales que aplican al caso
 
@@ -323,8 +585,9 @@ class AuditorLLM:
         6. Identifica fortalezas y áreas de mejora EN LA PRÁCTICA CLÍNICA
         7. Recomendaciones para mejorar EL ACTO MÉDICO, no la documentación
 
-        **IMPORTANTE: Responde ÚNICAMENTE con un objeto JSON válido con esta estructura:**
-        - cumple_guias: string ("Sí" o "No")
+"""
+
+CAMPOS_RESPUESTA_LLM = """        - cumple_guias: string ("Sí" o "No")
         - score_calidad: integer (0-100)
         - guias_aplicables: array de strings
         - criterios_cumplidos: array de strings
@@ -336,63 +599,1190 @@ class AuditorLLM:
         - hallazgos_criticos: array de strings
         - recomendaciones: array de strings
         - comentarios_adicionales: string
+"""
 
+# Tokens de respuesta que se reservan por llamada en el límite de tokens por minuto
+TOKENS_SALIDA_ESTIMADOS = 1500
+
+# Cobertura (hedging): latencias del principal que se recuerdan, muestras mínimas para usar
+# el percentil y plazo mínimo antes de lanzar la solicitud al fallback
+VENTANA_LATENCIAS_COBERTURA = 50
+MIN_MUESTRAS_COBERTURA = 10
+PLAZO_MINIMO_COBERTURA = 5.0
+
+# Auditoría por lotes (Message Batches): solicitudes por lote (límite del proveedor: 100.000),
+# tokens máximos de respuesta y versión de la API de Anthropic
+MAX_SOLICITUDES_LOTE = 10000
+TOKENS_MAXIMOS_LOTE = 4096
+VERSION_API_ANTHROPIC = "2023-06-01"
+
+# Versión de la lógica de auditoría. Incrementar cuando cambie algo que altere el
+# resultado sin cambiar el texto del prompt (parseo, modelo de datos, temperatura...):
+# invalida todas las entradas de la caché local de resultados.
+PROMPT_VERSION = "2"
+
+# Campos del resultado que NO genera el LLM: los completa el auditor con datos de la cuenta
+CAMPOS_METADATA = (
+    "id_medico", "nombre_medico", "id_persona_paciente", "nombre_paciente", "id_evolucion",
+    "fecha_atencion", "cuenta_gestion", "cuenta_internacion", "diagnostico_urgencia", "metricas",
+    "recortes_historial"
+)
+
+
+def esquema_respuesta_llm() -> Dict[str, Any]:
+    """
+    JSON Schema de la respuesta del LLM: los campos de AuditoriaUrgenciaResultado que genera
+    el modelo (todos menos CAMPOS_METADATA), sin propiedades adicionales. Se envía como
+    response_format para que el proveedor restrinja la salida a un objeto válido.
+    """
+    esquema = AuditoriaUrgenciaResultado.model_json_schema()
+    propiedades = {
+        nombre: {clave: valor for clave, valor in propiedad.items() if clave != "title"}
+        for nombre, propiedad in esquema["properties"].items()
+        if nombre not in CAMPOS_METADATA
+    }
+    return {
+        "type": "object",
+        "properties": propiedades,
+        "required": [nombre for nombre in esquema["required"] if nombre in propiedades],
+        "additionalProperties": False
+    }
+
+
+def esquema_respuesta_paquete() -> Dict[str, Any]:
+    """JSON Schema de la respuesta empaquetada: {"auditorias": [{"cuenta": ..., <campos de la auditoría>}]}"""
+    auditoria = esquema_respuesta_llm()
+    auditoria["properties"] = {
+        "cuenta": {"type": "string", "description": "Identificador de la atención, tal como aparece en su encabezado"},
+        **auditoria["properties"]
+    }
+    auditoria["required"] = ["cuenta", *auditoria["required"]]
+    return {
+        "type": "object",
+        "properties": {"auditorias": {"type": "array", "items": auditoria}},
+        "required": ["auditorias"],
+        "additionalProperties": False
+    }
+
+
+def coercionar_respuesta_llm(data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Corrige tipos en los campos que genera el LLM sin cambiar su contenido: score como
+    texto ("85/100") o decimal, listas devueltas como texto con viñetas, textos devueltos
+    como lista, cumple_guias como booleano o sin tilde. También desenvuelve una respuesta
+    anidada en un único objeto ({"auditoria": {...}}).
+    """
+    campos = [nombre for nombre in AuditoriaUrgenciaResultado.model_fields if nombre not in CAMPOS_METADATA]
+    if not any(nombre in data for nombre in campos):
+        anidados = [valor for valor in data.values() if isinstance(valor, dict)]
+        if len(anidados) == 1:
+            data = {**{clave: valor for clave, valor in data.items() if valor is not anidados[0]}, **anidados[0]}
+
+    corregido = dict(data)
+    for nombre in campos:
+        if nombre not in corregido:
+            continue
+        valor = corregido[nombre]
+        tipo = AuditoriaUrgenciaResultado.model_fields[nombre].annotation
+        if tipo is int:
+            if isinstance(valor, str):
+                numero = re.search(r"-?\d+(?:[.,]\d+)?", valor)
+                valor = float(numero.group().replace(",", ".")) if numero else valor
+            if isinstance(valor, float):
+                valor = round(valor)
+        elif tipo == List[str]:
+            if valor is None:
+                valor = []
+            elif isinstance(valor, str):
+                valor = [linea.strip(" -•*\t") for linea in valor.splitlines() if linea.strip(" -•*\t")]
+            elif isinstance(valor, list):
+                valor = [v if isinstance(v, str) else json.dumps(v, ensure_ascii=False) for v in valor]
+        elif tipo is str:
+            if isinstance(valor, list):
+                valor = "; ".join(str(v) for v in valor)
+            elif isinstance(valor, bool) and nombre == "cumple_guias":
+                valor = "Sí" if valor else "No"
+            elif valor is None:
+                valor = ""
+            elif not isinstance(valor, str):
+                valor = str(valor)
+            if nombre == "cumple_guias":
+                valor = {"si": "Sí", "sí": "Sí", "yes": "Sí", "true": "Sí", "no": "No", "false": "No"}.get(
+                    valor.strip().lower(), valor
+                )
+        corregido[nombre] = valor
+    return corregido
+
+
+def segundos_retry_after(error: Exception) -> Optional[float]:
+    """
+    Extrae la espera sugerida por el proveedor de un error 429: header Retry-After (segundos o
+    fecha HTTP) o retry-after-ms. None si la respuesta no la indica.
+    """
+    headers = getattr(error, "litellm_response_headers", None)
+    if not headers:
+        respuesta = getattr(error, "response", None)
+        headers = getattr(respuesta, "headers", None)
+    if not headers:
+        return None
+
+    valor_ms = headers.get("retry-after-ms")
+    if valor_ms:
+        try:
+            return max(0.0, float(valor_ms) / 1000)
+        except ValueError:
+            pass
+
+    valor = headers.get("retry-after")
+    if not valor:
+        return None
+    try:
+        return max(0.0, float(valor))
+    except ValueError:
+        try:
+            return max(0.0, (parsedate_to_datetime(valor) - datetime.now(timezone.utc)).total_seconds())
+        except (TypeError, ValueError):
+            return None
+
+
+def es_error_limite_tasa(error: Exception) -> bool:
+    # Si litellm no se importó todavía, el error no puede ser suyo
+    litellm = sys.modules.get("litellm")
+    return (litellm is not None and isinstance(error, litellm.RateLimitError)) or \
+        getattr(error, "status_code", None) == 429
+
+
+class LimitadorTasa:
+    """
+    Limitador compartido de llamadas al LLM, seguro entre hilos.
+
+    - Token bucket de requests por minuto (`rpm`) y de tokens por minuto (`tpm`); 0 = sin límite.
+      Los tokens se reservan con una estimación antes de la llamada y se ajustan con el uso real.
+    - Concurrencia adaptativa (AIMD): cada llamada exitosa sube el límite de llamadas simultáneas
+      en ~1 por ronda; cada 429 lo divide a la mitad (como mucho una vez por pausa) y pausa a
+      todos los hilos durante el Retry-After indicado por el proveedor.
+    """
+    def __init__(self, rpm: float = 0, tpm: float = 0, max_concurrencia: int = 8, pausa_por_defecto: float = 10):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.max_concurrencia = max(1, max_concurrencia)
+        self.pausa_por_defecto = pausa_por_defecto
+        self._cond = threading.Condition()
+        self._requests_disponibles = float(rpm)
+        self._tokens_disponibles = float(tpm)
+        self._ultima_recarga = time.monotonic()
+        self._limite = float(self.max_concurrencia)
+        self._en_curso = 0
+        self._pausa_hasta = 0.0
+        self._ultima_reduccion = 0.0
+        self.limitaciones = 0
+
+    @property
+    def limite_concurrencia(self) -> int:
+        return int(self._limite)
+
+    def _recargar(self, ahora: float):
+        transcurrido = ahora - self._ultima_recarga
+        self._ultima_recarga = ahora
+        if self.rpm:
+            self._requests_disponibles = min(self.rpm, self._requests_disponibles + transcurrido * self.rpm / 60)
+        if self.tpm:
+            self._tokens_disponibles = min(self.tpm, self._tokens_disponibles + transcurrido * self.tpm / 60)
+
+    def adquirir(self, tokens_estimados: int = 0) -> int:
+        """Bloquea hasta que haya cupo para una llamada. Retorna los tokens reservados (para liberar())."""
+        # Una llamada más grande que el TPM completo no puede esperar a que entre: reserva el máximo
+        reservados = min(tokens_estimados, int(self.tpm)) if self.tpm else 0
+        with self._cond:
+            while True:
+                ahora = time.monotonic()
+                self._recargar(ahora)
+                esperas = []
+                if ahora < self._pausa_hasta:
+                    esperas.append(self._pausa_hasta - ahora)
+                if self.rpm and self._requests_disponibles < 1:
+                    esperas.append((1 - self._requests_disponibles) * 60 / self.rpm)
+                if self.tpm and self._tokens_disponibles < reservados:
+                    esperas.append((reservados - self._tokens_disponibles) * 60 / self.tpm)
+                sin_lugar = self._en_curso >= int(self._limite)
+                if not esperas and not sin_lugar:
+                    break
+                # Sin lugar y sin otra espera: se despierta cuando otra llamada libera su lugar
+                self._cond.wait(timeout=max(esperas) if esperas else None)
+
+            if self.rpm:
+                self._requests_disponibles -= 1
+            self._tokens_disponibles -= reservados
+            self._en_curso += 1
+        return reservados
+
+    def liberar(
+        self, reservados: int = 0, tokens_reales: Optional[int] = None, limitado: bool = False,
+        retry_after: Optional[float] = None
+    ):
+        """Devuelve el lugar de la llamada, ajusta el bucket de tokens y adapta la concurrencia"""
+        with self._cond:
+            self._en_curso -= 1
+            if self.tpm and tokens_reales is not None:
+                self._tokens_disponibles -= tokens_reales - reservados
+
+            ahora = time.monotonic()
+            if limitado:
+                self.limitaciones += 1
+                pausa = retry_after if retry_after is not None else self.pausa_por_defecto
+                # Varios 429 simultáneos cuentan como una sola señal de congestión
+                if ahora >= self._ultima_reduccion + max(1.0, pausa):
+                    self._limite = max(1.0, self._limite / 2)
+                    self._ultima_reduccion = ahora
+                self._pausa_hasta = max(self._pausa_hasta, ahora + pausa)
+                logger.warning(
+                    f"Límite de tasa del proveedor (429): pausa de {pausa:.1f}s, "
+                    f"concurrencia LLM reducida a {self.limite_concurrencia}"
+                )
+            else:
+                self._limite = min(float(self.max_concurrencia), self._limite + 1 / self._limite)
+            self._cond.notify_all()
+
+
+class CacheResultadosLLM:
+    """
+    Caché en disco de respuestas del LLM direccionada por contenido.
+
+    La clave es el SHA-256 de (PROMPT_VERSION, prompt de sistema, modelos, prompt de usuario):
+    si una cuenta se vuelve a auditar con exactamente el mismo historial formateado,
+    se reutiliza la respuesta anterior sin llamar al LLM. Cada entrada es un archivo
+    JSON en `directorio` con solo los campos generados por el LLM.
+
+    Expulsión: se descartan las entradas que llevan más de `max_dias` sin usarse y, si el
+    directorio supera `max_mb`, las menos usadas recientemente (según mtime, que se
+    actualiza en cada acierto).
+    """
+    def __init__(self, directorio: str = os.path.join("output", "cache_llm"), max_dias: float = 30, max_mb: float = 200):
+        self.directorio = directorio
+        self.max_segundos = max_dias * 86400
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        os.makedirs(self.directorio, exist_ok=True)
+        self.purgar()
+
+    @staticmethod
+    def calcular_clave(modelos: List[str], prompt_usuario: str) -> str:
+        """Clave de contenido para una llamada al LLM"""
+        h = hashlib.sha256()
+        for parte in (PROMPT_VERSION, PROMPT_SISTEMA, "|".join(modelos), prompt_usuario):
+            h.update(parte.encode("utf-8"))
+            h.update(b"\x00")
+        return h.hexdigest()
+
+    def _ruta(self, clave: str) -> str:
+        return os.path.join(self.directorio, f"{clave}.json")
+
+    def obtener(self, clave: str) -> Optional[Dict[str, Any]]:
+        """Devuelve la entrada guardada para la clave, o None si no existe o expiró"""
+        ruta = self._ruta(clave)
+        try:
+            if time.time() - os.path.getmtime(ruta) > self.max_segundos:
+                self._eliminar(ruta)
+                return None
+            with open(ruta, "r", encoding="utf-8") as f:
+                entrada = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning(f"Entrada de caché LLM ilegible, se descarta ({ruta}): {e}")
+            self._eliminar(ruta)
+            return None
+
+        try:
+            os.utime(ruta, None)  # Marca de uso para la expulsión LRU
+        except OSError:
+            pass
+        return entrada
+
+    def guardar(self, clave: str, modelo: str, respuesta: Dict[str, Any]):
+        """Guarda la respuesta del LLM (escritura atómica)"""
+        entrada = {"clave": clave, "creado": time.time(), "modelo": modelo, "respuesta": respuesta}
+        ruta = self._ruta(clave)
+        temporal = f"{ruta}.{threading.get_ident()}.tmp"
+        try:
+            with open(temporal, "w", encoding="utf-8") as f:
+                json.dump(entrada, f, ensure_ascii=False)
+            os.replace(temporal, ruta)
+        except OSError as e:
+            logger.warning(f"No se pudo guardar en la caché LLM: {e}")
+            self._eliminar(temporal)
+
+    @staticmethod
+    def _eliminar(ruta: str):
+        try:
+            os.remove(ruta)
+        except OSError:
+            pass
+
+    def purgar(self):
+        """Elimina entradas expiradas y, si se supera el tamaño máximo, las menos usadas"""
+        ahora = time.time()
+        entradas = []
+        for entrada in os.scandir(self.directorio):
+            if not entrada.name.endswith(".json") or not entrada.is_file():
+                continue
+            stat = entrada.stat()
+            # La antigüedad se mide por mtime: una entrada usada recientemente se conserva
+            if ahora - stat.st_mtime > self.max_segundos:
+                self._eliminar(entrada.path)
+                continue
+            entradas.append((stat.st_mtime, stat.st_size, entrada.path))
+
+        total = sum(tamano for _, tamano, _ in entradas)
+        if total <= self.max_bytes:
+            return
+
+        eliminadas = 0
+        for _, tamano, ruta in sorted(entradas):
+            if total <= self.max_bytes:
+                break
+            self._eliminar(ruta)
+            total -= tamano
+            eliminadas += 1
+        logger.info(f"Caché LLM: {eliminadas} entradas expulsadas por tamaño")
+
+
+class AuditorLLM:
+    """Auditor médico usando Claude Sonnet 4.5/4 a través de OpenRouter con LiteLLM"""
+    def __init__(
+        self, reintentos: int = 3, cache_prompt: Optional[bool] = None, cache_resultados: Optional[bool] = None,
+        limitador: Optional[LimitadorTasa] = None
+    ):
+        self.api_key = os.getenv("OPENROUTER_API_KEY")
+        os.environ["OPENROUTER_API_KEY"] = self.api_key
+        # Permite apuntar a un endpoint local compatible (ej: stub_llm.py) para pruebas
+        self.api_base = os.getenv("OPENROUTER_BASE_URL") or None
+
+        model_base = os.getenv("DEFAULT_MODEL")
+        model_fallback = os.getenv("FALLBACK_MODEL")
+
+        self.model_principal = f"openrouter/{model_base}"
+        self.model_fallback = f"openrouter/{model_fallback}"
+        # Modo lote: modelo con el nombre de la API de Anthropic (anthropic/claude-sonnet-4.5 -> claude-sonnet-4-5)
+        self.modelo_lote = os.getenv("LOTE_MODELO") or (model_base or "").split("/")[-1].replace(".", "-")
+        self.reintentos = reintentos
+        # Tiempo máximo por llamada: acota la latencia de cola de cada auditoría
+        self.timeout = float(os.getenv("LLM_TIMEOUT_SEGUNDOS", "180"))
+        # Límite de tasa compartido por todas las llamadas de este auditor (y sus hilos)
+        self.limitador = limitador or LimitadorTasa(
+            rpm=float(os.getenv("LLM_RPM", "0")),
+            tpm=float(os.getenv("LLM_TPM", "0")),
+            max_concurrencia=int(os.getenv("LLM_MAX_CONCURRENCIA", "8"))
+        )
+
+        # Cobertura (hedging): si el principal tarda más que el percentil de sus latencias
+        # recientes, se lanza la misma solicitud al fallback y gana la primera respuesta válida
+        self.cobertura = os.getenv("LLM_COBERTURA", "0") == "1"
+        self.percentil_cobertura = float(os.getenv("LLM_COBERTURA_PERCENTIL", "95"))
+        self.plazo_cobertura_inicial = float(os.getenv("LLM_COBERTURA_PLAZO_INICIAL", "120"))
+        self._latencias = deque(maxlen=VENTANA_LATENCIAS_COBERTURA)
+        self._lock_latencias = threading.Lock()
+        self._loop = None
+
+        # Salida estructurada: el proveedor restringe la respuesta al esquema de la auditoría
+        self.response_format = None
+        if os.getenv("LLM_SALIDA_ESTRUCTURADA", "1") != "0":
+            self.response_format = {
+                "type": "json_schema",
+                "json_schema": {"name": "auditoria_urgencia", "strict": True, "schema": esquema_respuesta_llm()}
+            }
+            self.response_format_paquete = {
+                "type": "json_schema",
+                "json_schema": {"name": "auditorias_urgencia", "strict": True, "schema": esquema_respuesta_paquete()}
+            }
+        else:
+            self.response_format_paquete = None
+
+        # Contadores de llamadas, reintentos y respuestas inválidas (ver resumen_estadisticas)
+        self.estadisticas = {
+            "auditorias": 0, "llamadas": 0, "reintentos": 0, "errores_json": 0,
+            "errores_validacion": 0, "reparadas": 0, "limitadas": 0, "fallidas": 0
+        }
+        self._lock_estadisticas = threading.Lock()
+
+        # Prompt caching del proveedor (cache_control de Anthropic vía OpenRouter)
+        if cache_prompt is None:
+            cache_prompt = os.getenv("LLM_PROMPT_CACHE", "1") != "0"
+        self.cache_prompt = cache_prompt
+
+        # Caché local de resultados (evita repetir la llamada si el historial no cambió)
+        if cache_resultados is None:
+            cache_resultados = os.getenv("LLM_CACHE_RESULTADOS", "1") != "0"
+        self.cache_resultados = None
+        if cache_resultados:
+            self.cache_resultados = CacheResultadosLLM(
+                directorio=os.getenv("LLM_CACHE_DIR", os.path.join("output", "cache_llm")),
+                max_dias=float(os.getenv("LLM_CACHE_MAX_DIAS", "30")),
+                max_mb=float(os.getenv("LLM_CACHE_MAX_MB", "200"))
+            )
+
+    def _construir_mensajes(self, prompt_usuario: str) -> List[Dict[str, Any]]:
+        """
+        Arma los mensajes de la llamada. El prompt de sistema (fijo) va primero y,
+        con cache_prompt activo, marcado con cache_control para que el proveedor
+        lo procese una sola vez y lo reutilice en las llamadas y reintentos siguientes.
+        """
+        if self.cache_prompt:
+            sistema = {
+                "role": "system",
+                "content": [
+                    {"type": "text", "text": PROMPT_SISTEMA, "cache_control": {"type": "ephemeral"}}
+                ]
+            }
+        else:
+            sistema = {"role": "system", "content": PROMPT_SISTEMA}
+
+        return [sistema, {"role": "user", "content": prompt_usuario}]
+
+    def _contar(self, contador: str, cantidad: int = 1):
+        with self._lock_estadisticas:
+            self.estadisticas[contador] += cantidad
+
+    def resumen_estadisticas(self) -> str:
+        """Resumen de una línea: llamadas, reintentos y tasa de respuestas que no se pudieron parsear"""
+        with self._lock_estadisticas:
+            e = dict(self.estadisticas)
+        invalidas = e["errores_json"] + e["errores_validacion"]
+        tasa = invalidas / e["llamadas"] * 100 if e["llamadas"] else 0.0
+        return (
+            f"{e['llamadas']} llamadas para {e['auditorias']} auditorías, {e['reintentos']} reintentos, "
+            f"{invalidas} respuestas inválidas ({tasa:.1f}%: {e['errores_json']} JSON, "
+            f"{e['errores_validacion']} validación; {e['reparadas']} reparadas localmente), {e['limitadas']} limitadas por tasa (429), "
+            f"{e['fallidas']} auditorías fallidas"
+        )
+
+    @staticmethod
+    def _extraer_metricas(response, modelo: str, latencia: float) -> MetricasAuditoria:
+        """Extrae uso de tokens y caché de la respuesta (formato OpenAI/OpenRouter o Anthropic vía LiteLLM)"""
+        def valor(obj, nombre):
+            if obj is None:
+                return None
+            if isinstance(obj, dict):
+                return obj.get(nombre)
+            return getattr(obj, nombre, None)
+
+        usage = valor(response, "usage")
+        detalles = valor(usage, "prompt_tokens_details")
+
+        tokens_cacheados = valor(detalles, "cached_tokens") or valor(usage, "cache_read_input_tokens") or 0
+        tokens_escritos = valor(usage, "cache_creation_input_tokens") or 0
+
+        return MetricasAuditoria(
+            modelo=modelo,
+            latencia_segundos=round(latencia, 3),
+            tokens_entrada=valor(usage, "prompt_tokens") or 0,
+            tokens_salida=valor(usage, "completion_tokens") or 0,
+            tokens_cacheados=tokens_cacheados,
+            tokens_escritos_cache=tokens_escritos,
+            cache_hit=tokens_cacheados > 0
+        )
+
+    def _validar_respuesta(
+        self, content: str, metricas: MetricasAuditoria, metadata: Dict[str, Any], id_evolucion: int
+    ) -> AuditoriaUrgenciaResultado:
+        """
+        Parsea la respuesta del LLM y la valida contra AuditoriaUrgenciaResultado. Si el JSON
+        no parsea o no valida, intenta primero una reparación local (utils/reparar_json.py y
+        coercionar_respuesta_llm) antes de que el llamador gaste otra llamada al LLM.
+        """
+        content = (content or "").strip()
+        if content.startswith("```json"):
+            content = content[7:]
+        if content.startswith("```"):
+            content = content[3:]
+        if content.endswith("```"):
+            content = content[:-3]
+        content = content.strip()
+
+        reparada = False
+        try:
+            data = json.loads(content)
+        except json.JSONDecodeError as e:
+            self._contar("errores_json")
+            data, reparada = cargar_json_tolerante(content)
+            logger.info(f"Evolución {id_evolucion}: JSON inválido reparado localmente ({e})")
+        if not isinstance(data, dict):
+            raise ValueError(f"La respuesta no es un objeto JSON: {type(data).__name__}")
+
+        # Agregar campos que conocemos
+        data.update(metadata)
+        data["metricas"] = metricas
+
+        if metricas.tokens_entrada:
+            logger.info(
+                f"Tokens evolución {id_evolucion}: entrada={metricas.tokens_entrada} "
+                f"(caché: {metricas.tokens_cacheados} leídos, {metricas.tokens_escritos_cache} escritos), "
+                f"salida={metricas.tokens_salida}, latencia={metricas.latencia_segundos:.1f}s"
+            )
+
+        try:
+            resultado = AuditoriaUrgenciaResultado(**data)
+        except (ValidationError, TypeError) as e:
+            self._contar("errores_validacion")
+            try:
+                resultado = AuditoriaUrgenciaResultado(**coercionar_respuesta_llm(data))
+            except (ValidationError, TypeError):
+                raise e
+            reparada = True
+            logger.info(f"Evolución {id_evolucion}: tipos corregidos localmente tras error de validación")
+
+        if reparada:
+            self._contar("reparadas")
+        return resultado
+
+    def _intento(
+        self, modelo: str, mensajes: List[Dict[str, Any]], tokens_estimados: int,
+        metadata: Dict[str, Any], id_evolucion: int
+    ) -> AuditoriaUrgenciaResultado:
+        """Un intento de auditoría: llamada al LLM y validación. Lanza la excepción si falla."""
+        contenido, metricas = self._llamar(modelo, mensajes, tokens_estimados, self.response_format)
+        if modelo == self.model_principal:
+            self._registrar_latencia(metricas.latencia_segundos)
+        return self._validar_respuesta(contenido, metricas, metadata, id_evolucion)
+
+    def _llamar(
+        self, modelo: str, mensajes: List[Dict[str, Any]], tokens_estimados: int,
+        response_format: Optional[Dict[str, Any]]
+    ) -> Tuple[str, MetricasAuditoria]:
+        """Una llamada al LLM (dentro del limitador de tasa). Retorna (contenido, métricas)."""
+        reservados = self.limitador.adquirir(tokens_estimados)
+        tokens_reales = None
+        error = None
+        try:
+            self._contar("llamadas")
+            inicio = time.perf_counter()
+            response = cargar_litellm().completion(
+                model=modelo,
+                messages=mensajes,
+                temperature=0.3,
+                api_base=self.api_base,
+                timeout=self.timeout,
+                response_format=response_format,
+            )
+            metricas = self._extraer_metricas(response, modelo, time.perf_counter() - inicio)
+            if metricas.tokens_entrada:
+                tokens_reales = metricas.tokens_entrada + metricas.tokens_salida
+            return response.choices[0].message.content, metricas
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            limitado = error is not None and es_error_limite_tasa(error)
+            self.limitador.liberar(
+                reservados, tokens_reales, limitado, segundos_retry_after(error) if limitado else None
+            )
+
+    # --- Cobertura (hedging) entre modelo principal y fallback ---
+
+    def _registrar_latencia(self, segundos: float):
+        with self._lock_latencias:
+            self._latencias.append(segundos)
+
+    def plazo_cobertura(self) -> float:
+        """
+        Segundos que se espera al modelo principal antes de lanzar la solicitud de cobertura:
+        el percentil LLM_COBERTURA_PERCENTIL de las latencias recientes del principal (o el
+        plazo inicial mientras no haya suficientes muestras).
+        """
+        with self._lock_latencias:
+            latencias = sorted(self._latencias)
+        if len(latencias) < MIN_MUESTRAS_COBERTURA:
+            return self.plazo_cobertura_inicial
+        indice = min(len(latencias) - 1, math.ceil(self.percentil_cobertura / 100 * len(latencias)) - 1)
+        return max(PLAZO_MINIMO_COBERTURA, latencias[indice])
+
+    def _loop_cobertura(self) -> asyncio.AbstractEventLoop:
+        """Event loop propio (en un hilo daemon) para las llamadas async de cobertura"""
+        with self._lock_latencias:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name="cobertura-llm", daemon=True).start()
+            return self._loop
+
+    def _intento_con_cobertura(
+        self, mensajes: List[Dict[str, Any]], tokens_estimados: int, metadata: Dict[str, Any], id_evolucion: int
+    ) -> AuditoriaUrgenciaResultado:
+        futuro = asyncio.run_coroutine_threadsafe(
+            self._cobertura_async(mensajes, tokens_estimados, metadata, id_evolucion), self._loop_cobertura()
+        )
+        return futuro.result()
+
+    async def _intento_async(
+        self, modelo: str, mensajes: List[Dict[str, Any]], tokens_estimados: int,
+        metadata: Dict[str, Any], id_evolucion: int
+    ) -> AuditoriaUrgenciaResultado:
+        """Versión async de _intento: se puede cancelar (la solicitud HTTP se aborta)"""
+        # adquirir() bloquea: corre en un hilo. Si la tarea se cancela mientras espera,
+        # el lugar que termine obteniendo se devuelve apenas se obtenga.
+        adquisicion = asyncio.ensure_future(asyncio.to_thread(self.limitador.adquirir, tokens_estimados))
+        try:
+            reservados = await asyncio.shield(adquisicion)
+        except asyncio.CancelledError:
+            adquisicion.add_done_callback(
+                lambda tarea: None if tarea.cancelled() or tarea.exception() else self.limitador.liberar(tarea.result())
+            )
+            raise
+
+        tokens_reales = None
+        error = None
+        try:
+            self._contar("llamadas")
+            inicio = time.perf_counter()
+            response = await cargar_litellm().acompletion(
+                model=modelo,
+                messages=mensajes,
+                temperature=0.3,
+                api_base=self.api_base,
+                timeout=self.timeout,
+                response_format=self.response_format,
+            )
+            metricas = self._extraer_metricas(response, modelo, time.perf_counter() - inicio)
+            if metricas.tokens_entrada:
+                tokens_reales = metricas.tokens_entrada + metricas.tokens_salida
+            if modelo == self.model_principal:
+                self._registrar_latencia(metricas.latencia_segundos)
+            return self._validar_respuesta(response.choices[0].message.content, metricas, metadata, id_evolucion)
+        except BaseException as e:
+            error = e
+            if isinstance(e, asyncio.CancelledError) and modelo == self.model_principal:
+                # Latencia censurada (al menos esto tardó): evita que el percentil se sesgue hacia abajo
+                self._registrar_latencia(time.perf_counter() - inicio)
+            raise
+        finally:
+            limitado = isinstance(error, Exception) and es_error_limite_tasa(error)
+            self.limitador.liberar(
+                reservados, tokens_reales, limitado, segundos_retry_after(error) if limitado else None
+            )
+
+    async def _cobertura_async(
+        self, mensajes: List[Dict[str, Any]], tokens_estimados: int, metadata: Dict[str, Any], id_evolucion: int
+    ) -> AuditoriaUrgenciaResultado:
+        """
+        Llama al modelo principal; si no respondió dentro de plazo_cobertura(), lanza en paralelo
+        la misma solicitud al modelo de fallback. Gana el primer resultado válido y la otra
+        solicitud se cancela. Si ambas fallan se propaga el error del principal.
+        """
+        principal = asyncio.create_task(
+            self._intento_async(self.model_principal, mensajes, tokens_estimados, metadata, id_evolucion)
+        )
+        plazo = self.plazo_cobertura()
+        hechas, _ = await asyncio.wait({principal}, timeout=plazo)
+        if hechas:
+            return principal.result()
+
+        logger.info(
+            f"Evolución {id_evolucion}: {self.model_principal} sin respuesta tras {plazo:.1f}s, "
+            f"solicitud de cobertura a {self.model_fallback}"
+        )
+        cobertura = asyncio.create_task(
+            self._intento_async(self.model_fallback, mensajes, tokens_estimados, metadata, id_evolucion)
+        )
+        pendientes = {principal, cobertura}
+        try:
+            while pendientes:
+                hechas, pendientes = await asyncio.wait(pendientes, return_when=asyncio.FIRST_COMPLETED)
+                for tarea in hechas:
+                    if tarea.exception() is None:
+                        resultado = tarea.result()
+                        resultado.metricas.solicitud_cobertura = True
+                        if tarea is cobertura:
+                            logger.info(f"Evolución {id_evolucion}: ganó la solicitud de cobertura ({self.model_fallback})")
+                        return resultado
+                    logger.warning(f"Evolución {id_evolucion}: solicitud con cobertura fallida: {tarea.exception()}")
+        finally:
+            for tarea in pendientes:
+                tarea.cancel()
+
+        raise principal.exception()
+
+    @staticmethod
+    def construir_prompt_usuario(
+        historial: str, id_evolucion: int, fecha_atencion: str, diagnostico: str,
+        id_persona: int, id_medico: int, nombre_medico: str
+    ) -> str:
+        """Prompt de usuario de una atención (el mismo para llamadas directas y por lotes)"""
+        prompt_usuario = f"""
+        Analiza la siguiente atención de urgencias y auditala según guías médicas internacionales.
+
+        **Información de la atención:**
+        - ID Evolución: {id_evolucion}
+        - Fecha de atención: {fecha_atencion}
+        - Diagnóstico registrado: {diagnostico}
+        - ID Paciente: {id_persona}
+        - ID Médico: {id_medico}
+        - Médico tratante: {nombre_medico}
+
+        **Historial Clínico del Paciente:**
+        {historial}
+
+{INSTRUCCIONES_EVALUACION}        **IMPORTANTE: Responde ÚNICAMENTE con un objeto JSON válido con esta estructura:**
+{CAMPOS_RESPUESTA_LLM}
         NO incluyas los campos id_medico, nombre_medico, id_persona_paciente, id_evolucion, fecha_atencion, diagnostico_urgencia, nombre_paciente, cuenta_gestion, cuenta_internacion.
         Responde SOLO con el JSON, sin texto adicional.
         """
+        return prompt_usuario
+
+    @staticmethod
+    def metadata_auditoria(
+        id_evolucion: int, fecha_atencion: str, diagnostico: str, id_persona: int, id_medico: int,
+        nombre_medico: str, nombre_paciente: str, cuenta_gestion: int, cuenta_internacion: int,
+        recortes_historial: Optional[List[RecorteHistorial]] = None
+    ) -> Dict[str, Any]:
+        """Campos que conocemos (no los genera el LLM)"""
+        return {
+            "id_medico": id_medico,
+            "nombre_medico": nombre_medico,
+            "id_persona_paciente": id_persona,
+            "nombre_paciente": nombre_paciente,
+            "id_evolucion": id_evolucion,
+            "fecha_atencion": str(fecha_atencion),
+            "cuenta_gestion": cuenta_gestion,
+            "cuenta_internacion": cuenta_internacion,
+            "diagnostico_urgencia": diagnostico or "Pendiente de codificación CIE-9",
+            "recortes_historial": recortes_historial or [],
+        }
+
+    def resultado_desde_cache(
+        self, clave_cache: str, metadata: Dict[str, Any], id_evolucion: int
+    ) -> Optional[AuditoriaUrgenciaResultado]:
+        """Resultado guardado en la caché local para esta clave, o None si no hay (o es inválido)"""
+        entrada = self.cache_resultados.obtener(clave_cache)
+        if not entrada:
+            return None
+        try:
+            metricas = MetricasAuditoria(modelo=entrada["modelo"], resultado_cacheado=True)
+            resultado = AuditoriaUrgenciaResultado(**entrada["respuesta"], **metadata, metricas=metricas)
+            logger.info(f"Evolución {id_evolucion}: resultado tomado de la caché local ({clave_cache[:12]})")
+            return resultado
+        except (KeyError, TypeError, ValidationError) as e:
+            logger.warning(f"Entrada de caché LLM inválida ({clave_cache[:12]}), se vuelve a auditar: {e}")
+            return None
+
+    # --- Auditorías empaquetadas: varias atenciones cortas en una sola llamada ---
+
+    @staticmethod
+    def construir_prompt_paquete(atenciones: List[Dict[str, Any]]) -> str:
+        """
+        Prompt de usuario con varias atenciones: los datos e historial de cada una bajo su
+        identificador de cuenta, y las mismas instrucciones de evaluación que la auditoría individual.
+        """
+        bloques = []
+        for atencion in atenciones:
+            datos = atencion["datos"]
+            bloques.append(f"""
+        ### Atención {atencion['cuenta']}
+        - ID Evolución: {datos['id_evolucion']}
+        - Fecha de atención: {datos['fecha_atencion']}
+        - Diagnóstico registrado: {datos['diagnostico']}
+        - ID Paciente: {datos['id_persona']}
+        - ID Médico: {datos['id_medico']}
+        - Médico tratante: {datos['nombre_medico']}
+
+        **Historial Clínico del Paciente:**
+        {atencion['historial']}
+        """)
+
+        cuerpo = "".join(bloques)
+        return f"""
+        Analiza las siguientes {len(atenciones)} atenciones de urgencias (pacientes distintos) y audita CADA UNA por separado según guías médicas internacionales. No mezcles información entre atenciones.
+        {cuerpo}
+{INSTRUCCIONES_EVALUACION}
+        **IMPORTANTE: Responde ÚNICAMENTE con un objeto JSON válido con el campo "auditorias": un array con un objeto por atención, en el mismo orden. Cada objeto incluye "cuenta" (el identificador de la atención, ej: "{atenciones[0]['cuenta']}") y esta estructura:**
+        - cuenta: string
+{CAMPOS_RESPUESTA_LLM}
+        NO incluyas los campos id_medico, nombre_medico, id_persona_paciente, id_evolucion, fecha_atencion, diagnostico_urgencia, nombre_paciente, cuenta_gestion, cuenta_internacion.
+        Responde SOLO con el JSON, sin texto adicional.
+        """
+
+    def auditar_paquete(self, atenciones: List[Dict[str, Any]]) -> Dict[str, AuditoriaUrgenciaResultado]:
+        """
+        Audita varias atenciones cortas en una sola llamada (el prompt de sistema se envía una vez).
+        Cada atención es un dict con "cuenta" (identificador único), "historial", "datos" (los
+        argumentos de auditar_atencion) y "recortes". Cada objeto de la respuesta se valida por
+        separado; retorna {cuenta: resultado} solo con los válidos: el llamador audita
+        individualmente las atenciones que falten.
+        """
+        resultados = {}
+        pendientes = []
+        for atencion in atenciones:
+            datos = atencion["datos"]
+            atencion = {
+                **atencion,
+                "metadata": self.metadata_auditoria(recortes_historial=atencion.get("recortes"), **datos),
+                "clave_cache": None
+            }
+            if self.cache_resultados:
+                # Misma clave que la auditoría individual: el resultado sirve para ambas
+                prompt_individual = self.construir_prompt_usuario(
+                    atencion["historial"], datos["id_evolucion"], datos["fecha_atencion"], datos["diagnostico"],
+                    datos["id_persona"], datos["id_medico"], datos["nombre_medico"]
+                )
+                atencion["clave_cache"] = self.cache_resultados.calcular_clave(
+                    [self.model_principal, self.model_fallback], prompt_individual
+                )
+                cacheado = self.resultado_desde_cache(atencion["clave_cache"], atencion["metadata"], datos["id_evolucion"])
+                if cacheado:
+                    resultados[atencion["cuenta"]] = cacheado
+                    continue
+            pendientes.append(atencion)
+
+        if len(pendientes) < 2:
+            # Una sola atención no se empaqueta: la audita el llamador de forma individual
+            return resultados
+
+        prompt_usuario = self.construir_prompt_paquete(pendientes)
+        mensajes = self._construir_mensajes(prompt_usuario)
+        tokens_estimados = estimar_tokens(PROMPT_SISTEMA + prompt_usuario) + TOKENS_SALIDA_ESTIMADOS * len(pendientes)
+
+        # Un intento por modelo: si el paquete falla, cada atención tiene sus propios reintentos individuales
+        for modelo in (self.model_principal, self.model_fallback):
+            try:
+                contenido, metricas = self._llamar(modelo, mensajes, tokens_estimados, self.response_format_paquete)
+                data, _ = cargar_json_tolerante((contenido or "").strip())
+                break
+            except Exception as e:
+                if isinstance(e, json.JSONDecodeError):
+                    self._contar("errores_json")
+                elif es_error_limite_tasa(e):
+                    self._contar("limitadas")
+                logger.warning(f"Auditoría empaquetada de {len(pendientes)} atenciones fallida con {modelo}: {e}")
+        else:
+            return resultados
+
+        objetos = data.get("auditorias", []) if isinstance(data, dict) else data
+        por_cuenta = {
+            str(objeto.get("cuenta", "")).strip(): objeto
+            for objeto in (objetos if isinstance(objetos, list) else []) if isinstance(objeto, dict)
+        }
+        n = len(pendientes)
+        for atencion in pendientes:
+            objeto = por_cuenta.get(atencion["cuenta"])
+            if objeto is None:
+                continue
+            metricas_atencion = metricas.model_copy(update={
+                "tokens_entrada": metricas.tokens_entrada // n,
+                "tokens_salida": metricas.tokens_salida // n,
+                "tokens_cacheados": metricas.tokens_cacheados // n,
+                "tokens_escritos_cache": metricas.tokens_escritos_cache // n,
+                "tamano_paquete": n
+            })
+            respuesta = {clave: valor for clave, valor in objeto.items() if clave != "cuenta"}
+            id_evolucion = atencion["datos"]["id_evolucion"]
+            try:
+                resultado = self._validar_respuesta(
+                    json.dumps(respuesta, ensure_ascii=False), metricas_atencion, atencion["metadata"], id_evolucion
+                )
+            except (ValueError, TypeError, ValidationError) as e:
+                logger.warning(f"Atención {atencion['cuenta']}: objeto inválido en la respuesta empaquetada: {e}")
+                continue
+            if atencion["clave_cache"]:
+                self.cache_resultados.guardar(
+                    atencion["clave_cache"], metricas.modelo, resultado.model_dump(exclude=set(CAMPOS_METADATA))
+                )
+            resultados[atencion["cuenta"]] = resultado
+
+        faltantes = n - sum(1 for atencion in pendientes if atencion["cuenta"] in resultados)
+        # Las faltantes se cuentan al auditarlas individualmente
+        self._contar("auditorias", n - faltantes)
+        logger.info(
+            f"Auditoría empaquetada con {metricas.modelo}: {n - faltantes}/{n} atenciones válidas "
+            f"en {metricas.latencia_segundos:.1f}s"
+        )
+        return resultados
+
+    # --- Auditoría por lotes (Message Batches) ---
+
+    def solicitud_lote(self, custom_id: str, prompt_usuario: str) -> Dict[str, Any]:
+        """Solicitud de un lote de Message Batches (mismo prompt de sistema, con cache_control si corresponde)"""
+        sistema = {"type": "text", "text": PROMPT_SISTEMA}
+        if self.cache_prompt:
+            sistema["cache_control"] = {"type": "ephemeral"}
+        return {
+            "custom_id": custom_id,
+            "params": {
+                "model": self.modelo_lote,
+                "max_tokens": TOKENS_MAXIMOS_LOTE,
+                "temperature": 0.3,
+                "system": [sistema],
+                "messages": [{"role": "user", "content": prompt_usuario}]
+            }
+        }
+
+    def resultado_lote(
+        self, resultado: Dict[str, Any], metadata: Dict[str, Any], id_evolucion: int,
+        clave_cache: Optional[str] = None
+    ) -> Optional[AuditoriaUrgenciaResultado]:
+        """
+        Convierte el resultado de una solicitud del lote en AuditoriaUrgenciaResultado
+        (con la misma reparación local que las llamadas directas). None si la solicitud
+        falló en el proveedor o la respuesta no es válida.
+        """
+        if resultado.get("type") != "succeeded":
+            logger.warning(f"Evolución {id_evolucion}: solicitud del lote sin resultado ({resultado.get('type')}): {resultado.get('error')}")
+            return None
+
+        self._contar("auditorias")
+        self._contar("llamadas")
+        mensaje = resultado.get("message") or {}
+        texto = "".join(bloque.get("text", "") for bloque in mensaje.get("content", []) if bloque.get("type") == "text")
+        uso = mensaje.get("usage") or {}
+        tokens_cacheados = uso.get("cache_read_input_tokens") or 0
+        tokens_escritos = uso.get("cache_creation_input_tokens") or 0
+        metricas = MetricasAuditoria(
+            modelo=mensaje.get("model") or self.modelo_lote,
+            tokens_entrada=(uso.get("input_tokens") or 0) + tokens_cacheados + tokens_escritos,
+            tokens_salida=uso.get("output_tokens") or 0,
+            tokens_cacheados=tokens_cacheados,
+            tokens_escritos_cache=tokens_escritos,
+            cache_hit=tokens_cacheados > 0,
+            resultado_lote=True
+        )
+        try:
+            resultado_auditoria = self._validar_respuesta(texto, metricas, metadata, id_evolucion)
+        except (ValueError, TypeError, ValidationError) as e:
+            logger.warning(f"Evolución {id_evolucion}: respuesta del lote inválida: {e}")
+            return None
+
+        if clave_cache and self.cache_resultados:
+            self.cache_resultados.guardar(
+                clave_cache, metricas.modelo, resultado_auditoria.model_dump(exclude=set(CAMPOS_METADATA))
+            )
+        return resultado_auditoria
+
+    def auditar_atencion(
+        self,
+        historial: str,
+        id_evolucion: int,
+        fecha_atencion: str,
+        diagnostico: str,
+        id_persona: int,
+        id_medico: int,
+        nombre_medico: str,
+        nombre_paciente: str,  # NUEVO
+        cuenta_gestion: int,   # NUEVO
+        cuenta_internacion: int,  # NUEVO
+        recortes_historial: Optional[List[RecorteHistorial]] = None,
+        usar_cache: bool = True
+    ) -> Optional[AuditoriaUrgenciaResultado]:
+        """
+        Audita una atención de urgencias según guías internacionales.
+        usar_cache=False no lee la caché local de resultados (el resultado nuevo sí se guarda).
+        """
+        prompt_usuario = self.construir_prompt_usuario(
+            historial, id_evolucion, fecha_atencion, diagnostico, id_persona, id_medico, nombre_medico
+        )
+        metadata = self.metadata_auditoria(
+            id_evolucion, fecha_atencion, diagnostico, id_persona, id_medico, nombre_medico,
+            nombre_paciente, cuenta_gestion, cuenta_internacion, recortes_historial
+        )
 
         modelos = [self.model_principal, self.model_fallback]
 
-        for modelo in modelos:
-            for intento in range(self.reintentos):
-                try:
-                    response = litellm.completion(
-                        model=modelo,
-                        messages=[
-                            {"role": "system", "content": prompt_sistema},
-                            {"role": "user", "content": prompt_usuario}
-                        ],
-                        temperature=0.3,
-                    )
+        clave_cache = None
+        if self.cache_resultados:
+            clave_cache = self.cache_resultados.calcular_clave(modelos, prompt_usuario)
+            resultado = self.resultado_desde_cache(clave_cache, metadata, id_evolucion) if usar_cache else None
+            if resultado:
+                return resultado
 
-                    content = response.choices[0].message.content.strip()
-                    if content.startswith("```json"):
-                        content = content[7:]
-                    if content.startswith("```"):
-                        content = content[3:]
-                    if content.endswith("```"):
-                        content = content[:-3]
-                    content = content.strip()
-
-                    data = json.loads(content)
-
-                    # Agregar campos que conocemos
-                    data["id_medico"] = id_medico
-                    data["nombre_medico"] = nombre_medico
-                    data["id_persona_paciente"] = id_persona
-                    data["nombre_paciente"] = nombre_paciente
-                    data["id_evolucion"] = id_evolucion
-                    data["fecha_atencion"] = str(fecha_atencion)
-                    data["cuenta_gestion"] = cuenta_gestion
-                    data["cuenta_internacion"] = cuenta_internacion
-                    data["diagnostico_urgencia"] = diagnostico or "Pendiente de codificación CIE-9"
-
-                    return AuditoriaUrgenciaResultado(**data)
+        self._contar("auditorias")
+        mensajes = self._construir_mensajes(prompt_usuario)
+        # Reserva en el bucket de tokens por minuto (se ajusta con el uso real al terminar)
+        tokens_estimados = estimar_tokens(PROMPT_SISTEMA + prompt_usuario) + TOKENS_SALIDA_ESTIMADOS
 
+        for numero_modelo, modelo in enumerate(modelos):
+            for intento in range(self.reintentos):
+                if intento or numero_modelo:
+                    self._contar("reintentos")
+                try:
+                    if self.cobertura and modelo == self.model_principal:
+                        resultado = self._intento_con_cobertura(mensajes, tokens_estimados, metadata, id_evolucion)
+                    else:
+                        resultado = self._intento(modelo, mensajes, tokens_estimados, metadata, id_evolucion)
                 except (Exception, ValidationError, json.JSONDecodeError) as e:
-                    logger.warning(f"Intento {intento + 1}/{self.reintentos} fallido con {modelo}. Error: {e}")
-                    time.sleep(2**intento)
+                    if es_error_limite_tasa(e):
+                        self._contar("limitadas")
+                        # La espera la impone el limitador (pausa compartida por todos los hilos)
+                        logger.warning(f"Intento {intento + 1}/{self.reintentos} con {modelo} limitado por tasa (429)")
+                    else:
+                        logger.warning(f"Intento {intento + 1}/{self.reintentos} fallido con {modelo}. Error: {e}")
+                        # Fuera del limitador: el backoff de un error no ocupa lugar de concurrencia
+                        time.sleep(2**intento)
+                    continue
+
+                if clave_cache:
+                    self.cache_resultados.guardar(
+                        clave_cache, resultado.metricas.modelo, resultado.model_dump(exclude=set(CAMPOS_METADATA))
+                    )
+                return resultado
 
             logger.warning(f"Fallaron todos los intentos con {modelo}, probando siguiente modelo...")
 
+        self._contar("fallidas")
         logger.error(f"Fallaron todos los modelos para la evolución {id_evolucion}")
         return None
 
 
+class ClienteLotesLLM:
+    """
+    Cliente de la API de lotes de Anthropic (Message Batches): se envían todas las solicitudes
+    de la auditoría en un trabajo, el proveedor las procesa de forma asíncrona (hasta 24 h, a
+    menor precio que las llamadas directas) y los resultados se descargan después.
+    LOTE_BASE_URL permite apuntar a un endpoint local compatible (ej: stub_llm.py).
+    """
+    def __init__(self, base_url: Optional[str] = None, api_key: Optional[str] = None, timeout: float = 120):
+        import requests
+
+        self.base_url = (base_url or os.getenv("LOTE_BASE_URL") or "https://api.anthropic.com").rstrip("/")
+        self.timeout = timeout
+        self.sesion = requests.Session()
+        self.sesion.headers.update({
+            "x-api-key": api_key or os.getenv("ANTHROPIC_API_KEY", ""),
+            "anthropic-version": VERSION_API_ANTHROPIC,
+            "content-type": "application/json"
+        })
+
+    def crear(self, solicitudes: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Envía un lote. Retorna el objeto del lote (id, processing_status, ...)"""
+        respuesta = self.sesion.post(
+            f"{self.base_url}/v1/messages/batches", json={"requests": solicitudes}, timeout=self.timeout
+        )
+        respuesta.raise_for_status()
+        return respuesta.json()
+
+    def consultar(self, id_lote: str) -> Dict[str, Any]:
+        """Estado actual del lote (processing_status: in_progress, canceling o ended)"""
+        respuesta = self.sesion.get(f"{self.base_url}/v1/messages/batches/{id_lote}", timeout=self.timeout)
+        respuesta.raise_for_status()
+        return respuesta.json()
+
+    def resultados(self, lote: Dict[str, Any]):
+        """Itera los resultados de un lote terminado (JSONL: custom_id + result), sin cargarlos completos"""
+        url = lote.get("results_url") or f"{self.base_url}/v1/messages/batches/{lote['id']}/results"
+        with self.sesion.get(url, stream=True, timeout=self.timeout) as respuesta:
+            respuesta.raise_for_status()
+            respuesta.encoding = "utf-8"
+            for linea in respuesta.iter_lines(decode_unicode=True):
+                if linea:
+                    yield json.loads(linea)
+
+
 # --- 4. Función Auxiliar: Formateo de datos para LLM ---
 
-def formatear_atencion_para_llm(detalle: Dict) -> str:
-    """Formatea los datos de la atención en texto estructurado para el LLM"""
+# Estimación de tokens sin el tokenizer del proveedor (texto clínico en español: ~3.5 caracteres por token)
+CARACTERES_POR_TOKEN = 3.5
+# Por debajo de este presupuesto una sección no se recorta: se omite completa
+MIN_TOKENS_SECCION = 150
+
+# Secciones del historial en orden de prioridad ASCENDENTE: si el historial excede el presupuesto
+# de tokens se recortan primero las primeras de la lista. Las evoluciones son lo último que se recorta
+# y las órdenes médicas (cortas) se conservan antes que los resultados, para no generar falsos
+# "no se solicitó".
+PRIORIDAD_SECCIONES_HISTORIAL = (
+    "notas_enfermeria", "ejecuciones_medicamentos", "signos_vitales", "estudios_imagen",
+    "laboratorios", "solicitudes_imagen", "solicitudes_laboratorio", "evoluciones_clinicas"
+)
+
+SEPARADOR_SECCION = "=" * 81
+
+
+class HistorialFormateado(BaseModel):
+    """Historial listo para el prompt, con su tamaño estimado y lo que se recortó"""
+    texto: str
+    tokens_estimados: int
+    recortes: List[RecorteHistorial] = Field(default_factory=list)
+
+
+def estimar_tokens(texto: str) -> int:
+    return math.ceil(len(texto) / CARACTERES_POR_TOKEN)
+
+
+def _banner(titulo: str) -> str:
+    return f"\n{SEPARADOR_SECCION}\n{titulo}\n{SEPARADOR_SECCION}\n"
+
+
+def _recortar_bloques(bloques: List[str], max_caracteres: int, omitidos_texto: str) -> Optional[str]:
+    """Conserva el primer bloque y los últimos que entren (bloques enteros). None si no entra ninguno."""
+    if not bloques or len(bloques[0]) > max_caracteres:
+        return None
+    disponibles = max_caracteres - len(bloques[0])
+    finales = []
+    for bloque in reversed(bloques[1:]):
+        if len(bloque) > disponibles:
+            break
+        finales.append(bloque)
+        disponibles -= len(bloque)
+    omitidos = len(bloques) - 1 - len(finales)
+    if not omitidos:
+        return "".join(bloques)
+    marca = f"\n[... {omitidos} {omitidos_texto} por límite de tokens del historial ...]\n"
+    return bloques[0] + marca + "".join(reversed(finales))
+
+
+def _recortar_texto(cuerpo: str, max_caracteres: int) -> str:
+    """
+    Conserva el inicio (1/3 del presupuesto) y el final (2/3) del texto, cortando en líneas o,
+    si es una sola línea (GROUP_CONCAT con ' | '), en registros.
+    """
+    separador = "\n" if "\n" in cuerpo.strip("\n") else " | "
+    unidades = cuerpo.split(separador)
+    limite_inicio = max_caracteres // 3
+    inicio, usados = [], 0
+    for unidad in unidades:
+        if usados + len(unidad) + len(separador) > limite_inicio:
+            break
+        inicio.append(unidad)
+        usados += len(unidad) + len(separador)
+    final = []
+    for unidad in reversed(unidades[len(inicio):]):
+        if usados + len(unidad) + len(separador) > max_caracteres:
+            break
+        final.append(unidad)
+        usados += len(unidad) + len(separador)
+
+    omitidas = len(unidades) - len(inicio) - len(final)
+    if not inicio and not final:
+        # Un único registro gigante: corte por caracteres
+        return (
+            cuerpo[:limite_inicio]
+            + "\n[... texto omitido por límite de tokens del historial ...]\n"
+            + cuerpo[len(cuerpo) - (max_caracteres - limite_inicio):]
+        )
+    marca = f"[... {omitidas} registros omitidos por límite de tokens del historial ...]"
+    return separador.join(inicio + [marca] + list(reversed(final)))
+
+
+def _recortar_seccion(seccion: Dict[str, Any], tokens_disponibles: int) -> str:
+    """Versión recortada de una sección que entra (aproximadamente) en `tokens_disponibles`"""
+    encabezado, pie = seccion["encabezado"], seccion["pie"]
+    omitida = (
+        f"[Sección omitida por límite de tokens del historial (~{estimar_tokens(''.join(seccion['bloques']))} tokens). "
+        f"La ausencia de datos en esta sección NO significa que no se hayan realizado.]\n"
+    )
+    max_caracteres = int(tokens_disponibles * CARACTERES_POR_TOKEN) - len(encabezado) - len(pie) - 120
+
+    cuerpo = None
+    if tokens_disponibles >= MIN_TOKENS_SECCION and max_caracteres > 0:
+        if len(seccion["bloques"]) > 1:
+            cuerpo = _recortar_bloques(seccion["bloques"], max_caracteres, seccion["omitidos"])
+        if cuerpo is None:
+            cuerpo = _recortar_texto("".join(seccion["bloques"]), max_caracteres)
+    return encabezado + (cuerpo if cuerpo is not None else omitida) + pie
+
+
+def construir_historial_llm(detalle: Dict, presupuesto_tokens: Optional[int] = None) -> HistorialFormateado:
+    """
+    Formatea la atención en texto estructurado para el LLM, por secciones.
+
+    Si el texto excede `presupuesto_tokens` (None/0 = sin límite) recorta las secciones de menor
+    prioridad (PRIORIDAD_SECCIONES_HISTORIAL) de forma determinística: conserva el inicio y el
+    final de cada sección, o la omite si no queda lugar, hasta entrar en el presupuesto.
+    Cada recorte queda registrado en `recortes`.
+    """
     import json as json_module
 
     # Parsear evoluciones clínicas
@@ -410,169 +1800,689 @@ def formatear_atencion_para_llm(detalle: Dict) -> str:
             except json_module.JSONDecodeError:
                 pass
 
-    texto = f"""
-=================================================================================
+    encabezado = f"""
+{SEPARADOR_SECCION}
 ATENCIÓN DE URGENCIAS - DETALLE COMPLETO
-=================================================================================
+{SEPARADOR_SECCION}
 
 INFORMACIÓN DE LA CUENTA:
 - Paciente ID: {detalle.get('persona_numero')}
 - Gestión: {detalle.get('cuenta_gestion')}
 - Número de Internación: {detalle.get('cuenta_internacion')}
 - ID de Cuenta: {detalle.get('cuenta_id')}
-
-=================================================================================
-EVOLUCIONES CLÍNICAS
-=================================================================================
 """
 
+    bloques_evoluciones = []
     for i, evo in enumerate(evoluciones, 1):
-        texto += f"\n--- Evolución #{i} ---\n"
-        texto += f"Fecha: {evo.get('fecha', 'N/A')}\n"
-        texto += f"Tipo: {evo.get('tipo_evento', 'N/A')}\n"
-        texto += f"Profesional: {evo.get('profesional', 'N/A')}\n"
+        bloque = f"\n--- Evolución #{i} ---\n"
+        bloque += f"Fecha: {evo.get('fecha', 'N/A')}\n"
+        bloque += f"Tipo: {evo.get('tipo_evento', 'N/A')}\n"
+        bloque += f"Profesional: {evo.get('profesional', 'N/A')}\n"
 
         if evo.get('diagnosticos'):
-            texto += f"\nDiagnósticos CIE9:\n{evo['diagnosticos']}\n"
+            bloque += f"\nDiagnósticos CIE9:\n{evo['diagnosticos']}\n"
         if evo.get('comentario_clinico'):
-            texto += f"\nComentario Clínico:\n{evo['comentario_clinico']}\n"
+            bloque += f"\nComentario Clínico:\n{evo['comentario_clinico']}\n"
         if evo.get('plan_medico'):
-            texto += f"\nPlan Médico:\n{evo['plan_medico']}\n"
+            bloque += f"\nPlan Médico:\n{evo['plan_medico']}\n"
         if evo.get('medicamentos_prescritos'):
-            texto += f"\nMedicamentos Prescritos:\n{evo['medicamentos_prescritos']}\n"
-
-        texto += "-" * 80 + "\n"
-
-    if detalle.get('signos_vitales'):
-        texto += f"""
-=================================================================================
-SIGNOS VITALES
-=================================================================================
-{detalle['signos_vitales']}
-
-"""
-
-    if detalle.get('ejecuciones_medicamentos'):
-        texto += f"""
-=================================================================================
-EJECUCIONES DE MEDICAMENTOS (ENFERMERÍA)
-=================================================================================
-{detalle['ejecuciones_medicamentos']}
-
-"""
-
-    if detalle.get('notas_enfermeria'):
-        texto += f"""
-=================================================================================
-NOTAS DE ENFERMERÍA
-=================================================================================
-{detalle['notas_enfermeria']}
-
-"""
-
-    if detalle.get('laboratorios'):
-        texto += f"""
-=================================================================================
-RESULTADOS DE LABORATORIO
-=================================================================================
-{detalle['laboratorios']}
-
-"""
+            bloque += f"\nMedicamentos Prescritos:\n{evo['medicamentos_prescritos']}\n"
+
+        bloque += "-" * 80 + "\n"
+        bloques_evoluciones.append(bloque)
+
+    # Secciones en el orden en que aparecen en el prompt
+    secciones = {
+        "evoluciones_clinicas": {
+            "encabezado": _banner("EVOLUCIONES CLÍNICAS"), "bloques": bloques_evoluciones,
+            "pie": "", "omitidos": "evoluciones intermedias omitidas"
+        }
+    }
+
+    for clave, titulo in (
+        ("signos_vitales", "SIGNOS VITALES"),
+        ("ejecuciones_medicamentos", "EJECUCIONES DE MEDICAMENTOS (ENFERMERÍA)"),
+        ("notas_enfermeria", "NOTAS DE ENFERMERÍA"),
+        ("laboratorios", "RESULTADOS DE LABORATORIO"),
+    ):
+        if detalle.get(clave):
+            secciones[clave] = {
+                "encabezado": _banner(titulo), "bloques": [detalle[clave]], "pie": "\n\n", "omitidos": "registros omitidos"
+            }
 
     if detalle.get('estudios_imagen'):
         imagenes = detalle['estudios_imagen'].split('\n---IMAGEN---\n')
-        texto += f"""
-=================================================================================
-ESTUDIOS DE IMAGEN
-=================================================================================
-"""
-        for img in imagenes:
-            texto += f"{img}\n{'-'*80}\n"
+        secciones["estudios_imagen"] = {
+            "encabezado": _banner("ESTUDIOS DE IMAGEN"),
+            "bloques": [f"{img}\n{'-'*80}\n" for img in imagenes],
+            "pie": "", "omitidos": "estudios intermedios omitidos"
+        }
 
     if detalle.get('solicitudes_laboratorio'):
-        texto += f"""
-=================================================================================
-SOLICITUDES DE LABORATORIO (ÓRDENES MÉDICAS)
-=================================================================================
-NOTA: Esta sección muestra TODOS los laboratorios SOLICITADOS por el médico,
+        secciones["solicitudes_laboratorio"] = {
+            "encabezado": _banner("SOLICITUDES DE LABORATORIO (ÓRDENES MÉDICAS)") + """NOTA: Esta sección muestra TODOS los laboratorios SOLICITADOS por el médico,
 independientemente de si ya tienen resultado. Un estudio que aparece aquí
 FUE SOLICITADO aunque no tenga resultado en la sección anterior.
 
-{detalle['solicitudes_laboratorio']}
-
-"""
+""",
+            "bloques": [detalle['solicitudes_laboratorio']], "pie": "\n\n", "omitidos": "registros omitidos"
+        }
 
     if detalle.get('solicitudes_imagen'):
-        texto += f"""
-=================================================================================
-SOLICITUDES DE IMAGEN (ÓRDENES MÉDICAS)
-=================================================================================
-NOTA: Esta sección muestra TODOS los estudios de imagen SOLICITADOS por el médico
+        secciones["solicitudes_imagen"] = {
+            "encabezado": _banner("SOLICITUDES DE IMAGEN (ÓRDENES MÉDICAS)") + """NOTA: Esta sección muestra TODOS los estudios de imagen SOLICITADOS por el médico
 (RX, TAC, Ecografías, RM, etc.), independientemente de si ya tienen informe.
 Un estudio que aparece aquí FUE SOLICITADO aunque no tenga resultado/informe
 en la sección "ESTUDIOS DE IMAGEN" anterior.
 
-{detalle['solicitudes_imagen']}
+""",
+            "bloques": [detalle['solicitudes_imagen']], "pie": "\n\n", "omitidos": "registros omitidos"
+        }
+
+    textos = {
+        clave: seccion["encabezado"] + "".join(seccion["bloques"]) + seccion["pie"]
+        for clave, seccion in secciones.items()
+    }
+    cierre = "=" * 80 + "\n"
+
+    def unir() -> str:
+        return encabezado + "".join(textos.values()) + cierre
+
+    texto = unir()
+    tokens = estimar_tokens(texto)
+    recortes = []
+
+    if presupuesto_tokens and tokens > presupuesto_tokens:
+        exceso = tokens - presupuesto_tokens
+        for clave in PRIORIDAD_SECCIONES_HISTORIAL:
+            if exceso <= 0:
+                break
+            if clave not in secciones:
+                continue
+            originales = estimar_tokens(textos[clave])
+            recortado = _recortar_seccion(secciones[clave], originales - exceso)
+            finales = estimar_tokens(recortado)
+            if finales >= originales:
+                continue
+            textos[clave] = recortado
+            exceso -= originales - finales
+            recortes.append(RecorteHistorial(
+                seccion=clave, tokens_originales=originales, tokens_finales=finales,
+                omitida="[Sección omitida" in recortado
+            ))
 
-"""
+        texto = unir()
+        tokens = estimar_tokens(texto)
+
+    return HistorialFormateado(texto=texto, tokens_estimados=tokens, recortes=recortes)
+
+
+def formatear_atencion_para_llm(detalle: Dict) -> str:
+    """Formatea los datos de la atención en texto estructurado para el LLM (historial completo, sin recortes)"""
+    return construir_historial_llm(detalle).texto
 
-    texto += "=" * 80 + "\n"
-    return texto
+
+# Registro del journal de estado con los datos de la corrida por lotes
+CLAVE_CORRIDA_LOTE = "corrida_lote"
+# Registro del journal de estado con la marca de agua del modo continuo
+CLAVE_MARCA_AGUA = "marca_agua"
 
 
 # --- 5. Componente: Gestor de Estado (simplificado para producción) ---
 
 class GestorDeEstado:
-    """Gestiona el estado del proceso de auditoría para permitir reanudación"""
-    def __init__(self, archivo_estado: str):
+    """
+    Gestiona el estado del proceso de auditoría para permitir reanudación.
+
+    El estado se persiste como un journal JSONL de solo-anexado: cada transición
+    (pendiente/completado/fallido) agrega una línea y se sincroniza a disco, de modo
+    que cada actualización cuesta O(1) y un corte a mitad de escritura solo puede
+    dañar la última línea (que se ignora al cargar). Al cargar se reproduce el journal
+    y, cuando acumula demasiadas líneas obsoletas, se compacta a una línea por cuenta.
+    También lee archivos de estado antiguos (un único objeto JSON).
+    """
+    def __init__(self, archivo_estado: str, compactar_cada: int = 1000, sincronizar_disco: bool = True):
         self.archivo_estado = archivo_estado
+        # Se compacta cuando el journal supera este número de líneas y el doble de cuentas vivas
+        self.compactar_cada = compactar_cada
+        self.sincronizar_disco = sincronizar_disco
+        self._lock = threading.Lock()
+        self._lineas_journal = 0
+        # Se reescribe al cargar si el archivo es del formato anterior o termina en una línea cortada
+        self._requiere_compactar = False
         self.estado = self._cargar_estado()
+        self._archivo = None
+        if self._requiere_compactar or self._lineas_journal > max(self.compactar_cada, 2 * len(self.estado)):
+            self._compactar()
 
     def _cargar_estado(self) -> Dict:
         if not os.path.exists(self.archivo_estado):
             return {}
         try:
             with open(self.archivo_estado, "r", encoding="utf-8") as f:
-                return json.load(f)
-        except (json.JSONDecodeError, IOError):
+                contenido = f.read()
+        except IOError:
             logger.warning(f"No se pudo leer '{self.archivo_estado}'. Se creará uno nuevo.")
             return {}
 
-    def _guardar_estado(self):
-        with open(self.archivo_estado, "w", encoding="utf-8") as f:
-            json.dump(self.estado, f, indent=4, ensure_ascii=False)
+        # Formato anterior: un único objeto JSON {id: {"status": ...}}
+        try:
+            legado = json.loads(contenido)
+            if isinstance(legado, dict) and "id" not in legado:
+                self._requiere_compactar = True
+                return legado
+        except json.JSONDecodeError:
+            pass
+
+        estado = {}
+        self._requiere_compactar = bool(contenido) and not contenido.endswith("\n")
+        lineas = contenido.splitlines()
+        for numero, linea in enumerate(lineas, 1):
+            if not linea.strip():
+                continue
+            try:
+                registro = json.loads(linea)
+                id_registro = registro.pop("id")
+            except (json.JSONDecodeError, KeyError, AttributeError):
+                # Una última línea incompleta es esperable tras un corte; otras se reportan
+                if numero != len(lineas):
+                    logger.warning(f"Línea {numero} inválida en '{self.archivo_estado}', se ignora")
+                continue
+            estado[id_registro] = registro
+            self._lineas_journal += 1
+        return estado
+
+    def _compactar(self):
+        """Reescribe el journal con una sola línea por cuenta (escritura atómica)"""
+        temporal = f"{self.archivo_estado}.tmp"
+        with open(temporal, "w", encoding="utf-8") as f:
+            for id_registro, registro in self.estado.items():
+                f.write(json.dumps({"id": id_registro, **registro}, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        if self._archivo:
+            self._archivo.close()
+        os.replace(temporal, self.archivo_estado)
+        self._lineas_journal = len(self.estado)
+        if self._archivo:
+            self._archivo = open(self.archivo_estado, "a", encoding="utf-8")
+
+    def _registrar(self, id_evolucion, registro: Dict):
+        """Aplica una transición en memoria y la anexa al journal (llamar con el lock tomado)"""
+        self.estado[str(id_evolucion)] = registro
+        if self._archivo is None:
+            self._archivo = open(self.archivo_estado, "a", encoding="utf-8")
+        self._archivo.write(json.dumps({"id": str(id_evolucion), **registro}, ensure_ascii=False) + "\n")
+        self._archivo.flush()
+        if self.sincronizar_disco:
+            os.fsync(self._archivo.fileno())
+        self._lineas_journal += 1
+        if self._lineas_journal > max(self.compactar_cada, 2 * len(self.estado)):
+            self._compactar()
 
     def marcar_pendiente(self, id_evolucion: int):
         """Marca una evolución como pendiente"""
-        self.estado[str(id_evolucion)] = {"status": "pendiente"}
-        self._guardar_estado()
+        with self._lock:
+            self._registrar(id_evolucion, {"status": "pendiente"})
 
     def marcar_completado(self, id_evolucion: int):
         """Marca una evolución como completada"""
-        self.estado[str(id_evolucion)] = {"status": "completado"}
-        self._guardar_estado()
+        with self._lock:
+            self._registrar(id_evolucion, {"status": "completado"})
 
     def marcar_fallido(self, id_evolucion: int, error: str = ""):
         """Marca una evolución como fallida"""
-        self.estado[str(id_evolucion)] = {"status": "fallido", "error": error}
-        self._guardar_estado()
+        with self._lock:
+            self._registrar(id_evolucion, {"status": "fallido", "error": error})
+
+    # --- Modo lote: la corrida, los lotes enviados y las cuentas de cada lote quedan en el journal ---
+
+    def registrar_corrida_lote(self, output_file: str):
+        """Registra el archivo de resultados de la corrida por lotes (para retomarla tras un reinicio)"""
+        with self._lock:
+            self._registrar(CLAVE_CORRIDA_LOTE, {
+                "status": "lote", "output_file": output_file,
+                "creado": datetime.now().isoformat(timespec="seconds")
+            })
+
+    def corrida_lote(self) -> Optional[Dict]:
+        """Datos de la corrida por lotes en curso (None si no hay)"""
+        return self.estado.get(CLAVE_CORRIDA_LOTE)
+
+    def registrar_lote(self, id_lote: str, solicitudes: int):
+        """Registra un lote enviado al proveedor"""
+        with self._lock:
+            self._registrar(f"lote:{id_lote}", {
+                "status": "lote_enviado", "solicitudes": solicitudes,
+                "enviado": datetime.now().isoformat(timespec="seconds")
+            })
+
+    def marcar_lote_ingerido(self, id_lote: str):
+        """Marca un lote como descargado (sus cuentas ya tienen estado propio)"""
+        with self._lock:
+            registro = dict(self.estado.get(f"lote:{id_lote}", {}))
+            registro.update(status="lote_ingerido", ingerido=datetime.now().isoformat(timespec="seconds"))
+            self._registrar(f"lote:{id_lote}", registro)
+
+    def lotes_pendientes(self) -> List[str]:
+        """IDs de los lotes enviados que todavía no se descargaron"""
+        return [
+            id_registro.split(":", 1)[1] for id_registro, registro in self.estado.items()
+            if id_registro.startswith("lote:") and registro.get("status") == "lote_enviado"
+        ]
+
+    def marcar_en_lote(self, id_evolucion, id_lote: str, datos: Dict):
+        """Marca una cuenta como enviada en un lote, con los datos necesarios para ingerir su resultado"""
+        with self._lock:
+            self._registrar(id_evolucion, {"status": "en_lote", "lote": id_lote, **datos})
+
+    def cuentas_en_lote(self, id_lote: str) -> Dict[str, Dict]:
+        """Cuentas del lote que siguen esperando su resultado"""
+        return {
+            id_registro: registro for id_registro, registro in self.estado.items()
+            if registro.get("status") == "en_lote" and registro.get("lote") == id_lote
+        }
+
+    def registrar_marca_agua(self, marca: str):
+        """Guarda la fecha del último cierre ya auditado por el modo continuo"""
+        with self._lock:
+            self._registrar(CLAVE_MARCA_AGUA, {
+                "status": "marca_agua", "valor": marca,
+                "actualizada": datetime.now().isoformat(timespec="seconds")
+            })
+
+    def marca_agua(self) -> Optional[str]:
+        """Marca de agua del modo continuo ('YYYY-MM-DD HH:MM:SS'), None si nunca se registró"""
+        registro = self.estado.get(CLAVE_MARCA_AGUA)
+        return registro.get("valor") if registro else None
+
+    def registrar_bloque(self, inicio: str, atenciones: int, fallidas: int):
+        """Checkpoint de un bloque del backfill: completo si todas sus cuentas quedaron auditadas"""
+        with self._lock:
+            self._registrar(f"bloque:{inicio}", {
+                "status": "bloque_completo" if not fallidas else "bloque_con_fallas",
+                "atenciones": atenciones, "fallidas": fallidas,
+                "registrado": datetime.now().isoformat(timespec="seconds")
+            })
+
+    def bloques_completos(self) -> set:
+        """Inicios de los bloques del backfill ya completos (no se vuelven a consultar)"""
+        with self._lock:
+            return {
+                id_registro[len("bloque:"):] for id_registro, registro in self.estado.items()
+                if id_registro.startswith("bloque:") and registro.get("status") == "bloque_completo"
+            }
 
     def esta_procesado(self, id_evolucion: int) -> bool:
         """Verifica si una evolución ya fue procesada"""
         return str(id_evolucion) in self.estado and \
                self.estado[str(id_evolucion)].get("status") == "completado"
 
+    def cerrar(self):
+        """Cierra el journal (las transiciones ya están en disco; se reabre si hay más)"""
+        with self._lock:
+            if self._archivo:
+                self._archivo.close()
+                self._archivo = None
+
+
+class IndiceAuditorias:
+    """
+    Índice persistente de cuentas auditadas, compartido entre ejecuciones.
+
+    Cada ejecución de main.py tiene su propio archivo de tracking, por lo que una cuenta
+    que aparece en dos ventanas de 24h consecutivas se volvería a auditar. El índice
+    guarda, por cuenta (gestion-internacion-id), la huella de sus evoluciones en el
+    momento de la auditoría (última fecha y cantidad) para saltar las que no cambiaron.
+
+    Cada registro se anexa como una línea al journal `<archivo_indice>.journal` (O(1) por
+    auditoría); el índice completo se reescribe una sola vez, al cargar y al cerrar.
+    """
+    def __init__(self, archivo_indice: str, dias_retencion: int = 90):
+        self.archivo_indice = archivo_indice
+        self.archivo_journal = f"{archivo_indice}.journal"
+        self.dias_retencion = dias_retencion
+        self._lock = threading.Lock()
+        self._archivo = None
+        self.indice = self._cargar_indice()
+        if os.path.exists(self.archivo_journal):
+            self._compactar()
+
+    def _cargar_indice(self) -> Dict:
+        indice = {}
+        if os.path.exists(self.archivo_indice):
+            try:
+                with open(self.archivo_indice, "r", encoding="utf-8") as f:
+                    indice = json.load(f)
+            except (json.JSONDecodeError, IOError):
+                logger.warning(f"No se pudo leer el índice '{self.archivo_indice}'. Se creará uno nuevo.")
+                indice = {}
+
+        # Registros posteriores a la última compactación (una última línea cortada se ignora)
+        if os.path.exists(self.archivo_journal):
+            try:
+                with open(self.archivo_journal, "r", encoding="utf-8") as f:
+                    for linea in f:
+                        try:
+                            registro = json.loads(linea)
+                            indice[registro.pop("id")] = registro
+                        except (json.JSONDecodeError, KeyError, AttributeError):
+                            continue
+            except IOError:
+                logger.warning(f"No se pudo leer el journal del índice '{self.archivo_journal}'")
+
+        # Descartar cuentas auditadas hace más de dias_retencion (ya no caen en la ventana de 24h)
+        limite = datetime.now().timestamp() - self.dias_retencion * 86400
+        return {
+            cuenta: entrada for cuenta, entrada in indice.items()
+            if entrada.get("auditado_ts", 0) >= limite
+        }
+
+    def _compactar(self):
+        """Reescribe el índice completo (escritura atómica) y vacía el journal (llamar sin escrituras en curso)"""
+        if self._archivo:
+            self._archivo.close()
+            self._archivo = None
+        temporal = f"{self.archivo_indice}.tmp"
+        with open(temporal, "w", encoding="utf-8") as f:
+            json.dump(self.indice, f, indent=1, ensure_ascii=False)
+        os.replace(temporal, self.archivo_indice)
+        if os.path.exists(self.archivo_journal):
+            os.remove(self.archivo_journal)
+
+    @staticmethod
+    def _huella(atencion: Dict) -> Optional[Dict]:
+        """Huella de cambios de la cuenta según el listado de 24h (None si la query no la trae)"""
+        if atencion.get('ultima_evolucion') is None or atencion.get('num_evoluciones') is None:
+            return None
+        return {
+            "ultima_evolucion": str(atencion['ultima_evolucion']),
+            "num_evoluciones": int(atencion['num_evoluciones'])
+        }
+
+    def sin_cambios(self, id_unico: str, atencion: Dict) -> bool:
+        """True si la cuenta ya fue auditada y no tiene evoluciones nuevas desde entonces"""
+        huella = self._huella(atencion)
+        if huella is None:
+            return False
+        with self._lock:
+            entrada = self.indice.get(id_unico)
+        return entrada is not None and \
+            entrada.get("ultima_evolucion") == huella["ultima_evolucion"] and \
+            entrada.get("num_evoluciones") == huella["num_evoluciones"]
+
+    def registrar(self, id_unico: str, atencion: Dict, archivo_resultado: str = ""):
+        """Registra la huella de la cuenta recién auditada"""
+        huella = self._huella(atencion)
+        if huella is None:
+            return
+        entrada = {
+            **huella,
+            "auditado": datetime.now().isoformat(timespec="seconds"),
+            "auditado_ts": datetime.now().timestamp(),
+            "archivo": archivo_resultado
+        }
+        with self._lock:
+            self.indice[id_unico] = entrada
+            if self._archivo is None:
+                self._archivo = open(self.archivo_journal, "a", encoding="utf-8")
+            # Sin fsync: perder los últimos registros tras un corte solo provoca una re-auditoría
+            self._archivo.write(json.dumps({"id": id_unico, **entrada}, ensure_ascii=False) + "\n")
+            self._archivo.flush()
+
+    def cerrar(self):
+        """Consolida el journal en el índice (una reescritura por ejecución)"""
+        with self._lock:
+            if self._archivo is not None or os.path.exists(self.archivo_journal):
+                self._compactar()
+
+
+class EscritorJSONL:
+    """
+    Escritor de resultados JSONL de larga vida, seguro entre hilos.
+
+    Mantiene el archivo abierto y acumula líneas completas en un buffer que se vuelca
+    cada `lineas_por_flush` líneas o cada `segundos_por_flush` segundos (lo que ocurra
+    primero), con fsync opcional. Cada volcado escribe solo líneas enteras en una única
+    llamada, de modo que un lector nunca ve un registro a medias salvo, como mucho, el
+    último si el proceso se corta durante la escritura.
+
+    `al_persistir` se ejecuta cuando la línea ya está en disco: permite marcar la cuenta
+    como completada sin riesgo de perder un resultado que quedó en el buffer.
+    """
+    def __init__(
+        self, ruta: str, lineas_por_flush: int = 20, segundos_por_flush: Optional[float] = 5.0,
+        sincronizar_disco: bool = True
+    ):
+        self.ruta = ruta
+        self.lineas_por_flush = max(1, lineas_por_flush)
+        self.segundos_por_flush = segundos_por_flush
+        self.sincronizar_disco = sincronizar_disco
+        self._lock = threading.Lock()
+        self._buffer: List[str] = []
+        self._callbacks = []
+        self._archivo = None
+        self._detener = threading.Event()
+        self._hilo = None
+
+    def _volcado_periodico(self):
+        while not self._detener.wait(self.segundos_por_flush):
+            self.flush()
+
+    def escribir(self, linea: str, al_persistir=None):
+        """Encola una línea JSON (sin salto de línea final) para escribirla en el próximo volcado"""
+        if "\n" in linea:
+            raise ValueError("Cada registro JSONL debe ocupar una sola línea")
+        with self._lock:
+            self._buffer.append(linea + "\n")
+            if al_persistir:
+                self._callbacks.append(al_persistir)
+            lleno = len(self._buffer) >= self.lineas_por_flush
+            # El volcado por tiempo se inicia con la primera escritura (y tras cada cerrar())
+            if self.segundos_por_flush and self._hilo is None:
+                self._detener.clear()
+                self._hilo = threading.Thread(target=self._volcado_periodico, name="escritor-jsonl", daemon=True)
+                self._hilo.start()
+        if lleno:
+            self.flush()
+
+    def flush(self):
+        """Vuelca el buffer al archivo y ejecuta los callbacks de las líneas persistidas"""
+        with self._lock:
+            if not self._buffer:
+                return
+            if self._archivo is None:
+                self._archivo = open(self.ruta, "a", encoding="utf-8")
+            self._archivo.write("".join(self._buffer))
+            self._archivo.flush()
+            if self.sincronizar_disco:
+                os.fsync(self._archivo.fileno())
+            self._buffer = []
+            callbacks, self._callbacks = self._callbacks, []
+
+        # Fuera del lock: los callbacks toman sus propios locks (estado, índice)
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"Error en callback posterior a la escritura de {self.ruta}: {e}")
+
+    def cerrar(self):
+        """Vuelca lo pendiente y cierra el archivo (se reabre si se vuelve a escribir)"""
+        with self._lock:
+            hilo, self._hilo = self._hilo, None
+        self._detener.set()
+        if hilo and hilo is not threading.current_thread():
+            hilo.join()
+        self.flush()
+        with self._lock:
+            if self._archivo:
+                self._archivo.close()
+                self._archivo = None
+
+
+class ReporteIncremental:
+    """
+    Reporte HTML que se actualiza durante la ejecución, sin volver a leer el JSONL.
+
+    Mantiene en memoria el análisis (AcumuladorAnalisis) y los registros ya persistidos,
+    y re-renderiza el HTML cada `cada_resultados` resultados nuevos o cuando pasaron
+    `cada_segundos` desde el último renderizado. El archivo se reemplaza de forma atómica:
+    quien lo abra durante la ejecución ve siempre un reporte completo (parcial en datos).
+
+    El renderizado corre en un hilo propio: agregar() (llamado desde el callback de escritura
+    del JSONL, en un worker o en el hilo de volcado) solo acumula y, si corresponde, lo avisa.
+    Si llegan resultados mientras se renderiza, los avisos se agrupan en un solo renderizado.
+    """
+    def __init__(self, ruta: str, cada_resultados: int = 50, cada_segundos: float = 120, modo: str = "completo"):
+        self.ruta = ruta
+        self.cada_resultados = max(1, cada_resultados)
+        self.cada_segundos = cada_segundos
+        self.modo = modo
+        self._lock = threading.Lock()
+        self._lock_render = threading.Lock()
+        self._acumulador = AcumuladorAnalisis()
+        self._registros: List[Dict[str, Any]] = []
+        self._nuevos = 0
+        self._aviso = threading.Event()
+        self._detener = threading.Event()
+        self._hilo: Optional[threading.Thread] = None
+
+    def cargar(self, archivo: str):
+        """
+        Parte de los resultados que ya están en el JSONL (corrida reanudada, reinicio del modo continuo
+        o backfill repetido): el primer renderizado no debe dejar afuera lo auditado antes.
+        """
+        try:
+            registros = list(iterar_registros(archivo))
+        except (OSError, ValueError) as e:
+            logger.warning(f"No se pudieron cargar los resultados previos de {archivo} en el reporte: {e}")
+            return
+        with self._lock:
+            for registro in registros:
+                self._acumulador.agregar(registro)
+            self._registros.extend(registros)
+        if registros:
+            logger.info(f"Reporte HTML: {len(registros)} resultados previos cargados desde {archivo}")
+
+    def agregar(self, registro: Dict[str, Any]):
+        """Suma un resultado ya persistido; avisa al hilo de renderizado si se alcanzó el umbral"""
+        with self._lock:
+            self._acumulador.agregar(registro)
+            self._registros.append(registro)
+            self._nuevos += 1
+            vencido = self._nuevos >= self.cada_resultados
+            if self._hilo is None:
+                self._hilo = threading.Thread(target=self._renderizar_en_segundo_plano, name="reporte-html", daemon=True)
+                self._hilo.start()
+        if vencido:
+            self._aviso.set()
+
+    def _renderizar_en_segundo_plano(self):
+        """Renderiza al recibir un aviso o cada `cada_segundos` si hay resultados nuevos"""
+        while not self._detener.is_set():
+            self._aviso.wait(timeout=self.cada_segundos)
+            self._aviso.clear()
+            if self._detener.is_set():
+                break
+            with self._lock:
+                pendiente = self._nuevos > 0
+            if pendiente:
+                self._renderizar()
+
+    def actualizar(self) -> bool:
+        """
+        Detiene el hilo de renderizado y escribe el reporte final con todos los resultados
+        acumulados. Retorna True si el archivo quedó escrito.
+        """
+        with self._lock:
+            hilo, self._hilo = self._hilo, None
+        if hilo is not None:
+            self._detener.set()
+            self._aviso.set()
+            hilo.join()
+            self._detener.clear()
+            self._aviso.clear()
+        return self._renderizar()
+
+    def _renderizar(self) -> bool:
+        """Renderiza el reporte con los resultados acumulados. Retorna True si el archivo está al día."""
+        with self._lock_render:
+            try:
+                with self._lock:
+                    if not self._registros:
+                        return False
+                    if not self._nuevos and os.path.exists(self.ruta):
+                        return True  # ya está al día
+                    registros = list(self._registros)
+                    analisis = self._acumulador.resultado()
+                    self._nuevos = 0
+
+                temporal = f"{self.ruta}.tmp"
+                renderizar_html(registros, analisis, self.modo).escribir(temporal)
+                os.replace(temporal, self.ruta)
+                logger.info(f"Reporte HTML actualizado: {self.ruta} ({len(registros)} atenciones)")
+                return True
+            except Exception as e:
+                logger.warning(f"No se pudo actualizar el reporte HTML {self.ruta}: {e}")
+                return False
+
 
 # --- 6. Orquestador Principal de Producción ---
 
 class OrquestadorAuditoriaProduccion:
     """Orquesta el proceso completo de auditoría diaria de urgencias"""
-    def __init__(self, output_file: str, state_file: str):
+    def __init__(
+        self, output_file: str, state_file: str, max_concurrencia: int = 1, tamano_lote_detalle: int = 50,
+        usar_cache_llm: Optional[bool] = None, indice_file: Optional[str] = None, forzar: bool = False,
+        reporte_file: Optional[str] = None
+    ):
         load_dotenv()
         self.mcp_client = MCPClient()
-        self.auditor_llm = AuditorLLM()
+        # usar_cache_llm=None respeta LLM_CACHE_RESULTADOS; False fuerza llamadas nuevas al LLM
+        self.auditor_llm = AuditorLLM(cache_resultados=usar_cache_llm)
         self.output_file = output_file
         self.gestor_estado = GestorDeEstado(archivo_estado=state_file)
+        # Índice de cuentas auditadas entre ejecuciones (forzar=True re-audita aunque no cambien)
+        self.indice = IndiceAuditorias(indice_file or os.path.join("output", "indice_auditorias.json"))
+        self.forzar = forzar
+        # Número máximo de auditorías LLM en curso al mismo tiempo (1 = secuencial)
+        self.max_concurrencia = max(1, max_concurrencia)
+        # Cantidad de cuentas por cada consulta de detalle en lote
+        self.tamano_lote_detalle = tamano_lote_detalle
+        # Presupuesto de tokens del historial enviado al LLM (0 = sin límite)
+        self.max_tokens_historial = int(os.getenv("LLM_MAX_TOKENS_HISTORIAL", "60000"))
+        # Empaquetado: hasta LLM_PAQUETE_MAX_ATENCIONES historiales de menos de LLM_PAQUETE_MAX_TOKENS
+        # tokens se auditan en una sola llamada (1 = desactivado)
+        self.paquete_max_atenciones = int(os.getenv("LLM_PAQUETE_MAX_ATENCIONES", "1"))
+        self.paquete_max_tokens = int(os.getenv("LLM_PAQUETE_MAX_TOKENS", "2000"))
+        self._abrir_salida(output_file, reporte_file)
+        # Cliente de la API de lotes (solo modo lote; se crea al usarlo)
+        self.cliente_lotes: Optional[ClienteLotesLLM] = None
+        # Modo continuo: ciclos fallidos por cuenta (retienen la marca de agua hasta CONTINUO_REINTENTOS)
+        self.fallos_continuo: Dict[str, int] = {}
+
+    def _abrir_salida(self, output_file: str, reporte_file: Optional[str] = None):
+        """Crea el escritor del JSONL de resultados y el reporte HTML en vivo asociado"""
+        self.output_file = output_file
+        # Los resultados se escriben con buffer; la cuenta se marca completada recién cuando
+        # su línea está en disco (JSONL_LINEAS_POR_FLUSH / JSONL_SEGUNDOS_POR_FLUSH / JSONL_FSYNC)
+        self.escritor = EscritorJSONL(
+            output_file,
+            lineas_por_flush=int(os.getenv("JSONL_LINEAS_POR_FLUSH", "20")),
+            segundos_por_flush=float(os.getenv("JSONL_SEGUNDOS_POR_FLUSH", "5")),
+            sincronizar_disco=os.getenv("JSONL_FSYNC", "1") != "0"
+        )
+        # Reporte HTML en vivo, con los resultados ya persistidos
+        # (REPORTE_CADA_RESULTADOS / REPORTE_CADA_SEGUNDOS / REPORTE_MODO)
+        self.reporte = ReporteIncremental(
+            reporte_file or output_file.replace('.jsonl', '.html'),
+            cada_resultados=int(os.getenv("REPORTE_CADA_RESULTADOS", "50")),
+            cada_segundos=float(os.getenv("REPORTE_CADA_SEGUNDOS", "120")),
+            modo=os.getenv("REPORTE_MODO", "completo")
+        )
+        if os.path.exists(output_file):
+            self.reporte.cargar(output_file)
 
     def run_auditoria_24h(self):
         """Ejecuta la auditoría de todas las atenciones de las últimas 24 horas"""
@@ -580,13 +2490,34 @@ class OrquestadorAuditoriaProduccion:
         logger.info("INICIO DE AUDITORÍA DIARIA - URGENCIAS")
         logger.info("="*80)
 
+        obtenidas = self._obtener_atenciones()
+        if obtenidas is None:
+            return
+        atenciones, total_atenciones, sin_cambios = obtenidas
+
+        # 4. Procesar cada atención
+        logger.info(f"\nIniciando procesamiento de atenciones (concurrencia: {self.max_concurrencia})...")
+        procesadas, fallidas = self._procesar_atenciones(atenciones)
+        self.escritor.cerrar()
+        reporte_generado = self.reporte.actualizar()
+
+        # 5. Resumen final
+        self._resumen(total_atenciones, sin_cambios, procesadas, fallidas, reporte_generado)
+        self.gestor_estado.cerrar()
+        self.indice.cerrar()
+
+    def _obtener_atenciones(self) -> Optional[Tuple[List[Dict], int, int]]:
+        """
+        Lista las atenciones de las últimas 24 horas y descarta las que no cambiaron desde su
+        última auditoría. Retorna (atenciones por auditar, total encontradas, sin cambios) o None.
+        """
         # 1. Obtener TODAS las atenciones de las últimas 24 horas
         logger.info("Obteniendo atenciones de las últimas 24 horas...")
         atenciones = self.mcp_client.get_todas_atenciones_24h()
 
         if not atenciones or len(atenciones) == 0:
             logger.warning("No se encontraron atenciones en las últimas 24 horas")
-            return
+            return None
 
         total_atenciones = len(atenciones)
         logger.info(f"Total de atenciones encontradas: {total_atenciones}")
@@ -606,96 +2537,838 @@ class OrquestadorAuditoriaProduccion:
         for medico_id, info in medicos_map.items():
             logger.info(f"  - {info['nombre']}: {len(info['atenciones'])} atenciones")
 
-        # 3. Procesar cada atención
-        logger.info("\nIniciando procesamiento de atenciones...")
-        procesadas = 0
-        fallidas = 0
+        # 3. Descartar cuentas sin evoluciones nuevas desde su última auditoría
+        atenciones, sin_cambios = self._descartar_sin_cambios(atenciones)
+        return atenciones, total_atenciones, sin_cambios
+
+    def _descartar_sin_cambios(self, atenciones: List[Dict]) -> Tuple[List[Dict], int]:
+        """Descarta las cuentas ya auditadas sin evoluciones nuevas (salvo forzar). Retorna (por auditar, omitidas)."""
+        if self.forzar:
+            return atenciones, 0
+        por_auditar = [
+            a for a in atenciones
+            if not self.indice.sin_cambios(self._id_unico(a), a)
+        ]
+        sin_cambios = len(atenciones) - len(por_auditar)
+        if sin_cambios:
+            logger.info(f"Atenciones sin cambios desde su última auditoría (se omiten): {sin_cambios}")
+        return por_auditar, sin_cambios
+
+    def _resumen(self, total_atenciones: int, sin_cambios: int, procesadas: int, fallidas: int, reporte_generado: bool):
+        """Resumen final de la auditoría en el log"""
+        logger.info("\n" + "="*80)
+        logger.info("RESUMEN DE AUDITORÍA")
+        logger.info("="*80)
+        logger.info(f"Total de atenciones: {total_atenciones}")
+        logger.info(f"Sin cambios (omitidas): {sin_cambios}")
+        logger.info(f"Procesadas exitosamente: {procesadas}")
+        logger.info(f"Fallidas: {fallidas}")
+        logger.info(f"LLM: {self.auditor_llm.resumen_estadisticas()}")
+        logger.info(f"Resultados guardados en: {self.output_file}")
+        if reporte_generado:
+            logger.info(f"Reporte HTML: {self.reporte.ruta}")
+        logger.info("="*80)
 
-        for idx, atencion in enumerate(atenciones, 1):
-            # Crear ID único basado en la CUENTA (no en evolución)
-            # Esto garantiza que cada atención se procese solo una vez
-            id_unico = f"{atencion['cuenta_gestion']}-{atencion['cuenta_internacion']}-{atencion['cuenta_id']}"
-            cuenta_formato = f"{atencion['cuenta_gestion']}/{atencion['cuenta_internacion']}"
+    def _procesar_atenciones(self, atenciones: List[Dict]) -> Tuple[int, int]:
+        """
+        Procesa una lista de atenciones, en paralelo si max_concurrencia > 1.
+        Retorna (procesadas, fallidas).
+        """
+        total = len(atenciones)
+        tareas = self._tareas_auditoria(atenciones)
 
-            # Verificar si ya fue procesada
-            if self.gestor_estado.esta_procesado(id_unico):
-                logger.info(f"[{idx}/{total_atenciones}] Atención {cuenta_formato} ya procesada. Saltando.")
-                procesadas += 1
+        if self.max_concurrencia == 1:
+            exitos = [self._ejecutar_tarea(*tarea) for tarea in tareas]
+        else:
+            with ThreadPoolExecutor(max_workers=self.max_concurrencia, thread_name_prefix="auditor") as pool:
+                futuros = [pool.submit(self._ejecutar_tarea, *tarea) for tarea in tareas]
+                exitos = [futuro.result() for futuro in futuros]
+
+        procesadas = sum(exitos)
+        return procesadas, total - procesadas
+
+    def _tareas_auditoria(self, atenciones: List[Dict]) -> List[Tuple[Any, Tuple, List[Dict]]]:
+        """
+        Precarga el detalle y arma las tareas de auditoría (paquetes e individuales) de las atenciones.
+        Retorna (función, argumentos, atenciones que cubre), para ejecutar con _ejecutar_tarea.
+        """
+        total = len(atenciones)
+        detalles = self._precargar_detalles(atenciones)
+
+        individuales = list(enumerate(atenciones, 1))
+        paquetes = []
+        if self.paquete_max_atenciones > 1:
+            paquetes, individuales = self._armar_paquetes(individuales, detalles)
+
+        def procesar(idx: int, atencion: Dict) -> int:
+            detalle = detalles.get(self._clave_cuenta(atencion))
+            return int(self._procesar_atencion(idx, total, atencion, detalle))
+
+        tareas = [
+            (self._procesar_paquete, (paquete, total), [atencion for _, atencion, _, _ in paquete])
+            for paquete in paquetes
+        ]
+        tareas += [(procesar, (idx, atencion), [atencion]) for idx, atencion in individuales]
+        return tareas
+
+    def _ejecutar_tarea(self, funcion, argumentos: Tuple, atenciones: List[Dict]) -> int:
+        """
+        Ejecuta una tarea de _tareas_auditoria y retorna cuántas atenciones quedaron procesadas.
+        Un error inesperado (ej: al escribir el resultado) marca fallidas las atenciones de la
+        tarea que no quedaron completadas, sin detener al resto de la corrida.
+        """
+        try:
+            return funcion(*argumentos)
+        except Exception as e:
+            cuentas = ", ".join(f"{a['cuenta_gestion']}/{a['cuenta_internacion']}" for a in atenciones)
+            logger.error(f"Error inesperado en la tarea de auditoría de {cuentas}: {e}", exc_info=True)
+            for atencion in atenciones:
+                id_unico = self._id_unico(atencion)
+                if not self.gestor_estado.esta_procesado(id_unico):
+                    self.gestor_estado.marcar_fallido(id_unico, f"Error inesperado: {e}")
+            return 0
+
+    def _armar_paquetes(
+        self, indexadas: List[Tuple[int, Dict]], detalles: Dict[Tuple[int, int, int], Dict]
+    ) -> Tuple[List[List[Tuple[int, Dict, Dict, HistorialFormateado]]], List[Tuple[int, Dict]]]:
+        """
+        Agrupa las atenciones pendientes con historial corto (sin recortes y de hasta
+        paquete_max_tokens tokens) en paquetes de hasta paquete_max_atenciones.
+        Retorna (paquetes, atenciones que se auditan individualmente).
+        """
+        cortas = []
+        individuales = []
+        for idx, atencion in indexadas:
+            detalle = detalles.get(self._clave_cuenta(atencion))
+            if detalle is None or self.gestor_estado.esta_procesado(self._id_unico(atencion)):
+                individuales.append((idx, atencion))
                 continue
+            historial = construir_historial_llm(detalle, self.max_tokens_historial)
+            if historial.recortes or historial.tokens_estimados > self.paquete_max_tokens:
+                individuales.append((idx, atencion))
+            else:
+                cortas.append((idx, atencion, detalle, historial))
+
+        paquetes = [
+            cortas[inicio:inicio + self.paquete_max_atenciones]
+            for inicio in range(0, len(cortas), self.paquete_max_atenciones)
+        ]
+        if paquetes and len(paquetes[-1]) == 1:
+            idx, atencion, _, _ = paquetes.pop()[0]
+            individuales.append((idx, atencion))
+        if paquetes:
+            logger.info(
+                f"{sum(len(paquete) for paquete in paquetes)} atenciones con historial corto "
+                f"en {len(paquetes)} paquete(s) de hasta {self.paquete_max_atenciones}"
+            )
+        return paquetes, individuales
 
-            logger.info(f"\n[{idx}/{total_atenciones}] Procesando atención {cuenta_formato}")
-            logger.info(f"  Médico: {atencion['nombre_medico']}")
-            logger.info(f"  Paciente: {atencion['nombre_paciente']}")
-            logger.info(f"  Fecha: {atencion['fecha_atencion']}")
-
-            # 3.1 Obtener detalle completo
-            detalle = self.mcp_client.get_detalle_atencion(
-                persona_numero=atencion['id_persona_paciente'],
-                cuenta_gestion=atencion['cuenta_gestion'],
-                cuenta_internacion=atencion['cuenta_internacion'],
-                cuenta_id=atencion['cuenta_id']
+    def _procesar_paquete(self, paquete: List[Tuple[int, Dict, Dict, HistorialFormateado]], total: int) -> int:
+        """
+        Audita un paquete de atenciones cortas en una sola llamada. Las que no vuelven con un
+        objeto válido se auditan individualmente. Retorna cuántas quedaron procesadas.
+        """
+        entradas = [
+            {
+                "cuenta": self._id_unico(atencion),
+                "historial": historial.texto,
+                "datos": self._datos_auditoria(atencion),
+                "recortes": historial.recortes
+            }
+            for _, atencion, _, historial in paquete
+        ]
+        try:
+            resultados = self.auditor_llm.auditar_paquete(entradas)
+        except Exception as e:
+            logger.error(f"Error inesperado en la auditoría empaquetada de {len(paquete)} atenciones: {e}")
+            resultados = {}
+
+        procesadas = 0
+        for (idx, atencion, detalle, _), entrada in zip(paquete, entradas):
+            resultado = resultados.get(entrada["cuenta"])
+            if resultado is None:
+                procesadas += self._procesar_atencion(idx, total, atencion, detalle)
+                continue
+            self._registrar_resultado(entrada["cuenta"], atencion, resultado)
+            logger.info(
+                f"[{idx}/{total}] [OK] Atención {atencion['cuenta_gestion']}/{atencion['cuenta_internacion']} "
+                f"auditada en paquete. Score: {resultado.score_calidad}/100"
             )
+            procesadas += 1
+        return procesadas
 
-            if not detalle:
-                logger.error(f"  Error al obtener detalle de la atención")
-                self.gestor_estado.marcar_fallido(id_unico, "Error al obtener detalle")
-                fallidas += 1
+    @staticmethod
+    def _id_unico(atencion: Dict) -> str:
+        """ID único basado en la CUENTA (no en evolución): cada atención se procesa una sola vez"""
+        return f"{atencion['cuenta_gestion']}-{atencion['cuenta_internacion']}-{atencion['cuenta_id']}"
+
+    @staticmethod
+    def _clave_cuenta(atencion: Dict) -> Tuple[int, int, int]:
+        return (int(atencion['cuenta_gestion']), int(atencion['cuenta_internacion']), int(atencion['cuenta_id']))
+
+    def _precargar_detalles(self, atenciones: List[Dict]) -> Dict[Tuple[int, int, int], Dict]:
+        """
+        Obtiene en lote el detalle de las atenciones pendientes.
+        Las cuentas cuyo lote falle quedan fuera del dict y se consultan individualmente.
+        """
+        pendientes = [a for a in atenciones if not self.gestor_estado.esta_procesado(self._id_unico(a))]
+        detalles = {}
+        for inicio in range(0, len(pendientes), self.tamano_lote_detalle):
+            lote = pendientes[inicio:inicio + self.tamano_lote_detalle]
+            resultado_lote = self.mcp_client.get_detalles_atenciones([
+                (a['id_persona_paciente'], a['cuenta_gestion'], a['cuenta_internacion'], a['cuenta_id'])
+                for a in lote
+            ])
+            if resultado_lote is None:
+                logger.warning(f"Falló la consulta de detalle en lote ({len(lote)} cuentas). Se consultarán individualmente.")
                 continue
+            detalles.update(resultado_lote)
+
+        if pendientes:
+            logger.info(f"Detalle precargado en lote para {len(detalles)}/{len(pendientes)} atenciones pendientes")
+        return detalles
 
-            # 3.2 Formatear para LLM
-            historial = formatear_atencion_para_llm(detalle)
+    def _procesar_atencion(self, idx: int, total: int, atencion: Dict, detalle: Optional[Dict] = None) -> bool:
+        """Procesa una atención completa (detalle + auditoría + guardado). Retorna True si quedó procesada."""
+        id_unico = self._id_unico(atencion)
+        cuenta_formato = f"{atencion['cuenta_gestion']}/{atencion['cuenta_internacion']}"
+
+        # Verificar si ya fue procesada
+        if self.gestor_estado.esta_procesado(id_unico):
+            logger.info(f"[{idx}/{total}] Atención {cuenta_formato} ya procesada. Saltando.")
+            return True
+
+        logger.info(f"[{idx}/{total}] Procesando atención {cuenta_formato}")
+        logger.info(f"  [{cuenta_formato}] Médico: {atencion['nombre_medico']}")
+        logger.info(f"  [{cuenta_formato}] Paciente: {atencion['nombre_paciente']}")
+        logger.info(f"  [{cuenta_formato}] Fecha: {atencion['fecha_atencion']}")
+
+        try:
+            # 1. Obtener detalle completo (si no vino precargado en lote)
+            if detalle is None:
+                detalle = self.mcp_client.get_detalle_atencion(
+                    persona_numero=atencion['id_persona_paciente'],
+                    cuenta_gestion=atencion['cuenta_gestion'],
+                    cuenta_internacion=atencion['cuenta_internacion'],
+                    cuenta_id=atencion['cuenta_id']
+                )
 
-            # 3.3 Auditar con IA
+            if not detalle:
+                logger.error(f"  [{cuenta_formato}] Error al obtener detalle de la atención")
+                self.gestor_estado.marcar_fallido(id_unico, "Error al obtener detalle")
+                return False
+
+            # 2. Formatear para LLM (recortando las secciones de menor prioridad si excede el presupuesto)
+            historial = construir_historial_llm(detalle, self.max_tokens_historial)
+            if historial.recortes:
+                logger.warning(
+                    f"  [{cuenta_formato}] Historial recortado a ~{historial.tokens_estimados} tokens: "
+                    + ", ".join(
+                        f"{r.seccion} ({'omitida' if r.omitida else f'{r.tokens_originales}->{r.tokens_finales}'})"
+                        for r in historial.recortes
+                    )
+                )
+
+            # 3. Auditar con IA
             resultado = self.auditor_llm.auditar_atencion(
-                historial=historial,
-                id_evolucion=atencion.get('id_evolucion', 0),  # Para compatibilidad
-                fecha_atencion=str(atencion['fecha_atencion']),
-                diagnostico=atencion.get('diagnosticos', ''),
-                id_persona=atencion['id_persona_paciente'],
-                id_medico=atencion['id_medico'],
-                nombre_medico=atencion['nombre_medico'],
-                nombre_paciente=atencion['nombre_paciente'],
-                cuenta_gestion=atencion['cuenta_gestion'],
-                cuenta_internacion=atencion['cuenta_internacion']
+                historial=historial.texto,
+                recortes_historial=historial.recortes,
+                **self._datos_auditoria(atencion)
             )
+        except Exception as e:
+            # Un error inesperado en una cuenta no debe detener al resto de workers
+            logger.error(f"  [{cuenta_formato}] Error inesperado: {e}")
+            self.gestor_estado.marcar_fallido(id_unico, f"Error inesperado: {e}")
+            return False
+
+        if resultado:
+            self._registrar_resultado(id_unico, atencion, resultado)
+            logger.info(f"  [{cuenta_formato}] [OK] Auditoría completada. Score: {resultado.score_calidad}/100")
+            return True
+
+        self.gestor_estado.marcar_fallido(id_unico, "Error en auditoría LLM")
+        logger.error(f"  [{cuenta_formato}] [ERROR] Auditoría fallida")
+        return False
+
+    @staticmethod
+    def _datos_auditoria(atencion: Dict) -> Dict[str, Any]:
+        """Datos de la atención que recibe el auditor además del historial"""
+        return {
+            "id_evolucion": atencion.get('id_evolucion', 0),  # Para compatibilidad
+            "fecha_atencion": str(atencion['fecha_atencion']),
+            "diagnostico": atencion.get('diagnosticos', ''),
+            "id_persona": atencion['id_persona_paciente'],
+            "id_medico": atencion['id_medico'],
+            "nombre_medico": atencion['nombre_medico'],
+            "nombre_paciente": atencion['nombre_paciente'],
+            "cuenta_gestion": atencion['cuenta_gestion'],
+            "cuenta_internacion": atencion['cuenta_internacion'],
+        }
+
+    def _registrar_resultado(self, id_unico: str, atencion: Dict, resultado: AuditoriaUrgenciaResultado):
+        """Escribe el resultado; la cuenta se marca completada (índice y reporte) cuando está en disco"""
+        def confirmar():
+            self.gestor_estado.marcar_completado(id_unico)
+            self.indice.registrar(id_unico, atencion, self.output_file)
+            self.reporte.agregar(resultado.model_dump(mode="json"))
+
+        self.guardar_resultado(resultado, al_persistir=confirmar)
+
+    def guardar_resultado(self, resultado: AuditoriaUrgenciaResultado, al_persistir=None):
+        """Guarda un resultado de auditoría en formato JSONL (al_persistir se llama cuando está en disco)"""
+        self.escritor.escribir(resultado.model_dump_json(), al_persistir)
+
+    # --- Backfill de un rango de fechas ---
+
+    def run_auditoria_rango(
+        self, desde: datetime, hasta: datetime, horas_por_bloque: float = 24, consultas_paralelas: int = 2
+    ):
+        """
+        Audita las atenciones de [desde, hasta) (ej: después de una caída del servicio). El rango se
+        divide en bloques de horas_por_bloque; hasta consultas_paralelas consultas de listado corren
+        en paralelo y las cuentas de cada bloque listado pasan a una única cola de auditoría (de
+        max_concurrencia workers) compartida por todo el rango. Las cuentas que aparecen en varios
+        bloques se auditan una sola vez. Cada bloque terminado queda registrado en el
+        archivo de estado: al volver a ejecutar el mismo rango solo se consultan los bloques
+        pendientes o con fallas (y sus cuentas ya auditadas se saltan).
+        """
+        logger.info("="*80)
+        logger.info(f"BACKFILL DE AUDITORÍA - URGENCIAS ({desde:%Y-%m-%d %H:%M} a {hasta:%Y-%m-%d %H:%M})")
+        logger.info("="*80)
 
-            if resultado:
-                self.guardar_resultado(resultado)
-                self.gestor_estado.marcar_completado(id_unico)
-                logger.info(f"  [OK] Auditoría completada. Score: {resultado.score_calidad}/100")
-                procesadas += 1
+        paso = timedelta(hours=horas_por_bloque)
+        bloques = []
+        inicio = desde
+        while inicio < hasta:
+            bloques.append((inicio, min(inicio + paso, hasta)))
+            inicio += paso
+
+        completos = self.gestor_estado.bloques_completos()
+        pendientes = [b for b in bloques if f"{b[0]:%Y-%m-%d %H:%M:%S}" not in completos]
+        logger.info(
+            f"{len(bloques)} bloques de {horas_por_bloque:g} h; {len(bloques) - len(pendientes)} ya completos, "
+            f"{len(pendientes)} por procesar (consultas en paralelo: {consultas_paralelas})"
+        )
+
+        total_atenciones = sin_cambios = procesadas = fallidas = 0
+        vistas = set()
+        por_listar = list(enumerate(pendientes, 1))
+        listados: Dict[Any, Tuple[int, Tuple[datetime, datetime]]] = {}  # futuro -> (número, bloque)
+        auditorias: Dict[Any, Tuple[str, int]] = {}  # futuro -> (bloque, atenciones que cubre)
+        en_curso: Dict[str, Dict[str, Any]] = {}  # bloques listados con auditorías pendientes
+        # Los listados no se adelantan mientras la cola de auditoría tenga trabajo de sobra
+        max_en_cola = 2 * self.max_concurrencia
+        listador = ThreadPoolExecutor(max_workers=max(1, consultas_paralelas), thread_name_prefix="listado")
+        auditor = ThreadPoolExecutor(max_workers=self.max_concurrencia, thread_name_prefix="auditor")
+
+        def listar_siguientes():
+            while por_listar and len(listados) < consultas_paralelas and len(auditorias) < max_en_cola:
+                numero, (inicio, fin) = por_listar.pop(0)
+                futuro = listador.submit(
+                    self.mcp_client.get_atenciones_rango, f"{inicio:%Y-%m-%d %H:%M:%S}", f"{fin:%Y-%m-%d %H:%M:%S}"
+                )
+                listados[futuro] = (numero, (inicio, fin))
+
+        def encolar_bloque(numero: int, inicio: datetime, fin: datetime, atenciones: List[Dict]):
+            nonlocal total_atenciones, sin_cambios
+            # Cada cuenta se audita una sola vez: en el primer bloque listado donde aparece
+            nuevas = []
+            for atencion in atenciones:
+                id_unico = self._id_unico(atencion)
+                if id_unico not in vistas:
+                    vistas.add(id_unico)
+                    nuevas.append(atencion)
+            total_atenciones += len(nuevas)
+            por_auditar, omitidas = self._descartar_sin_cambios(nuevas)
+            sin_cambios += omitidas
+
+            clave = f"{inicio:%Y-%m-%d %H:%M:%S}"
+            en_curso[clave] = {
+                "etiqueta": f"Bloque {numero}/{len(pendientes)} ({inicio:%Y-%m-%d %H:%M} a {fin:%Y-%m-%d %H:%M})",
+                "atenciones": len(atenciones), "repetidas": len(atenciones) - len(nuevas), "sin_cambios": omitidas,
+                "tareas": 0, "procesadas": 0, "fallidas": 0
+            }
+            for funcion, argumentos, cubiertas in self._tareas_auditoria(por_auditar):
+                auditorias[auditor.submit(self._ejecutar_tarea, funcion, argumentos, cubiertas)] = (clave, len(cubiertas))
+                en_curso[clave]["tareas"] += 1
+            if not en_curso[clave]["tareas"]:
+                cerrar_bloque(clave)
+
+        def cerrar_bloque(clave: str):
+            # El checkpoint del bloque se registra cuando todos sus resultados están en disco
+            bloque = en_curso.pop(clave)
+            self.escritor.flush()
+            self.gestor_estado.registrar_bloque(clave, bloque["atenciones"], bloque["fallidas"])
+            logger.info(
+                f"{bloque['etiqueta']}: {bloque['atenciones']} atenciones ({bloque['repetidas']} ya vistas en otro "
+                f"bloque, {bloque['sin_cambios']} sin cambios), {bloque['procesadas']} procesadas, "
+                f"{bloque['fallidas']} fallidas"
+            )
+
+        try:
+            # Una sola cola de auditoría para todo el rango: las cuentas de cada bloque se encolan
+            # apenas termina su listado, mientras se auditan las de los bloques anteriores
+            listar_siguientes()
+            while listados or auditorias:
+                listos, _ = wait([*listados, *auditorias], return_when=FIRST_COMPLETED)
+                for futuro in listos:
+                    if futuro in listados:
+                        numero, (inicio, fin) = listados.pop(futuro)
+                        atenciones = futuro.result()
+                        if atenciones is None:
+                            logger.error(
+                                f"Bloque {numero}/{len(pendientes)} ({inicio:%Y-%m-%d %H:%M} a {fin:%Y-%m-%d %H:%M}): "
+                                f"falló la consulta; queda pendiente para la próxima ejecución"
+                            )
+                            continue
+                        encolar_bloque(numero, inicio, fin, atenciones)
+                    else:
+                        clave, cubiertas = auditorias.pop(futuro)
+                        ok = futuro.result()
+                        bloque = en_curso[clave]
+                        bloque["procesadas"] += ok
+                        bloque["fallidas"] += cubiertas - ok
+                        procesadas += ok
+                        fallidas += cubiertas - ok
+                        bloque["tareas"] -= 1
+                        if not bloque["tareas"]:
+                            cerrar_bloque(clave)
+                listar_siguientes()
+        except KeyboardInterrupt:
+            logger.info("Backfill interrumpido: volver a ejecutar el mismo rango para continuar")
+        finally:
+            # Los listados y auditorías en cola se cancelan; solo se esperan las auditorías en curso
+            listador.shutdown(wait=False, cancel_futures=True)
+            auditor.shutdown(wait=True, cancel_futures=True)
+
+        self.escritor.cerrar()
+        reporte_generado = self.reporte.actualizar()
+        self._resumen(total_atenciones, sin_cambios, procesadas, fallidas, reporte_generado)
+        self.gestor_estado.cerrar()
+        self.indice.cerrar()
+
+        restantes = [b for b in bloques if f"{b[0]:%Y-%m-%d %H:%M:%S}" not in self.gestor_estado.bloques_completos()]
+        if restantes:
+            logger.info(f"Quedan {len(restantes)} bloque(s) pendientes o con fallas: volver a ejecutar el mismo rango")
+        else:
+            # Rango completo: el estado se archiva y una nueva ejecución del rango empieza de cero
+            archivado = self.gestor_estado.archivo_estado.replace(".jsonl", f"_{datetime.now():%Y%m%d_%H%M%S}.jsonl")
+            if os.path.exists(self.gestor_estado.archivo_estado):
+                os.replace(self.gestor_estado.archivo_estado, archivado)
+                logger.info(f"Backfill completo. Estado archivado en: {archivado}")
+
+    # --- Modo continuo (cuentas cerradas desde una marca de agua) ---
+
+    def run_auditoria_continua(
+        self, intervalo: float = 300, directorio_salida: str = "output", max_ciclos: Optional[int] = None
+    ):
+        """
+        Auditoría casi en tiempo real: cada `intervalo` segundos lista las cuentas de urgencias
+        cerradas (epicrisis o alta) después de la marca de agua del archivo de estado, las audita
+        y avanza la marca. Los resultados van a auditoria_continua_YYYYMMDD.jsonl (un archivo por
+        día, con su reporte HTML). Se detiene con Ctrl+C o después de max_ciclos.
+        """
+        logger.info("="*80)
+        logger.info("AUDITORÍA CONTINUA - URGENCIAS")
+        logger.info("="*80)
+        logger.info(f"Intervalo entre ciclos: {intervalo:.0f}s. Marca de agua: {self.gestor_estado.marca_agua() or '(primera ejecución)'}")
+
+        total_atenciones = sin_cambios = procesadas = fallidas = 0
+        ciclo = 0
+        try:
+            while True:
+                inicio = time.monotonic()
+                ciclo += 1
+                salida = os.path.join(directorio_salida, f"auditoria_continua_{datetime.now():%Y%m%d}.jsonl")
+                if salida != self.output_file:
+                    # Cambio de día: se cierra el archivo (y reporte) anterior
+                    self.escritor.cerrar()
+                    self.reporte.actualizar()
+                    self.indice.cerrar()
+                    self._abrir_salida(salida)
+
+                resultado = self._ciclo_continuo(ciclo)
+                if resultado:
+                    total_atenciones += resultado[0]
+                    sin_cambios += resultado[1]
+                    procesadas += resultado[2]
+                    fallidas += resultado[3]
+
+                if max_ciclos and ciclo >= max_ciclos:
+                    break
+                time.sleep(max(0.0, intervalo - (time.monotonic() - inicio)))
+        except KeyboardInterrupt:
+            logger.info("Auditoría continua detenida por el usuario")
+        finally:
+            self.escritor.cerrar()
+            reporte_generado = self.reporte.actualizar()
+            self._resumen(total_atenciones, sin_cambios, procesadas, fallidas, reporte_generado)
+            self.gestor_estado.cerrar()
+            self.indice.cerrar()
+
+    def _ciclo_continuo(self, ciclo: int) -> Optional[Tuple[int, int, int, int]]:
+        """
+        Un ciclo del modo continuo. Retorna (cerradas, sin cambios, procesadas, fallidas), o
+        None si falló la consulta (la marca de agua no avanza y se reintenta en el próximo ciclo).
+        """
+        marca = self.gestor_estado.marca_agua()
+        if marca is None:
+            marca = (datetime.now() - timedelta(hours=float(os.getenv("CONTINUO_HORAS_INICIALES", "24")))).strftime("%Y-%m-%d %H:%M:%S")
+        # Solapamiento: una evolución puede guardarse con fecha anterior a la del ciclo previo;
+        # las cuentas que se vuelven a listar sin cambios las descarta el índice de auditorías
+        solapamiento = timedelta(minutes=float(os.getenv("CONTINUO_SOLAPAMIENTO_MINUTOS", "10")))
+        desde = (datetime.strptime(marca, "%Y-%m-%d %H:%M:%S") - solapamiento).strftime("%Y-%m-%d %H:%M:%S")
+
+        atenciones = self.mcp_client.get_atenciones_cerradas(desde)
+        if atenciones is None:
+            logger.error(f"Ciclo {ciclo}: falló la consulta de cuentas cerradas; se reintenta en el próximo ciclo")
+            return None
+
+        cerradas = len(atenciones)
+        por_auditar, sin_cambios = self._descartar_sin_cambios(atenciones)
+        # Una cuenta ya completada en este estado que vuelve con evoluciones nuevas se audita otra vez
+        for atencion in por_auditar:
+            id_unico = self._id_unico(atencion)
+            if self.gestor_estado.esta_procesado(id_unico):
+                self.gestor_estado.marcar_pendiente(id_unico)
+
+        procesadas = fallidas = 0
+        if por_auditar:
+            procesadas, fallidas = self._procesar_atenciones(por_auditar)
+        # Confirmar en disco lo auditado antes de mover la marca de agua
+        self.escritor.flush()
+
+        # La marca avanza hasta el último cierre listado, salvo que una cuenta fallida la retenga
+        # (se reintenta en los próximos ciclos, hasta CONTINUO_REINTENTOS veces)
+        max_reintentos = int(os.getenv("CONTINUO_REINTENTOS", "3"))
+        auditadas = {self._id_unico(a) for a in por_auditar}
+        nueva_marca = marca
+        retenida = None
+        for atencion in atenciones:
+            cierre = atencion['fecha_cierre']
+            cierre = cierre.strftime("%Y-%m-%d %H:%M:%S") if isinstance(cierre, datetime) else str(cierre)[:19]
+            nueva_marca = max(nueva_marca, cierre)
+            id_unico = self._id_unico(atencion)
+            if id_unico in auditadas and not self.gestor_estado.esta_procesado(id_unico):
+                self.fallos_continuo[id_unico] = self.fallos_continuo.get(id_unico, 0) + 1
+                if self.fallos_continuo[id_unico] < max_reintentos:
+                    retenida = cierre if retenida is None else min(retenida, cierre)
+                else:
+                    logger.error(f"Cuenta {id_unico} fallida en {max_reintentos} ciclos: se deja de reintentar")
             else:
-                self.gestor_estado.marcar_fallido(id_unico, "Error en auditoría LLM")
-                logger.error(f"  [ERROR] Auditoría fallida")
-                fallidas += 1
+                self.fallos_continuo.pop(id_unico, None)
+        if retenida is not None:
+            # Un segundo antes del cierre fallido, para que la consulta (> desde) lo vuelva a listar
+            nueva_marca = min(nueva_marca, (datetime.strptime(retenida, "%Y-%m-%d %H:%M:%S") - timedelta(seconds=1)).strftime("%Y-%m-%d %H:%M:%S"))
+        if nueva_marca != marca:
+            self.gestor_estado.registrar_marca_agua(nueva_marca)
+
+        if cerradas:
+            logger.info(
+                f"Ciclo {ciclo}: {cerradas} cuentas cerradas desde {desde}, {sin_cambios} sin cambios, "
+                f"{procesadas} procesadas, {fallidas} fallidas. Marca de agua: {nueva_marca}"
+            )
+        else:
+            logger.info(f"Ciclo {ciclo}: sin cuentas cerradas desde {desde}")
+        return cerradas, sin_cambios, procesadas, fallidas
 
-        # 4. Resumen final
-        logger.info("\n" + "="*80)
-        logger.info("RESUMEN DE AUDITORÍA")
+    # --- Modo lote (Message Batches) ---
+
+    def run_auditoria_lote(self, esperar: bool = False, intervalo_sondeo: float = 300):
+        """
+        Auditoría diaria por lotes: arma los prompts de todas las atenciones pendientes y los envía
+        como lotes de Message Batches; los IDs quedan en el archivo de estado. Cada ejecución
+        posterior consulta los lotes pendientes e ingiere los terminados, hasta completar la
+        corrida (esperar=True sondea cada intervalo_sondeo segundos sin terminar el proceso).
+        Las cuentas sin resultado válido en el lote se auditan con llamadas directas.
+        """
         logger.info("="*80)
-        logger.info(f"Total de atenciones: {total_atenciones}")
-        logger.info(f"Procesadas exitosamente: {procesadas}")
-        logger.info(f"Fallidas: {fallidas}")
-        logger.info(f"Resultados guardados en: {self.output_file}")
+        logger.info("AUDITORÍA DIARIA POR LOTES - URGENCIAS")
         logger.info("="*80)
 
-    def guardar_resultado(self, resultado: AuditoriaUrgenciaResultado):
-        """Guarda un resultado de auditoría en formato JSONL"""
-        with open(self.output_file, "a", encoding="utf-8") as f:
-            f.write(resultado.model_dump_json() + "\n")
+        self.cliente_lotes = self.cliente_lotes or ClienteLotesLLM()
+        total_atenciones = sin_cambios = procesadas = fallidas = 0
+
+        pendientes = self.gestor_estado.lotes_pendientes()
+        if pendientes:
+            logger.info(f"Retomando corrida por lotes: {len(pendientes)} lote(s) pendientes ({', '.join(pendientes)})")
+        else:
+            obtenidas = self._obtener_atenciones()
+            if obtenidas is None:
+                return
+            atenciones, total_atenciones, sin_cambios = obtenidas
+            self.gestor_estado.registrar_corrida_lote(self.output_file)
+            pendientes, procesadas, fallidas = self._enviar_lotes(atenciones)
+
+        while pendientes:
+            for id_lote in list(pendientes):
+                ingerido = self._ingerir_lote(id_lote)
+                if ingerido is not None:
+                    pendientes.remove(id_lote)
+                    procesadas += ingerido[0]
+                    fallidas += ingerido[1]
+            if not pendientes or not esperar:
+                break
+            logger.info(f"{len(pendientes)} lote(s) en proceso; próxima consulta en {intervalo_sondeo:.0f}s")
+            time.sleep(intervalo_sondeo)
+
+        self.escritor.cerrar()
+        reporte_generado = self.reporte.actualizar()
+        self._resumen(total_atenciones, sin_cambios, procesadas, fallidas, reporte_generado)
+        self.gestor_estado.cerrar()
+        self.indice.cerrar()
+
+        if pendientes:
+            logger.info(f"Quedan {len(pendientes)} lote(s) en proceso: volver a ejecutar con --modo lote para ingerirlos")
+        else:
+            # Corrida terminada: el estado se archiva y la próxima ejecución arranca una corrida nueva
+            archivado = self.gestor_estado.archivo_estado.replace(".jsonl", f"_{datetime.now():%Y%m%d_%H%M%S}.jsonl")
+            if os.path.exists(self.gestor_estado.archivo_estado):
+                os.replace(self.gestor_estado.archivo_estado, archivado)
+                logger.info(f"Corrida por lotes completa. Estado archivado en: {archivado}")
+
+    def _enviar_lotes(self, atenciones: List[Dict]) -> Tuple[List[str], int, int]:
+        """
+        Arma una solicitud por atención pendiente y las envía en lotes de hasta MAX_SOLICITUDES_LOTE.
+        Las que ya están en la caché local se guardan sin enviarse.
+        Retorna (IDs de lotes enviados, procesadas desde la caché, fallidas).
+        """
+        detalles = self._precargar_detalles(atenciones)
+        modelos_lote = [self.auditor_llm.modelo_lote]
+        solicitudes = []
+        procesadas = fallidas = 0
+
+        for atencion in atenciones:
+            id_unico = self._id_unico(atencion)
+            if self.gestor_estado.esta_procesado(id_unico):
+                continue
+            try:
+                detalle = detalles.get(self._clave_cuenta(atencion)) or self.mcp_client.get_detalle_atencion(
+                    persona_numero=atencion['id_persona_paciente'],
+                    cuenta_gestion=atencion['cuenta_gestion'],
+                    cuenta_internacion=atencion['cuenta_internacion'],
+                    cuenta_id=atencion['cuenta_id']
+                )
+                if not detalle:
+                    raise ValueError("Error al obtener detalle")
+
+                historial = construir_historial_llm(detalle, self.max_tokens_historial)
+                datos = self._datos_auditoria(atencion)
+                prompt_usuario = self.auditor_llm.construir_prompt_usuario(
+                    historial.texto, datos["id_evolucion"], datos["fecha_atencion"], datos["diagnostico"],
+                    datos["id_persona"], datos["id_medico"], datos["nombre_medico"]
+                )
+            except Exception as e:
+                logger.error(f"  [{id_unico}] No se pudo preparar la solicitud: {e}")
+                self.gestor_estado.marcar_fallido(id_unico, str(e))
+                fallidas += 1
+                continue
+
+            clave_cache = None
+            if self.auditor_llm.cache_resultados:
+                clave_cache = self.auditor_llm.cache_resultados.calcular_clave(modelos_lote, prompt_usuario)
+                metadata = self.auditor_llm.metadata_auditoria(recortes_historial=historial.recortes, **datos)
+                resultado = self.auditor_llm.resultado_desde_cache(clave_cache, metadata, datos["id_evolucion"])
+                if resultado:
+                    self._registrar_resultado(id_unico, atencion, resultado)
+                    procesadas += 1
+                    continue
+
+            solicitudes.append((id_unico, self.auditor_llm.solicitud_lote(id_unico, prompt_usuario), {
+                # Lo necesario para ingerir el resultado (o re-auditar la cuenta) después de un reinicio
+                "atencion": {
+                    clave: valor if isinstance(valor, (str, int, float, bool, type(None))) else str(valor)
+                    for clave, valor in atencion.items()
+                },
+                "recortes": [recorte.model_dump() for recorte in historial.recortes],
+                "clave_cache": clave_cache
+            }))
+
+        enviados = []
+        for inicio in range(0, len(solicitudes), MAX_SOLICITUDES_LOTE):
+            bloque = solicitudes[inicio:inicio + MAX_SOLICITUDES_LOTE]
+            try:
+                lote = self.cliente_lotes.crear([solicitud for _, solicitud, _ in bloque])
+            except (OSError, ValueError) as e:
+                logger.error(f"Error al enviar un lote de {len(bloque)} solicitudes: {e}")
+                for id_unico, _, _ in bloque:
+                    self.gestor_estado.marcar_fallido(id_unico, f"Error al enviar el lote: {e}")
+                fallidas += len(bloque)
+                continue
+
+            self.gestor_estado.registrar_lote(lote["id"], len(bloque))
+            for id_unico, _, datos_lote in bloque:
+                self.gestor_estado.marcar_en_lote(id_unico, lote["id"], datos_lote)
+            enviados.append(lote["id"])
+            logger.info(f"Lote {lote['id']} enviado con {len(bloque)} solicitudes")
+
+        if procesadas:
+            logger.info(f"Atenciones tomadas de la caché local (no se envían): {procesadas}")
+        return enviados, procesadas, fallidas
+
+    def _ingerir_lote(self, id_lote: str) -> Optional[Tuple[int, int]]:
+        """
+        Si el lote terminó, guarda sus resultados y re-audita con llamadas directas las cuentas
+        sin resultado válido. Retorna (procesadas, fallidas), o None si el lote sigue en proceso
+        (o no se pudo consultar).
+        """
+        try:
+            lote = self.cliente_lotes.consultar(id_lote)
+        except (OSError, ValueError) as e:
+            logger.warning(f"No se pudo consultar el lote {id_lote}: {e}")
+            return None
+
+        if lote.get("processing_status") != "ended":
+            logger.info(f"Lote {id_lote}: {lote.get('processing_status')} {lote.get('request_counts') or ''}")
+            return None
+
+        cuentas = self.gestor_estado.cuentas_en_lote(id_lote)
+        logger.info(f"Lote {id_lote} terminado: ingiriendo {len(cuentas)} resultados")
+        procesadas = 0
+        reauditar = []
+        try:
+            for item in self.cliente_lotes.resultados(lote):
+                registro = cuentas.pop(item.get("custom_id"), None)
+                if registro is None:
+                    continue
+                atencion = registro["atencion"]
+                datos = self._datos_auditoria(atencion)
+                metadata = self.auditor_llm.metadata_auditoria(
+                    recortes_historial=[RecorteHistorial(**r) for r in registro.get("recortes", [])], **datos
+                )
+                resultado = self.auditor_llm.resultado_lote(
+                    item.get("result") or {}, metadata, datos["id_evolucion"], registro.get("clave_cache")
+                )
+                if resultado:
+                    self._registrar_resultado(item["custom_id"], atencion, resultado)
+                    procesadas += 1
+                else:
+                    reauditar.append(atencion)
+        except (OSError, ValueError) as e:
+            # Lo ya ingerido queda completado al persistirse; el resto se retoma en la próxima consulta
+            logger.warning(f"Descarga de resultados del lote {id_lote} interrumpida: {e}")
+            self.escritor.flush()
+            return None
+
+        # Cuentas sin línea en los resultados, o cuyo resultado falló o no es válido
+        reauditar.extend(registro["atencion"] for registro in cuentas.values())
+        fallidas = 0
+        if reauditar:
+            logger.warning(f"Lote {id_lote}: {len(reauditar)} cuenta(s) sin resultado válido, se auditan con llamadas directas")
+            reauditadas, fallidas = self._procesar_atenciones(reauditar)
+            procesadas += reauditadas
+
+        self.escritor.flush()
+        self.gestor_estado.marcar_lote_ingerido(id_lote)
+        return procesadas, fallidas
 
 
 # --- Punto de Entrada ---
 if __name__ == "__main__":
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Auditoría diaria de urgencias - Clínica Foianini")
+    parser.add_argument(
+        "--modo",
+        choices=("diario", "lote", "continuo", "backfill"),
+        default="diario",
+        help="diario: llamadas directas al LLM; lote: envía la auditoría como lotes (Message Batches) y los "
+             "ingiere al terminar, retomando la corrida en cada ejecución; continuo: audita cada pocos minutos "
+             "las cuentas cerradas (epicrisis/alta) desde la última marca de agua; backfill: audita el rango "
+             "--desde/--hasta por bloques, retomable (por defecto: diario)"
+    )
+    parser.add_argument(
+        "--esperar",
+        action="store_true",
+        help="Con --modo lote: no terminar hasta ingerir todos los lotes (sondea cada LOTE_INTERVALO_SONDEO segundos)"
+    )
+    parser.add_argument(
+        "--intervalo",
+        type=float,
+        default=float(os.getenv("CONTINUO_INTERVALO_SEGUNDOS", "300")),
+        help="Con --modo continuo: segundos entre ciclos (por defecto: CONTINUO_INTERVALO_SEGUNDOS o 300)"
+    )
+    parser.add_argument(
+        "--ciclos",
+        type=int,
+        default=None,
+        help="Con --modo continuo: terminar después de N ciclos (por defecto: sin límite, hasta Ctrl+C)"
+    )
+    parser.add_argument(
+        "--desde",
+        help="Con --modo backfill: inicio del rango (YYYY-MM-DD o 'YYYY-MM-DD HH:MM')"
+    )
+    parser.add_argument(
+        "--hasta",
+        help="Con --modo backfill: fin del rango, excluido (YYYY-MM-DD incluye ese día completo)"
+    )
+    parser.add_argument(
+        "--horas-por-bloque",
+        type=float,
+        default=float(os.getenv("BACKFILL_HORAS_POR_BLOQUE", "24")),
+        help="Con --modo backfill: horas de cada bloque consultado (por defecto: BACKFILL_HORAS_POR_BLOQUE o 24)"
+    )
+    parser.add_argument(
+        "--consultas-paralelas",
+        type=int,
+        default=int(os.getenv("BACKFILL_CONSULTAS_PARALELAS", "2")),
+        help="Con --modo backfill: consultas de listado simultáneas (por defecto: BACKFILL_CONSULTAS_PARALELAS o 2)"
+    )
+    parser.add_argument(
+        "--concurrencia",
+        type=int,
+        default=int(os.getenv("MAX_AUDITORIAS_CONCURRENTES", "4")),
+        help="Máximo de auditorías LLM simultáneas (por defecto: MAX_AUDITORIAS_CONCURRENTES o 4; 1 = secuencial)"
+    )
+    parser.add_argument(
+        "--sin-cache",
+        action="store_true",
+        help="No usar la caché local de resultados del LLM (vuelve a auditar aunque el historial no haya cambiado)"
+    )
+    parser.add_argument(
+        "--forzar",
+        action="store_true",
+        help="Re-auditar también las cuentas sin evoluciones nuevas desde su última auditoría (ignora output/indice_auditorias.json)"
+    )
+    args = parser.parse_args()
+
+    if args.modo == "backfill":
+        if not args.desde or not args.hasta:
+            parser.error("--modo backfill requiere --desde y --hasta")
+        try:
+            desde = datetime.fromisoformat(args.desde)
+            hasta = datetime.fromisoformat(args.hasta)
+        except ValueError as e:
+            parser.error(f"Fecha inválida: {e}")
+        if len(args.hasta.strip()) <= 10:
+            hasta += timedelta(days=1)
+        if hasta <= desde or args.horas_por_bloque <= 0:
+            parser.error("El rango debe cumplir --desde < --hasta y --horas-por-bloque > 0")
+
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
 
-    # Asegurar carpetas
+    # Asegurar carpetas (logs/ la crea configurar_logging)
     os.makedirs("output", exist_ok=True)
-    os.makedirs("logs", exist_ok=True)
+    configurar_logging()
 
     # Archivos de salida
     output_jsonl = os.path.join("output", f"auditoria_urgencias_{timestamp}.jsonl")
-    state_file = os.path.join("output", f"tracking_{timestamp}.json")
+    state_file = os.path.join("output", f"tracking_{timestamp}.jsonl")
+    if args.modo == "lote":
+        # Estado fijo: guarda los IDs de los lotes enviados para retomar la corrida tras un reinicio
+        state_file = os.path.join("output", "estado_lotes.jsonl")
+        corrida = GestorDeEstado(state_file).corrida_lote()
+        if corrida:
+            output_jsonl = corrida["output_file"]
+    elif args.modo == "continuo":
+        # Estado fijo: guarda la marca de agua entre ejecuciones; un JSONL por día
+        state_file = os.path.join("output", "estado_continuo.jsonl")
+        output_jsonl = os.path.join("output", f"auditoria_continua_{datetime.now():%Y%m%d}.jsonl")
+    elif args.modo == "backfill":
+        # Estado y resultados fijos por rango: volver a ejecutar el mismo rango retoma los bloques pendientes
+        rango = f"{desde:%Y%m%d%H%M}_{hasta:%Y%m%d%H%M}"
+        state_file = os.path.join("output", f"estado_backfill_{rango}.jsonl")
+        output_jsonl = os.path.join("output", f"auditoria_backfill_{rango}.jsonl")
 
     logger.info(f"\nARCHIVOS DE SALIDA:")
     logger.info(f"  - JSONL: {output_jsonl}")
@@ -704,29 +3377,22 @@ if __name__ == "__main__":
     # Ejecutar auditoría
     orquestador = OrquestadorAuditoriaProduccion(
         output_file=output_jsonl,
-        state_file=state_file
+        state_file=state_file,
+        max_concurrencia=args.concurrencia,
+        usar_cache_llm=False if args.sin_cache else None,
+        forzar=args.forzar
     )
 
-    orquestador.run_auditoria_24h()
-
-    # Generar reporte HTML automáticamente
-    logger.info("\nGENERANDO REPORTE HTML...")
-    import subprocess
-
-    try:
-        result = subprocess.run(
-            ["python", "generar_reporte.py", output_jsonl],
-            capture_output=True,
-            text=True
+    # El reporte HTML se actualiza durante la ejecución y queda completo al terminar
+    if args.modo == "lote":
+        orquestador.run_auditoria_lote(
+            esperar=args.esperar, intervalo_sondeo=float(os.getenv("LOTE_INTERVALO_SONDEO", "300"))
         )
-
-        if result.returncode == 0:
-            output_html = output_jsonl.replace('.jsonl', '.html')
-            logger.info(f"Reporte HTML generado: {output_html}")
-        else:
-            logger.warning(f"Error al generar reporte HTML: {result.stderr}")
-            logger.info(f"Puedes generarlo manualmente: python generar_reporte.py {output_jsonl}")
-
-    except Exception as e:
-        logger.warning(f"No se pudo generar reporte HTML automáticamente: {e}")
-        logger.info(f"Puedes generarlo manualmente: python generar_reporte.py {output_jsonl}")
+    elif args.modo == "continuo":
+        orquestador.run_auditoria_continua(intervalo=args.intervalo, max_ciclos=args.ciclos)
+    elif args.modo == "backfill":
+        orquestador.run_auditoria_rango(
+            desde, hasta, horas_por_bloque=args.horas_por_bloque, consultas_paralelas=args.consultas_paralelas
+        )
+    else:
+        orquestador.run_auditoria_24h()
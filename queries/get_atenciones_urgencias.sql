@@ -0,0 +1,214 @@
+-- Obtener TODAS las ATENCIONES ÚNICAS de urgencias
+-- Única query de listado de main.py (MCPClient._get_atenciones_urgencias):
+--   - get_todas_atenciones_24h: desde NOW() - 24h según el reloj de MySQL, sin límite superior (modo diario y lote)
+--   - get_atenciones_rango: ventana [desde, hasta) de cada bloque del backfill (--modo backfill)
+--   - get_atenciones_cerradas: cuentas con epicrisis o alta posterior a la marca de agua (--modo continuo)
+-- FILTROS: Sector 50 (Urgencias) + TurnoTipo 'E' (Urgencias, excluye consultas 'P' y sobrecupo 'S')
+-- IMPORTANTE: Agrupa por número de internación para evitar duplicados por múltiples evoluciones
+--
+-- Parámetros (expresiones SQL; NULL deja el filtro sin aplicar):
+--   {desde}          - Inicio de la ventana (incluido), ej: '2025-10-01 00:00:00' o DATE_SUB(NOW(), INTERVAL 24 HOUR)
+--   {hasta}          - Fin de la ventana (excluido), ej: '2025-10-02 00:00:00'
+--   {cerradas_desde} - Marca de agua (exclusiva): solo cuentas con epicrisis o alta posterior
+--
+-- RENDIMIENTO: versión de una sola pasada (requiere MySQL 8.0+).
+-- La versión anterior ejecutaba 3 subconsultas correlacionadas por cada cuenta agrupada
+-- (id de médico, nombre de médico y diagnósticos), cada una re-escaneando pacienteevolucion.
+-- Aquí las evoluciones de las cuentas se leen una sola vez y el primer médico se obtiene
+-- con ROW_NUMBER(). Equivalencia verificada con comparar_query_24h.py contra
+-- get_todas_atenciones_24h_correlacionada.sql.
+
+WITH atenciones AS (
+    -- Cuentas con actividad de urgencias en la ventana
+    SELECT
+        -- Tomamos la primera evolución como referencia (la más antigua de la atención)
+        MIN(pe.EvolucionAutonumerico) AS id_evolucion,
+        pe.PersonaNumero,
+        MIN(pe.PacienteEvolucionFechaHora) AS fecha_atencion,  -- Fecha de la primera evolución (ingreso)
+        pe.PacienteEvolucionGestion,
+        pe.PacienteEvolucionNroInter,
+        pe.PacienteEvolucionNroIntId
+    FROM pacienteevolucion pe
+    INNER JOIN turno t
+        ON pe.TurnoNumero = t.TurnoNumero              -- JOIN con tabla turno para filtrar por tipo
+    WHERE pe.PacienteEvolucionSector = 50  -- Urgencias solamente (Sector 50)
+      AND t.TurnoTipo = 'E'  -- Solo Urgencias ('E'), excluye Consulta ('P') y Sobrecupo ('S')
+      AND ({desde} IS NULL OR pe.PacienteEvolucionFechaHora >= {desde})  -- Ventana [desde, hasta)
+      AND ({hasta} IS NULL OR pe.PacienteEvolucionFechaHora < {hasta})
+      AND ({cerradas_desde} IS NULL OR (
+          pe.PersonaNumero, pe.PacienteEvolucionGestion, pe.PacienteEvolucionNroInter, pe.PacienteEvolucionNroIntId
+      ) IN (
+          -- Cuentas con epicrisis o alta registrada después de la marca de agua
+          SELECT
+              ci.PersonaNumero,
+              ci.PacienteEvolucionGestion,
+              ci.PacienteEvolucionNroInter,
+              ci.PacienteEvolucionNroIntId
+          FROM pacienteevolucion ci
+          WHERE ci.PacienteEvolucionFechaHora > {cerradas_desde}
+            AND (ci.PacienteEvolucionTipo = 3 OR COALESCE(ci.taCodTipoAlta, 0) <> 0)  -- Epicrisis o alta
+            AND ci.PacienteEvolucionBFecha = '1000-01-01 00:00:00'
+      ))
+      AND pe.PacienteEvolucionBFecha = '1000-01-01 00:00:00'  -- No eliminados
+    GROUP BY
+        pe.PersonaNumero,
+        pe.PacienteEvolucionGestion,
+        pe.PacienteEvolucionNroInter,
+        pe.PacienteEvolucionNroIntId
+),
+
+evoluciones_cuenta AS (
+    -- TODAS las evoluciones vigentes de esas cuentas (cualquier sector y fecha),
+    -- igual que las subconsultas de la versión anterior
+    SELECT
+        pe2.PersonaNumero,
+        pe2.PacienteEvolucionGestion,
+        pe2.PacienteEvolucionNroInter,
+        pe2.PacienteEvolucionNroIntId,
+        pe2.PacienteEvolucionFechaHora,
+        pe2.EvolucionAutonumerico,
+        pe2.PacienteEvolucionMUsuario,
+        pe2.PacienteEvolucionTipo,
+        pe2.taCodTipoAlta
+    FROM atenciones a
+    JOIN pacienteevolucion pe2
+        ON pe2.PersonaNumero = a.PersonaNumero
+        AND pe2.PacienteEvolucionGestion = a.PacienteEvolucionGestion
+        AND pe2.PacienteEvolucionNroInter = a.PacienteEvolucionNroInter
+        AND pe2.PacienteEvolucionNroIntId = a.PacienteEvolucionNroIntId
+    WHERE pe2.PacienteEvolucionBFecha = '1000-01-01 00:00:00'
+),
+
+medicos_cuenta AS (
+    -- MÉDICO QUE ATENDIÓ (el de la primera evolución)
+    -- orden_id: primera evolución con usuario (para id_medico)
+    -- orden_nombre: primera evolución con usuario Y persona (para nombre_medico),
+    --               se numera aparte porque la versión anterior exigía el JOIN con persona
+    SELECT
+        ec.PersonaNumero,
+        ec.PacienteEvolucionGestion,
+        ec.PacienteEvolucionNroInter,
+        ec.PacienteEvolucionNroIntId,
+        u2.UsuarioPersonaCodigo AS id_medico,
+        med2.PersonaNumero AS persona_medico,
+        med2.PersonaNombreCompleto AS nombre_medico,
+        ROW_NUMBER() OVER (
+            PARTITION BY ec.PersonaNumero, ec.PacienteEvolucionGestion,
+                         ec.PacienteEvolucionNroInter, ec.PacienteEvolucionNroIntId
+            ORDER BY ec.PacienteEvolucionFechaHora ASC, ec.EvolucionAutonumerico ASC
+        ) AS orden_id,
+        ROW_NUMBER() OVER (
+            PARTITION BY ec.PersonaNumero, ec.PacienteEvolucionGestion,
+                         ec.PacienteEvolucionNroInter, ec.PacienteEvolucionNroIntId,
+                         med2.PersonaNumero IS NULL
+            ORDER BY ec.PacienteEvolucionFechaHora ASC, ec.EvolucionAutonumerico ASC
+        ) AS orden_nombre
+    FROM evoluciones_cuenta ec
+    JOIN usuario u2 ON u2.UsuarioCodigo = ec.PacienteEvolucionMUsuario
+    LEFT JOIN persona med2 ON med2.PersonaNumero = u2.UsuarioPersonaCodigo
+),
+
+resumen_cuenta AS (
+    -- HUELLA DE CAMBIOS: última evolución y cantidad de evoluciones de la cuenta.
+    -- El orquestador la compara con indice_auditorias.json para no re-auditar
+    -- cuentas sin evoluciones nuevas desde su última auditoría.
+    SELECT
+        ec.PersonaNumero,
+        ec.PacienteEvolucionGestion,
+        ec.PacienteEvolucionNroInter,
+        ec.PacienteEvolucionNroIntId,
+        MAX(ec.PacienteEvolucionFechaHora) AS ultima_evolucion,
+        COUNT(*) AS num_evoluciones,
+        -- CIERRE: última epicrisis (PacienteEvolucionTipo = 3) o alta (taCodTipoAlta, ver
+        -- clinica01.tiposaltas) de la cuenta; NULL si sigue abierta. Marca de agua del modo continuo.
+        MAX(CASE
+            WHEN ec.PacienteEvolucionTipo = 3 OR COALESCE(ec.taCodTipoAlta, 0) <> 0
+            THEN ec.PacienteEvolucionFechaHora
+        END) AS fecha_cierre
+    FROM evoluciones_cuenta ec
+    GROUP BY
+        ec.PersonaNumero,
+        ec.PacienteEvolucionGestion,
+        ec.PacienteEvolucionNroInter,
+        ec.PacienteEvolucionNroIntId
+),
+
+diagnosticos_cuenta AS (
+    -- DIAGNÓSTICOS (de todas las evoluciones de esta atención)
+    SELECT
+        ec.PersonaNumero,
+        ec.PacienteEvolucionGestion,
+        ec.PacienteEvolucionNroInter,
+        ec.PacienteEvolucionNroIntId,
+        GROUP_CONCAT(DISTINCT
+            CONCAT(cie.CIE9CMCodigo, '-', cie.CIE9CMDescripcion)
+            SEPARATOR ' | '
+        ) AS diagnosticos
+    FROM evoluciones_cuenta ec
+    JOIN pacienteevoluciondiagnostico ped
+        ON ped.PersonaNumero = ec.PersonaNumero
+        AND ped.PacienteEvolucionFechaHora = ec.PacienteEvolucionFechaHora
+    LEFT JOIN cie9cm cie ON cie.CIE9CMCodigo = ped.CIE9CMCodigo
+    GROUP BY
+        ec.PersonaNumero,
+        ec.PacienteEvolucionGestion,
+        ec.PacienteEvolucionNroInter,
+        ec.PacienteEvolucionNroIntId
+)
+
+SELECT
+    a.id_evolucion,
+    a.PersonaNumero AS id_persona_paciente,
+    a.fecha_atencion,
+
+    -- MÉDICO QUE ATENDIÓ (tomamos el de la primera evolución)
+    mid.id_medico,
+    mnom.nombre_medico,
+
+    -- CUENTA (para reporte HTML)
+    a.PacienteEvolucionGestion AS cuenta_gestion,
+    a.PacienteEvolucionNroInter AS cuenta_internacion,  -- Campo principal de agrupación
+    a.PacienteEvolucionNroIntId AS cuenta_id,           -- Campo secundario (para query detalle)
+
+    -- PACIENTE (nombre completo para reporte HTML)
+    pac.PersonaNombreCompleto AS nombre_paciente,
+    pac.PersonaSexo AS sexo_paciente,
+    pac.PersonaFechaNacimiento AS fecha_nacimiento_paciente,
+
+    dx.diagnosticos,
+
+    -- HUELLA DE CAMBIOS (detección de cuentas ya auditadas sin novedades)
+    rc.ultima_evolucion,
+    rc.num_evoluciones,
+
+    -- CIERRE (marca de agua del modo continuo)
+    rc.fecha_cierre
+
+FROM atenciones a
+JOIN persona pac
+    ON pac.PersonaNumero = a.PersonaNumero        -- Nombre del paciente
+LEFT JOIN medicos_cuenta mid
+    ON mid.PersonaNumero = a.PersonaNumero
+    AND mid.PacienteEvolucionGestion = a.PacienteEvolucionGestion
+    AND mid.PacienteEvolucionNroInter = a.PacienteEvolucionNroInter
+    AND mid.PacienteEvolucionNroIntId = a.PacienteEvolucionNroIntId
+    AND mid.orden_id = 1
+LEFT JOIN medicos_cuenta mnom
+    ON mnom.PersonaNumero = a.PersonaNumero
+    AND mnom.PacienteEvolucionGestion = a.PacienteEvolucionGestion
+    AND mnom.PacienteEvolucionNroInter = a.PacienteEvolucionNroInter
+    AND mnom.PacienteEvolucionNroIntId = a.PacienteEvolucionNroIntId
+    AND mnom.persona_medico IS NOT NULL
+    AND mnom.orden_nombre = 1
+LEFT JOIN diagnosticos_cuenta dx
+    ON dx.PersonaNumero = a.PersonaNumero
+    AND dx.PacienteEvolucionGestion = a.PacienteEvolucionGestion
+    AND dx.PacienteEvolucionNroInter = a.PacienteEvolucionNroInter
+    AND dx.PacienteEvolucionNroIntId = a.PacienteEvolucionNroIntId
+LEFT JOIN resumen_cuenta rc
+    ON rc.PersonaNumero = a.PersonaNumero
+    AND rc.PacienteEvolucionGestion = a.PacienteEvolucionGestion
+    AND rc.PacienteEvolucionNroInter = a.PacienteEvolucionNroInter
+    AND rc.PacienteEvolucionNroIntId = a.PacienteEvolucionNroIntId
+
+ORDER BY a.fecha_atencion DESC
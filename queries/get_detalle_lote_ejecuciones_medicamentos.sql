@@ -0,0 +1,32 @@
+-- ============================================================================
+-- Query en lote: Ejecuciones de medicamentos (clinica01) de varias cuentas
+-- ============================================================================
+-- Equivalente set-based de la sección 4 de get_detalle_atencion.sql.
+--
+-- Parámetros:
+--   {internaciones} - Lista de tuplas (gestion, internacion)
+-- ============================================================================
+
+SELECT
+    mc.Gestion AS cuenta_gestion,
+    mc.NroInternacion AS cuenta_internacion,
+    GROUP_CONCAT(
+        CONCAT(
+            'Fecha: ', mc.FechaReg,
+            ' | Medicamento: ', COALESCE(ia.IvDescrip, 'No especificado'),
+            ' | Cantidad: ', COALESCE(md.Cantidad, ''),
+            ' | Unidad: ', COALESCE(md.Unidad, ''),
+            ' | Enfermera: ', mc.Usuario,
+            ' | Observación: ', COALESCE(mc.glosa, '')
+        )
+        ORDER BY mc.FechaReg ASC
+        SEPARATOR '\n'
+    ) AS ejecuciones_medicamentos
+FROM clinica01.medicamentosc mc
+LEFT JOIN clinica01.medicamentosd md
+    ON md.Gestion = mc.Gestion
+    AND md.NroInternacion = mc.NroInternacion
+    AND md.NroMedicamento = mc.NroMedicamento
+LEFT JOIN clinica01.ivarticulos ia ON ia.IvcodArticulo = md.IvCodArticulo
+WHERE (mc.Gestion, mc.NroInternacion) IN ({internaciones})
+GROUP BY mc.Gestion, mc.NroInternacion;
@@ -0,0 +1,30 @@
+-- ============================================================================
+-- Query en lote: Estudios de imagen con informe de varias cuentas
+-- ============================================================================
+-- Equivalente set-based de la sección 7 de get_detalle_atencion.sql.
+--
+-- Parámetros:
+--   {cuentas_persona} - Lista de tuplas (persona, gestion, internacion, cuenta_id)
+-- ============================================================================
+
+SELECT
+    enc.persona_numero,
+    enc.cuenta_gestion,
+    enc.cuenta_internacion,
+    enc.cuenta_id,
+    GROUP_CONCAT(
+        DISTINCT CONCAT(
+            'Tipo: ', enc.tipo_estudio,
+            ' | Fecha: ', enc.fecha_estudio,
+            ' | Solicitante: ', enc.medico_solicitante,
+            ' | Informante: ', enc.medico_informante,
+            ' | Título: ', det.titulo,
+            ' | Hallazgos: ', det.descripcion
+        )
+        SEPARATOR '\n---IMAGEN---\n'
+    ) AS estudios_imagen
+FROM vw_hc_resultados_imagenes_encabezado enc
+JOIN vw_hc_resultados_imagenes_detalle det
+    ON det.solicitud_codigo = enc.solicitud_codigo
+WHERE (enc.persona_numero, enc.cuenta_gestion, enc.cuenta_internacion, enc.cuenta_id) IN ({cuentas_persona})
+GROUP BY enc.persona_numero, enc.cuenta_gestion, enc.cuenta_internacion, enc.cuenta_id;
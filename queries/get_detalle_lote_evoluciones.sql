@@ -0,0 +1,127 @@
+-- ============================================================================
+-- Query en lote: Evoluciones clínicas de varias cuentas
+-- ============================================================================
+-- Equivalente set-based de la sección 2 de get_detalle_atencion.sql.
+-- Diagnósticos y medicamentos se agregan una sola vez por evolución en tablas
+-- derivadas (en lugar de subconsultas correlacionadas por cada evolución).
+--
+-- Parámetros:
+--   {cuentas} - Lista de tuplas (gestion, internacion, cuenta_id)
+-- ============================================================================
+
+SELECT
+    evo.PacienteEvolucionGestion AS cuenta_gestion,
+    evo.PacienteEvolucionNroInter AS cuenta_internacion,
+    evo.PacienteEvolucionNroIntId AS cuenta_id,
+    GROUP_CONCAT(
+        JSON_OBJECT(
+            'id_evolucion', evo.EvolucionAutonumerico,
+            'fecha', evo.PacienteEvolucionFechaHora,
+            'profesional', pers.PersonaNombreCompleto,
+            'tipo_evento', CASE evo.PacienteEvolucionTipo
+                WHEN 0 THEN 'Evaluación Inicial'
+                WHEN 1 THEN 'Evaluación Inicial'
+                WHEN 2 THEN 'Evolución'
+                WHEN 3 THEN 'Epicrisis'
+                WHEN 4 THEN 'Interconsulta'
+                WHEN 5 THEN 'Reporte Enfermería'
+                WHEN 23 THEN 'Evolución Enfermería'
+                ELSE 'Evolución Clínica'
+            END,
+            'diagnosticos', dx.diagnosticos,
+            'comentario_clinico', CONCAT_WS('\n',
+                NULLIF(evo.PacienteEvolucionSubjetivo, ''),
+                NULLIF(evo.PacienteEvolucionObjetivo, ''),
+                NULLIF(evo.PacienteEvolucionProblema, ''),
+                NULLIF(evo.PacienteEvolucionComentario, ''),
+                NULLIF(evo.PacienteEvolucionHallazgos, ''),
+                NULLIF(evo.PacienteEvolucionEvFinal, '')
+            ),
+            'plan_medico', CONCAT_WS('\n',
+                NULLIF(evo.PacienteEvolucionPlan, ''),
+                NULLIF(evo.PacienteEvolucionPlanterapeuti, '')
+            ),
+            'medicamentos_prescritos', rx.medicamentos_prescritos,
+            'condicion_alta', CONVERT(ta.Descripcion USING utf8mb4),
+            'causa_egreso', evo.PacienteEvolucionCausaEgre,
+            'complicaciones', evo.PacienteEvolucionCompliTexto
+        )
+        ORDER BY evo.PacienteEvolucionFechaHora ASC
+        SEPARATOR '\n---EVOLUCION---\n'
+    ) AS evoluciones_clinicas
+FROM pacienteevolucion evo
+LEFT JOIN usuario usr ON usr.UsuarioCodigo = evo.PacienteEvolucionMUsuario
+LEFT JOIN persona pers ON pers.PersonaNumero = usr.UsuarioPersonaCodigo
+LEFT JOIN clinica01.tiposaltas ta ON ta.CodTipoAlta = evo.taCodTipoAlta
+
+-- Diagnósticos CIE9 agregados por evolución (solo evoluciones del lote)
+LEFT JOIN (
+    SELECT
+        diag.PersonaNumero,
+        diag.PacienteEvolucionFechaHora,
+        GROUP_CONCAT(
+            CONCAT(diag.CIE9CMCodigo, '-', cie.CIE9CMDescripcion,
+                CASE diag.PacienteEvolucionProblemaTipo
+                    WHEN 1 THEN ' (Principal)'
+                    WHEN 2 THEN ' (Secundario)'
+                    ELSE ''
+                END
+            ) SEPARATOR ' | '
+        ) AS diagnosticos
+    FROM (
+        SELECT DISTINCT e.PersonaNumero, e.PacienteEvolucionFechaHora
+        FROM pacienteevolucion e
+        WHERE e.PacienteEvolucionBFecha = '1000-01-01 00:00:00'
+          AND (e.PacienteEvolucionGestion, e.PacienteEvolucionNroInter, e.PacienteEvolucionNroIntId) IN ({cuentas})
+    ) lote
+    JOIN pacienteevoluciondiagnostico diag
+        ON diag.PersonaNumero = lote.PersonaNumero
+        AND diag.PacienteEvolucionFechaHora = lote.PacienteEvolucionFechaHora
+    LEFT JOIN cie9cm cie ON cie.CIE9CMCodigo = diag.CIE9CMCodigo
+    GROUP BY diag.PersonaNumero, diag.PacienteEvolucionFechaHora
+) dx
+    ON dx.PersonaNumero = evo.PersonaNumero
+    AND dx.PacienteEvolucionFechaHora = evo.PacienteEvolucionFechaHora
+
+-- Medicamentos prescritos agregados por evolución (solo evoluciones del lote)
+LEFT JOIN (
+    SELECT
+        med.PersonaNumero,
+        med.PacienteEvolucionFechaHora,
+        GROUP_CONCAT(
+            CONCAT_WS(' ',
+                CONVERT(COALESCE(ivartmed.nombregenerico, art.IvDescrip) USING utf8mb4),
+                CONVERT(COALESCE(med.PacienteMedicamentoDosisCombin, '') USING utf8mb4),
+                CONVERT(COALESCE(med.UnidadCodigo, '') USING utf8mb4),
+                CASE med.PacienteMedicamentoFrecUnidad
+                    WHEN 1 THEN CONCAT('cada ', med.PacienteMedicamentoFrecuencia, ' horas')
+                    WHEN 2 THEN CONCAT('cada ', med.PacienteMedicamentoFrecuencia, ' días')
+                    WHEN 3 THEN 'PRN'
+                    ELSE ''
+                END,
+                CONCAT('(', CONVERT(vias.Descripcion USING utf8mb4), ')')
+            ) SEPARATOR ' | '
+        ) AS medicamentos_prescritos
+    FROM (
+        SELECT DISTINCT e.PersonaNumero, e.PacienteEvolucionFechaHora
+        FROM pacienteevolucion e
+        WHERE e.PacienteEvolucionBFecha = '1000-01-01 00:00:00'
+          AND (e.PacienteEvolucionGestion, e.PacienteEvolucionNroInter, e.PacienteEvolucionNroIntId) IN ({cuentas})
+    ) lote
+    JOIN pacienteevolucionmedicamento med
+        ON med.PersonaNumero = lote.PersonaNumero
+        AND med.PacienteEvolucionFechaHora = lote.PacienteEvolucionFechaHora
+    LEFT JOIN clinica01.ivarticulosmed ivartmed ON ivartmed.ivcodarticulo = med.MedicamentoCodigo
+    LEFT JOIN clinica01.ivarticulos art ON art.IvcodArticulo = med.MedicamentoCodigo
+    LEFT JOIN clinica01.vias ON clinica01.vias.CodVia = med.ViaEvoCodigo
+    GROUP BY med.PersonaNumero, med.PacienteEvolucionFechaHora
+) rx
+    ON rx.PersonaNumero = evo.PersonaNumero
+    AND rx.PacienteEvolucionFechaHora = evo.PacienteEvolucionFechaHora
+
+WHERE evo.PacienteEvolucionBFecha = '1000-01-01 00:00:00'
+  AND (evo.PacienteEvolucionGestion, evo.PacienteEvolucionNroInter, evo.PacienteEvolucionNroIntId) IN ({cuentas})
+GROUP BY
+    evo.PacienteEvolucionGestion,
+    evo.PacienteEvolucionNroInter,
+    evo.PacienteEvolucionNroIntId;
@@ -0,0 +1,27 @@
+-- ============================================================================
+-- Query en lote: Resultados de laboratorio de varias cuentas
+-- ============================================================================
+-- Equivalente set-based de la sección 6 de get_detalle_atencion.sql.
+--
+-- Parámetros:
+--   {cuentas_persona} - Lista de tuplas (persona, gestion, internacion, cuenta_id)
+-- ============================================================================
+
+SELECT
+    persona_numero,
+    cuenta_gestion,
+    cuenta_internacion,
+    cuenta_id,
+    GROUP_CONCAT(
+        DISTINCT CONCAT(
+            'Servicio: ', descripcion_servicio,
+            ' | Fecha: ', fecha_orden,
+            ' | Lab #', numero_laboratorio,
+            ' | Resultados: ', linea_detalle, ': ', resultado, ' ', COALESCE(unidad, ''),
+            ' (Ref: ', COALESCE(valor_referencia, 'N/A'), ')'
+        )
+        SEPARATOR '\n'
+    ) AS laboratorios
+FROM vw_hc_resultados_laboratorio
+WHERE (persona_numero, cuenta_gestion, cuenta_internacion, cuenta_id) IN ({cuentas_persona})
+GROUP BY persona_numero, cuenta_gestion, cuenta_internacion, cuenta_id;
@@ -0,0 +1,26 @@
+-- ============================================================================
+-- Query en lote: Notas de enfermería de varias cuentas
+-- ============================================================================
+-- Equivalente set-based de la sección 5 de get_detalle_atencion.sql.
+--
+-- Parámetros:
+--   {cuentas_persona} - Lista de tuplas (persona, gestion, internacion, cuenta_id)
+-- ============================================================================
+
+SELECT
+    PersonaNumero AS persona_numero,
+    InterGestion AS cuenta_gestion,
+    InterNroInternacion AS cuenta_internacion,
+    InterNroIntID AS cuenta_id,
+    GROUP_CONCAT(
+        CONCAT(
+            'Fecha: ', COALESCE(NotaEnfHoraRealizado, NotaEnfMFecha),
+            ' | Usuario: ', NotaEnfMUsuario,
+            ' | Nota: ', NotaEnfConclusion
+        )
+        ORDER BY COALESCE(NotaEnfHoraRealizado, NotaEnfMFecha) ASC
+        SEPARATOR '\n'
+    ) AS notas_enfermeria
+FROM notasenfermeria
+WHERE (PersonaNumero, InterGestion, InterNroInternacion, InterNroIntID) IN ({cuentas_persona})
+GROUP BY PersonaNumero, InterGestion, InterNroInternacion, InterNroIntID;
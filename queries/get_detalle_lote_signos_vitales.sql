@@ -0,0 +1,22 @@
+-- ============================================================================
+-- Query en lote: Signos vitales de varias cuentas
+-- ============================================================================
+-- Equivalente set-based de la sección 3 de get_detalle_atencion.sql.
+--
+-- Parámetros:
+--   {cuentas_persona} - Lista de tuplas (persona, gestion, internacion, cuenta_id)
+-- ============================================================================
+
+SELECT
+    persona_numero,
+    cuenta_gestion,
+    cuenta_internacion,
+    cuenta_id,
+    GROUP_CONCAT(
+        CONCAT(fecha_registro, ': ', descripcion, ' = ', valor, ' ', COALESCE(unidad, ''))
+        ORDER BY fecha_registro ASC
+        SEPARATOR ' | '
+    ) AS signos_vitales
+FROM vw_hc_signos_vitales
+WHERE (persona_numero, cuenta_gestion, cuenta_internacion, cuenta_id) IN ({cuentas_persona})
+GROUP BY persona_numero, cuenta_gestion, cuenta_internacion, cuenta_id;
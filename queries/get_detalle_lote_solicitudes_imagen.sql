@@ -0,0 +1,33 @@
+-- ============================================================================
+-- Query en lote: Solicitudes de imagen/estudios de varias cuentas
+-- ============================================================================
+-- Equivalente set-based de la sección 9 de get_detalle_atencion.sql.
+--
+-- Parámetros:
+--   {cuentas_persona} - Lista de tuplas (persona, gestion, internacion, cuenta_id)
+-- ============================================================================
+
+SELECT
+    sol.Pacienteimagencodigo AS persona_numero,
+    ate.InternacionesGestion AS cuenta_gestion,
+    ate.InternacionesNroInternacion AS cuenta_internacion,
+    ate.InternacionesNroIntId AS cuenta_id,
+    GROUP_CONCAT(
+        DISTINCT CONCAT(
+            'Estudio: ', prest.PrestacionDescripcion,
+            ' | Fecha solicitud: ', sol.PacienteSolicudEstudioSFecha,
+            ' | Codigo: ', prest.PrestacionCodigo
+        )
+        SEPARATOR '\n'
+    ) AS solicitudes_imagen
+FROM pacientesolicudestudio sol
+INNER JOIN prestacion prest
+    ON prest.PrestacionCodigo = sol.PrestacionCodigo
+INNER JOIN turnoatencion ate
+    ON ate.TurnoNumero = sol.TurnoNumero
+WHERE (sol.Pacienteimagencodigo, ate.InternacionesGestion, ate.InternacionesNroInternacion, ate.InternacionesNroIntId) IN ({cuentas_persona})
+GROUP BY
+    sol.Pacienteimagencodigo,
+    ate.InternacionesGestion,
+    ate.InternacionesNroInternacion,
+    ate.InternacionesNroIntId;
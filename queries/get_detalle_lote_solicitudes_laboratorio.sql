@@ -0,0 +1,33 @@
+-- ============================================================================
+-- Query en lote: Solicitudes de laboratorio de varias cuentas
+-- ============================================================================
+-- Equivalente set-based de la sección 8 de get_detalle_atencion.sql.
+-- Igual que la query individual, las solicitudes se asocian por
+-- paciente + gestión + internación (sin cuenta_id).
+--
+-- Parámetros:
+--   {internaciones_persona} - Lista de tuplas (persona, gestion, internacion)
+-- ============================================================================
+
+SELECT
+    maestro.PacienteLaboCodigo AS persona_numero,
+    maestro.PacienteSolicudLaboratorioGest AS cuenta_gestion,
+    maestro.PacienteSolicudLaboratorioNroI AS cuenta_internacion,
+    GROUP_CONCAT(
+        DISTINCT CONCAT(
+            'Estudio: ', prod.Descripcion,
+            ' | Fecha solicitud: ', maestro.PacienteSolicudLaboratorioSFec,
+            ' | Codigo: ', prod.CodProdCMF
+        )
+        SEPARATOR '\n'
+    ) AS solicitudes_laboratorio
+FROM pacientesolicudlaboratorio maestro
+INNER JOIN pacientesolicudlaboratoriolabo det
+    ON det.PacienteSolicudLaboratorioCodi = maestro.PacienteSolicudLaboratorioCodi
+INNER JOIN clinica01.productos prod
+    ON prod.CodProdCMF = det.productosCodProdCMF
+WHERE (maestro.PacienteLaboCodigo, maestro.PacienteSolicudLaboratorioGest, maestro.PacienteSolicudLaboratorioNroI) IN ({internaciones_persona})
+GROUP BY
+    maestro.PacienteLaboCodigo,
+    maestro.PacienteSolicudLaboratorioGest,
+    maestro.PacienteSolicudLaboratorioNroI;
@@ -1,3 +1,13 @@
+-- ============================================================================
+-- VERSIÓN DE REFERENCIA (subconsultas correlacionadas)
+-- ============================================================================
+-- Versión anterior de la query de 24h (hoy get_atenciones_urgencias.sql con
+-- desde = NOW() - 24h y sin límite superior). NO la usa el sistema:
+-- se conserva únicamente para que comparar_query_24h.py verifique que la
+-- versión actual (una sola pasada, sin subconsultas correlacionadas)
+-- devuelve exactamente las mismas filas.
+-- ============================================================================
+
 -- Obtener TODAS las ATENCIONES ÚNICAS de urgencias de las últimas 24 horas
 -- Para sistema de auditoría diaria de producción
 -- IMPORTANTE: Agrupa por número de internación para evitar duplicados por múltiples evoluciones
@@ -0,0 +1,273 @@
+"""
+Servicio de Auditoría de Atenciones - Clínica Foianini
+======================================================
+
+Proceso de larga duración que mantiene abiertos el pool MySQL (MCPClient) y el
+cliente LLM (AuditorLLM, con litellm ya importado) y atiende auditorías de cuentas
+individuales por HTTP local o por socket Unix. Cada solicitud ejecuta la misma
+auditoría que auditar_atencion.py, sin el arranque de Python, el import de litellm
+ni la conexión a MySQL.
+
+Las auditorías corren en paralelo hasta --concurrencia; dos solicitudes simultáneas
+de la misma cuenta comparten una sola auditoría.
+
+Uso:
+    python servicio_auditoria.py                            # escucha en 127.0.0.1:8090
+    python servicio_auditoria.py --puerto 8091 --concurrencia 8
+    python servicio_auditoria.py --socket /tmp/auditoria.sock
+
+    curl -X POST http://127.0.0.1:8090/auditar -d '{"cuenta": "2025/140954"}'
+    curl -X POST http://127.0.0.1:8090/auditar -d '{"cuenta": "2025/140954", "sin_cache": true, "incluir_html": true}'
+    curl --unix-socket /tmp/auditoria.sock -X POST http://localhost/auditar -d '{"cuenta": "2025/140954"}'
+
+Endpoints:
+    POST /auditar             {"cuenta": "GESTION/INTERNACION[/ID]", "sin_cache": false, "incluir_html": false}
+                              -> resultado de la auditoría, rutas del JSON y HTML generados y,
+                                 con incluir_html, el HTML completo
+    GET  /archivos/<nombre>   descarga un output generado (atencion_*.json / atencion_*.html)
+    GET  /salud               estado del servicio y estadísticas del LLM
+
+Outputs:
+    - Los mismos de auditar_atencion.py: output/atencion_[gestion]_[internacion]_[id]_YYYYMMDD_HHMMSS.json/.html
+"""
+
+import os
+import re
+import json
+import stat
+import time
+import argparse
+import threading
+import socketserver
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Tuple
+
+from main import cargar_litellm, configurar_logging, logger
+from auditar_atencion import AuditorAtencionEspecifica
+
+DIRECTORIO_OUTPUT = "output"
+
+# Solo se sirven los outputs de auditorías individuales
+_ARCHIVO_OUTPUT = re.compile(r"^atencion_\d+_\d+_\d+_\d{8}_\d{6}(_\d+)?\.(json|html)$")
+
+
+class ServicioAuditoria:
+    """Auditor compartido por todas las solicitudes, con auditorías en un pool de hilos"""
+
+    def __init__(self, max_concurrencia: int = 4, usar_cache_llm=None):
+        inicio = time.perf_counter()
+        # Importar litellm ahora: la primera solicitud no debe pagar su import
+        cargar_litellm()
+        self.auditor = AuditorAtencionEspecifica(usar_cache_llm=usar_cache_llm)
+        self.ejecutor = ThreadPoolExecutor(max_workers=max(1, max_concurrencia), thread_name_prefix="auditoria")
+        self.max_concurrencia = max(1, max_concurrencia)
+        self.en_curso: Dict[Tuple[int, int, int, bool], Future] = {}
+        self.lock = threading.Lock()
+        self.atendidas = 0
+        self.fallidas = 0
+        self.inicio = time.time()
+        logger.info(f"Servicio de auditoría listo en {time.perf_counter() - inicio:.1f}s "
+                    f"(concurrencia {self.max_concurrencia})")
+
+    def auditar(self, gestion: int, internacion: int, id: int = 1, usar_cache: bool = True) -> Future:
+        """
+        Encola la auditoría de la cuenta y retorna su Future ((resultado, archivo_json,
+        archivo_html) o None). Si la cuenta ya se está auditando con el mismo uso de la caché,
+        retorna el Future en curso (una solicitud sin caché no recibe un resultado cacheado).
+        """
+        clave = (gestion, internacion, id, usar_cache)
+        with self.lock:
+            futuro = self.en_curso.get(clave)
+            if futuro is None:
+                futuro = self.ejecutor.submit(self._ejecutar, clave)
+                self.en_curso[clave] = futuro
+            return futuro
+
+    def _ejecutar(self, clave: Tuple[int, int, int, bool]):
+        gestion, internacion, id, usar_cache = clave
+        cuenta = f"{gestion}/{internacion}"
+
+        def informar(mensaje=""):
+            mensaje = str(mensaje).strip()
+            if mensaje and not mensaje.startswith("="):
+                logger.info(f"[{cuenta}] {mensaje}")
+
+        try:
+            ejecucion = self.auditor.ejecutar(gestion, internacion, id, usar_cache=usar_cache, informar=informar)
+        except Exception:
+            with self.lock:
+                self.fallidas += 1
+            raise
+        finally:
+            with self.lock:
+                self.en_curso.pop(clave, None)
+
+        with self.lock:
+            if ejecucion:
+                self.atendidas += 1
+            else:
+                self.fallidas += 1
+        return ejecucion
+
+    def salud(self) -> dict:
+        with self.lock:
+            en_curso = [f"{g}/{i}" for g, i, _, _ in self.en_curso]
+            atendidas, fallidas = self.atendidas, self.fallidas
+        return {
+            "estado": "ok",
+            "segundos_activo": round(time.time() - self.inicio),
+            "concurrencia": self.max_concurrencia,
+            "en_curso": en_curso,
+            "atendidas": atendidas,
+            "fallidas": fallidas,
+            "llm": self.auditor.auditor_llm.resumen_estadisticas()
+        }
+
+    def cerrar(self):
+        self.ejecutor.shutdown(wait=True, cancel_futures=True)
+
+
+class ManejadorServicio(BaseHTTPRequestHandler):
+    servicio: ServicioAuditoria = None
+
+    def log_message(self, format, *args):
+        # En un socket Unix client_address es "" (address_string() no aplica)
+        logger.info(f"[servicio] {format % args}")
+
+    def _responder(self, codigo, cuerpo, tipo="application/json"):
+        if isinstance(cuerpo, (dict, list)):
+            cuerpo = json.dumps(cuerpo, ensure_ascii=False, default=str)
+        data = cuerpo.encode("utf-8") if isinstance(cuerpo, str) else cuerpo
+        self.send_response(codigo)
+        self.send_header("Content-Type", f"{tipo}; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        try:
+            self.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            logger.warning(f"[servicio] cliente desconectado antes de la respuesta ({self.path})")
+
+    def _leer_json(self):
+        largo = int(self.headers.get("Content-Length", "0"))
+        return json.loads(self.rfile.read(largo) or b"{}")
+
+    def do_POST(self):
+        if self.path.rstrip("/") != "/auditar":
+            self._responder(404, {"error": f"Ruta no soportada: {self.path}"})
+            return
+
+        try:
+            solicitud = self._leer_json()
+            gestion, internacion, id = self.servicio.auditor.parsear_cuenta(str(solicitud.get("cuenta", "")))
+        except (ValueError, AttributeError) as e:
+            self._responder(400, {"error": str(e) or "Cuerpo JSON inválido"})
+            return
+
+        inicio = time.perf_counter()
+        try:
+            ejecucion = self.servicio.auditar(
+                gestion, internacion, id, usar_cache=not solicitud.get("sin_cache", False)
+            ).result()
+        except Exception as e:
+            logger.error(f"Error auditando la cuenta {gestion}/{internacion}: {e}", exc_info=True)
+            self._responder(500, {"error": f"Error inesperado: {e}"})
+            return
+
+        if not ejecucion:
+            self._responder(404, {
+                "error": f"No se pudo auditar la cuenta {gestion}/{internacion}: no existe, no tiene "
+                         f"evoluciones o falló la auditoría con IA (ver log)"
+            })
+            return
+
+        resultado, archivo_json, archivo_html = ejecucion
+        respuesta = {
+            "cuenta": f"{gestion}/{internacion}",
+            "segundos": round(time.perf_counter() - inicio, 2),
+            "resultado": resultado.model_dump(),
+            "archivo_json": archivo_json,
+            "archivo_html": archivo_html
+        }
+        if solicitud.get("incluir_html"):
+            with open(archivo_html, "r", encoding="utf-8") as f:
+                respuesta["html"] = f.read()
+        self._responder(200, respuesta)
+
+    def do_GET(self):
+        ruta = self.path.rstrip("/")
+        if ruta == "/salud":
+            self._responder(200, self.servicio.salud())
+            return
+
+        if ruta.startswith("/archivos/"):
+            nombre = ruta[len("/archivos/"):]
+            archivo = os.path.join(DIRECTORIO_OUTPUT, nombre)
+            if not _ARCHIVO_OUTPUT.match(nombre) or not os.path.isfile(archivo):
+                self._responder(404, {"error": f"Archivo inexistente: {nombre}"})
+                return
+            with open(archivo, "rb") as f:
+                contenido = f.read()
+            self._responder(200, contenido, "text/html" if nombre.endswith(".html") else "application/json")
+            return
+
+        self._responder(404, {"error": f"Ruta no soportada: {self.path}"})
+
+
+def es_socket(ruta: str) -> bool:
+    """True si la ruta existe y es un socket Unix (nunca se borra otro tipo de archivo)"""
+    try:
+        return stat.S_ISSOCK(os.stat(ruta).st_mode)
+    except FileNotFoundError:
+        return False
+
+
+class ServidorUnixHTTP(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Servidor HTTP sobre socket Unix (un hilo por conexión, como ThreadingHTTPServer)"""
+    daemon_threads = True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servicio de auditoría de atenciones (HTTP local o socket Unix)")
+    parser.add_argument("--host", default=os.getenv("SERVICIO_HOST", "127.0.0.1"),
+                        help="Host de escucha (por defecto: SERVICIO_HOST o 127.0.0.1)")
+    parser.add_argument("--puerto", type=int, default=int(os.getenv("SERVICIO_PUERTO", "8090")),
+                        help="Puerto de escucha (por defecto: SERVICIO_PUERTO o 8090)")
+    parser.add_argument("--socket", default=os.getenv("SERVICIO_SOCKET") or None,
+                        help="Escuchar en este socket Unix en lugar de host:puerto")
+    parser.add_argument("--concurrencia", type=int, default=int(os.getenv("SERVICIO_MAX_CONCURRENCIA", "4")),
+                        help="Auditorías simultáneas (por defecto: SERVICIO_MAX_CONCURRENCIA o 4)")
+    parser.add_argument("--sin-cache", action="store_true",
+                        help="No usar la caché local de resultados del LLM en ninguna solicitud")
+    args = parser.parse_args()
+    if args.socket and os.path.exists(args.socket) and not es_socket(args.socket):
+        parser.error(f"{args.socket} ya existe y no es un socket")
+    configurar_logging()
+    os.makedirs(DIRECTORIO_OUTPUT, exist_ok=True)
+
+    ManejadorServicio.servicio = ServicioAuditoria(
+        max_concurrencia=args.concurrencia, usar_cache_llm=False if args.sin_cache else None
+    )
+    if args.socket:
+        if es_socket(args.socket):
+            os.remove(args.socket)  # socket de una ejecución anterior
+        servidor = ServidorUnixHTTP(args.socket, ManejadorServicio)
+        direccion = f"unix:{args.socket}"
+    else:
+        servidor = ThreadingHTTPServer((args.host, args.puerto), ManejadorServicio)
+        direccion = f"http://{args.host}:{args.puerto}"
+
+    print(f"Servicio de auditoría escuchando en {direccion} (Ctrl+C para detener)")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        print("\nServicio detenido")
+    finally:
+        servidor.server_close()
+        ManejadorServicio.servicio.cerrar()
+        if args.socket and es_socket(args.socket):
+            os.remove(args.socket)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,319 @@
+"""
+Servidor Stub de LLM - Pruebas Locales
+======================================
+
+Endpoint local compatible con OpenRouter/OpenAI (POST /chat/completions) que
+responde auditorías ficticias válidas, para probar AuditorLLM sin consumir
+créditos ni depender de la red.
+
+Simula el prompt caching del proveedor: la primera vez que recibe un bloque de
+sistema marcado con cache_control reporta tokens escritos en caché; las
+siguientes reporta tokens leídos de caché (prompt_tokens_details.cached_tokens).
+
+Con --rpm simula el límite de tasa del proveedor: al superar N requests en los
+últimos 60 segundos responde 429 con el header Retry-After.
+
+Si el prompt trae varias atenciones empaquetadas ("### Atención GESTION/INTERNACION")
+responde {"auditorias": [...]} con un objeto por cuenta.
+
+Con --fallas-formato simula respuestas mal formadas (texto previo, bloque ```json
+y coma final) en esa fracción de las solicitudes que NO envían response_format
+con json_schema; las que lo envían reciben siempre un objeto válido, como con la
+salida estructurada del proveedor.
+
+También simula la API de lotes de Anthropic (POST /v1/messages/batches, GET
+/v1/messages/batches/{id} y /results): cada lote pasa a "ended" después de
+--latencia-lote segundos, con una auditoría ficticia por solicitud.
+
+Uso:
+    python stub_llm.py                      # escucha en 127.0.0.1:8099
+    python stub_llm.py --puerto 8100 --latencia 2
+    python stub_llm.py --rpm 30             # responde 429 por encima de 30 requests/minuto
+    python stub_llm.py --latencia-modelo anthropic/claude-sonnet-4.5=30   # principal lento (probar cobertura)
+    python stub_llm.py --fallas-formato 0.3   # 30% de respuestas con JSON inválido si no hay response_format
+    python stub_llm.py --latencia-lote 30     # los lotes terminan 30 s después de enviarse
+
+    # En otra terminal, apuntar el auditor al stub:
+    OPENROUTER_BASE_URL=http://127.0.0.1:8099 python auditar_atencion.py 2025/140954
+    LOTE_BASE_URL=http://127.0.0.1:8099 python main.py --modo lote --esperar
+"""
+
+import json
+import time
+import hashlib
+import argparse
+import math
+import re
+import random
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+AUDITORIA_FICTICIA = {
+    "cumple_guias": "Sí",
+    "score_calidad": 85,
+    "guias_aplicables": ["WHO - Manejo de urgencias", "ACEP - Clinical Policy"],
+    "criterios_cumplidos": ["Evaluación inicial oportuna"],
+    "criterios_no_cumplidos": [],
+    "tratamiento_adecuado": "Adecuado según guías",
+    "tiempo_atencion": "Adecuado",
+    "estudios_solicitados": "Apropiados",
+    "medicacion_apropiada": "Apropiada",
+    "hallazgos_criticos": [],
+    "recomendaciones": ["Respuesta generada por stub_llm.py"],
+    "comentarios_adicionales": "Auditoría ficticia del servidor stub"
+}
+
+
+def estimar_tokens(texto):
+    """Aproximación de tokens suficiente para el stub (~4 caracteres por token)"""
+    return max(1, len(texto) // 4)
+
+
+class EstadoStub:
+    """Estado compartido entre requests (caché simulada y contadores)"""
+    def __init__(self, latencia, rpm=0, latencia_por_modelo=None, fallas_formato=0.0, latencia_lote=5.0):
+        self.latencia = latencia
+        self.fallas_formato = fallas_formato
+        self.latencia_lote = latencia_lote
+        self.lotes = {}
+        self.latencia_por_modelo = latencia_por_modelo or {}
+        self.rpm = rpm
+        self.lock = threading.Lock()
+        self.prefijos_cacheados = set()
+        self.requests = 0
+        self.rechazadas = 0
+        self.ventana = deque()
+
+    def admitir(self):
+        """Ventana deslizante de 60 s. Retorna None si se admite, o los segundos de Retry-After."""
+        if not self.rpm:
+            return None
+        ahora = time.monotonic()
+        with self.lock:
+            while self.ventana and ahora - self.ventana[0] >= 60:
+                self.ventana.popleft()
+            if len(self.ventana) >= self.rpm:
+                self.rechazadas += 1
+                return max(1, math.ceil(60 - (ahora - self.ventana[0])))
+            self.ventana.append(ahora)
+            return None
+
+
+class ManejadorStub(BaseHTTPRequestHandler):
+    estado: EstadoStub = None
+
+    def log_message(self, format, *args):
+        print(f"[stub] {self.address_string()} - {format % args}")
+
+    def _responder(self, codigo, cuerpo, headers=None):
+        data = json.dumps(cuerpo, ensure_ascii=False).encode("utf-8")
+        self.send_response(codigo)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for nombre, valor in (headers or {}).items():
+            self.send_header(nombre, valor)
+        self.end_headers()
+        try:
+            self.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            # El cliente canceló la solicitud (ej: perdió contra la solicitud de cobertura)
+            print(f"[stub] cliente desconectado antes de la respuesta ({self.path})")
+
+    def _leer_json(self):
+        largo = int(self.headers.get("Content-Length", "0"))
+        return json.loads(self.rfile.read(largo) or b"{}")
+
+    def do_POST(self):
+        ruta = self.path.rstrip("/")
+        if ruta.endswith("/v1/messages/batches"):
+            self._crear_lote(self._leer_json())
+        elif ruta.endswith("/chat/completions"):
+            self._chat_completion(self._leer_json())
+        else:
+            self._responder(404, {"error": {"message": f"Ruta no soportada: {self.path}"}})
+
+    def do_GET(self):
+        partes = self.path.rstrip("/").split("/")
+        if "batches" not in partes:
+            self._responder(404, {"error": {"message": f"Ruta no soportada: {self.path}"}})
+            return
+        resto = partes[partes.index("batches") + 1:]
+        lote = self.estado.lotes.get(resto[0]) if resto else None
+        if lote is None:
+            self._responder(404, {"error": {"type": "not_found_error", "message": f"Lote inexistente: {self.path}"}})
+        elif len(resto) == 1:
+            self._responder(200, self._objeto_lote(resto[0], lote))
+        elif resto[1] == "results" and self._objeto_lote(resto[0], lote)["processing_status"] == "ended":
+            self._resultados_lote(lote)
+        else:
+            self._responder(400, {"error": {"type": "invalid_request_error", "message": "El lote sigue en proceso"}})
+
+    def _contenido_auditoria(self, formato, texto=""):
+        """
+        Auditoría ficticia; mal formada en la fracción --fallas-formato si no se pidió json_schema.
+        Si el prompt trae varias atenciones ("### Atención GESTION/INTERNACION") responde una por cuenta.
+        """
+        cuentas = re.findall(r"### Atención (\S+)", texto)
+        if cuentas:
+            contenido = json.dumps(
+                {"auditorias": [{"cuenta": cuenta, **AUDITORIA_FICTICIA} for cuenta in cuentas]}, ensure_ascii=False
+            )
+        else:
+            contenido = json.dumps(AUDITORIA_FICTICIA, ensure_ascii=False)
+        if (formato or {}).get("type") != "json_schema" and random.random() < self.estado.fallas_formato:
+            contenido = f"Aquí está la auditoría solicitada:\n```json\n{contenido[:-1]},\n}}\n```"
+        return contenido
+
+    def _crear_lote(self, body):
+        estado = self.estado
+        with estado.lock:
+            id_lote = f"msgbatch_stub_{len(estado.lotes) + 1:04d}"
+            estado.lotes[id_lote] = {"creado": time.time(), "solicitudes": body.get("requests", [])}
+        print(f"[stub] lote {id_lote} con {len(body.get('requests', []))} solicitudes")
+        self._responder(200, self._objeto_lote(id_lote, estado.lotes[id_lote]))
+
+    def _objeto_lote(self, id_lote, lote):
+        terminado = time.time() - lote["creado"] >= self.estado.latencia_lote
+        cantidad = len(lote["solicitudes"])
+        host = self.headers.get("Host", "127.0.0.1")
+        return {
+            "id": id_lote,
+            "type": "message_batch",
+            "processing_status": "ended" if terminado else "in_progress",
+            "request_counts": {
+                "processing": 0 if terminado else cantidad, "succeeded": cantidad if terminado else 0,
+                "errored": 0, "canceled": 0, "expired": 0
+            },
+            "results_url": f"http://{host}/v1/messages/batches/{id_lote}/results" if terminado else None
+        }
+
+    def _resultados_lote(self, lote):
+        lineas = []
+        for solicitud in lote["solicitudes"]:
+            params = solicitud.get("params", {})
+            contenido = self._contenido_auditoria(None)
+            texto_prompt = "".join(b.get("text", "") for b in params.get("system", [])) + "".join(
+                m.get("content", "") if isinstance(m.get("content"), str) else "" for m in params.get("messages", [])
+            )
+            lineas.append(json.dumps({
+                "custom_id": solicitud.get("custom_id"),
+                "result": {
+                    "type": "succeeded",
+                    "message": {
+                        "id": f"msg_stub_{solicitud.get('custom_id')}",
+                        "type": "message",
+                        "role": "assistant",
+                        "model": params.get("model", "stub"),
+                        "content": [{"type": "text", "text": contenido}],
+                        "stop_reason": "end_turn",
+                        "usage": {"input_tokens": estimar_tokens(texto_prompt), "output_tokens": estimar_tokens(contenido)}
+                    }
+                }
+            }, ensure_ascii=False))
+        data = ("\n".join(lineas) + "\n").encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-jsonl")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _chat_completion(self, body):
+        estado = self.estado
+        retry_after = estado.admitir()
+        if retry_after is not None:
+            self._responder(
+                429,
+                {"error": {"message": "Rate limit exceeded (stub)", "code": 429}},
+                headers={"Retry-After": str(retry_after)}
+            )
+            return
+
+        with estado.lock:
+            estado.requests += 1
+
+        mensajes = body.get("messages", [])
+        tokens_prefijo_cacheable = 0
+        prefijo = ""
+        texto_total = ""
+        for mensaje in mensajes:
+            contenido = mensaje.get("content")
+            if isinstance(contenido, list):
+                for bloque in contenido:
+                    texto = bloque.get("text", "")
+                    texto_total += texto
+                    if bloque.get("cache_control"):
+                        prefijo += texto
+                        tokens_prefijo_cacheable = estimar_tokens(prefijo)
+            else:
+                texto_total += contenido or ""
+
+        tokens_cacheados = 0
+        tokens_escritos = 0
+        if prefijo:
+            clave = hashlib.sha256(prefijo.encode("utf-8")).hexdigest()
+            with estado.lock:
+                if clave in estado.prefijos_cacheados:
+                    tokens_cacheados = tokens_prefijo_cacheable
+                else:
+                    estado.prefijos_cacheados.add(clave)
+                    tokens_escritos = tokens_prefijo_cacheable
+
+        latencia = estado.latencia_por_modelo.get(body.get("model"), estado.latencia)
+        if latencia:
+            time.sleep(latencia)
+
+        contenido = self._contenido_auditoria(body.get("response_format"), texto_total)
+        self._responder(200, {
+            "id": f"stub-{estado.requests}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "stub"),
+            "choices": [{
+                "index": 0,
+                "finish_reason": "stop",
+                "message": {"role": "assistant", "content": contenido}
+            }],
+            "usage": {
+                "prompt_tokens": estimar_tokens(texto_total),
+                "completion_tokens": estimar_tokens(contenido),
+                "total_tokens": estimar_tokens(texto_total) + estimar_tokens(contenido),
+                "prompt_tokens_details": {"cached_tokens": tokens_cacheados},
+                "cache_creation_input_tokens": tokens_escritos
+            }
+        })
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor stub compatible con OpenRouter para pruebas locales")
+    parser.add_argument("--host", default="127.0.0.1", help="Host de escucha (por defecto: 127.0.0.1)")
+    parser.add_argument("--puerto", type=int, default=8099, help="Puerto de escucha (por defecto: 8099)")
+    parser.add_argument("--latencia", type=float, default=0.0, help="Segundos de espera simulada por respuesta")
+    parser.add_argument("--rpm", type=int, default=0, help="Requests por minuto antes de responder 429 (0 = sin límite)")
+    parser.add_argument("--latencia-modelo", action="append", default=[], metavar="MODELO=SEGUNDOS",
+                        help="Latencia específica para un modelo (se puede repetir)")
+    parser.add_argument("--fallas-formato", type=float, default=0.0, metavar="FRACCION",
+                        help="Fracción de respuestas con JSON mal formado si la solicitud no envía response_format")
+    parser.add_argument("--latencia-lote", type=float, default=5.0,
+                        help="Segundos hasta que un lote pasa a 'ended' (por defecto: 5)")
+    args = parser.parse_args()
+
+    latencia_por_modelo = {}
+    for valor in args.latencia_modelo:
+        modelo, _, segundos = valor.rpartition("=")
+        latencia_por_modelo[modelo] = float(segundos)
+
+    ManejadorStub.estado = EstadoStub(latencia=args.latencia, rpm=args.rpm, latencia_por_modelo=latencia_por_modelo,
+                                     fallas_formato=args.fallas_formato, latencia_lote=args.latencia_lote)
+    servidor = ThreadingHTTPServer((args.host, args.puerto), ManejadorStub)
+    print(f"Stub LLM escuchando en http://{args.host}:{args.puerto} (Ctrl+C para detener)")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        print("\nStub detenido")
+    finally:
+        servidor.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+Motor de renderizado de reportes HTML
+=====================================
+
+Los reportes se arman como una lista de fragmentos que se une UNA sola vez al final
+(o se escribe directo al archivo), en lugar de concatenar `html += ...` sobre un string
+que crece con cada atención: con miles de atenciones cada concatenación puede copiar
+el documento completo y el costo se vuelve cuadrático.
+
+Uso:
+    from utils.render import Fragmentos, items_lista
+
+    html = Fragmentos()
+    html += f"<h1>{titulo}</h1>\n"
+    html += items_lista(hallazgos, sangria=24, vacio="<em>Sin hallazgos</em>")
+    return html.render()
+"""
+
+from typing import Iterable, Optional
+
+
+class Fragmentos:
+    """
+    Acumulador de fragmentos de texto. `+=` agrega un fragmento en O(1);
+    `render()` los une en un único string y `escribir()` los vuelca a disco
+    sin construir ese string intermedio.
+    """
+    __slots__ = ("_partes",)
+
+    def __init__(self, *partes: str):
+        self._partes = list(partes)
+
+    def __iadd__(self, texto: str):
+        self._partes.append(texto)
+        return self
+
+    def agregar(self, *textos: str):
+        """Agrega varios fragmentos a la vez"""
+        self._partes.extend(textos)
+
+    def __len__(self) -> int:
+        """Cantidad de caracteres acumulados"""
+        return sum(len(parte) for parte in self._partes)
+
+    def render(self) -> str:
+        return "".join(self._partes)
+
+    def escribir(self, archivo: str):
+        with open(archivo, "w", encoding="utf-8") as f:
+            f.writelines(self._partes)
+
+
+def items_lista(items: Iterable, sangria: int = 0, vacio: Optional[str] = None) -> str:
+    """
+    Renderiza `<li>` por cada item (una línea por item, con la sangría dada).
+    Si no hay items y se indica `vacio`, renderiza un único `<li>` con ese contenido.
+    """
+    prefijo = " " * sangria
+    lineas = [f"{prefijo}<li>{item}</li>\n" for item in items]
+    if not lineas and vacio is not None:
+        lineas.append(f"{prefijo}<li>{vacio}</li>\n")
+    return "".join(lineas)
@@ -0,0 +1,125 @@
+"""
+Reparación local de JSON mal formado
+====================================
+
+Los modelos a veces devuelven un objeto JSON casi válido: envuelto en un bloque
+```json, precedido de texto ("Aquí está la auditoría:"), con comas finales, comillas
+sin escapar dentro de un texto o cortado antes de cerrar llaves y corchetes. Repararlo
+de forma determinista es instantáneo; volver a pedir la respuesta cuesta otra llamada
+completa al LLM.
+
+Uso:
+    from utils.reparar_json import cargar_json_tolerante
+
+    data, reparado = cargar_json_tolerante(contenido)   # json.JSONDecodeError si no hay arreglo
+"""
+
+import re
+import json
+from typing import Any, List, Tuple
+
+ESPACIOS = " \t\r\n"
+
+# Clave de objeto sin valor al final del texto (respuesta cortada): `, "clave"` o `, "clave":`
+_CLAVE_COLGANTE = re.compile(r'(?:,|(?<=\{))\s*"(?:[^"\\]|\\.)*"\s*:?\s*$')
+
+
+def _siguiente_significativo(texto: str, inicio: int) -> str:
+    """Primer carácter que no es espacio a partir de `inicio` ("" si no hay)"""
+    for caracter in texto[inicio:]:
+        if caracter not in ESPACIOS:
+            return caracter
+    return ""
+
+
+def _quitar_coma_final(salida: List[str]):
+    """Elimina espacios y una coma colgante al final de lo ya escrito"""
+    while salida and salida[-1] in ESPACIOS:
+        salida.pop()
+    if salida and salida[-1] == ",":
+        salida.pop()
+
+
+def reparar_json(texto: str) -> str:
+    """
+    Devuelve el primer objeto (o arreglo) JSON del texto con arreglos deterministas:
+    descarta texto antes y después del objeto y los delimitadores ```, escapa comillas y
+    saltos de línea dentro de textos, elimina comas finales y cierra textos, corchetes y
+    llaves que quedaron abiertos. No garantiza un JSON válido: el llamador lo vuelve a parsear.
+    """
+    inicio = min((i for i in (texto.find("{"), texto.find("[")) if i >= 0), default=-1)
+    if inicio < 0:
+        return texto.strip()
+
+    salida: List[str] = []
+    pila: List[str] = []
+    en_cadena = False
+    escape = False
+
+    for i in range(inicio, len(texto)):
+        caracter = texto[i]
+        if en_cadena:
+            if escape:
+                escape = False
+                salida.append(caracter)
+            elif caracter == "\\":
+                escape = True
+                salida.append(caracter)
+            elif caracter == '"':
+                # Solo cierra el texto si lo que sigue es estructura JSON; si no, es una comilla interna
+                if _siguiente_significativo(texto, i + 1) in ("", ",", ":", "}", "]"):
+                    en_cadena = False
+                    salida.append(caracter)
+                else:
+                    salida.append('\\"')
+            elif caracter == "\n":
+                salida.append("\\n")
+            elif caracter == "\t":
+                salida.append("\\t")
+            elif caracter != "\r":
+                salida.append(caracter)
+            continue
+
+        if caracter == '"':
+            en_cadena = True
+            salida.append(caracter)
+        elif caracter in "{[":
+            pila.append("}" if caracter == "{" else "]")
+            salida.append(caracter)
+        elif caracter in "}]":
+            _quitar_coma_final(salida)
+            if pila:
+                salida.append(pila.pop())
+                if not pila:
+                    # Objeto completo: lo que sigue es texto del modelo (ej: cierre del bloque ```)
+                    break
+        else:
+            salida.append(caracter)
+
+    # Respuesta cortada: cerrar el texto abierto, descartar una clave sin valor y cerrar contenedores
+    if en_cadena:
+        if escape:
+            salida.pop()
+        salida.append('"')
+    reparado = "".join(salida)
+    if pila and pila[-1] == "}":
+        reparado = _CLAVE_COLGANTE.sub("", reparado)
+    salida = list(reparado)
+    _quitar_coma_final(salida)
+    salida.extend(reversed(pila))
+    return "".join(salida)
+
+
+def cargar_json_tolerante(texto: str) -> Tuple[Any, bool]:
+    """
+    Parsea el texto como JSON; si falla, lo intenta con reparar_json().
+    Retorna (datos, reparado). Si ni la versión reparada es válida, propaga el
+    json.JSONDecodeError del texto original.
+    """
+    try:
+        return json.loads(texto), False
+    except json.JSONDecodeError as error_original:
+        try:
+            return json.loads(reparar_json(texto)), True
+        except json.JSONDecodeError:
+            raise error_original
@@ -43,9 +43,18 @@ def main():
         "auditar_atencion.py",
         "generar_reporte.py",
         "ver_historial_raw.py",
-        "queries/get_todas_atenciones_24h.sql",
+        "queries/get_atenciones_urgencias.sql",
         "queries/get_detalle_atencion.sql",
+        "queries/get_detalle_lote_evoluciones.sql",
+        "queries/get_detalle_lote_signos_vitales.sql",
+        "queries/get_detalle_lote_ejecuciones_medicamentos.sql",
+        "queries/get_detalle_lote_notas_enfermeria.sql",
+        "queries/get_detalle_lote_laboratorios.sql",
+        "queries/get_detalle_lote_estudios_imagen.sql",
+        "queries/get_detalle_lote_solicitudes_laboratorio.sql",
+        "queries/get_detalle_lote_solicitudes_imagen.sql",
         "utils/__init__.py",
+        "utils/render.py",
         "pyproject.toml",
         "README.md",
         "CHANGELOG.md",
@@ -123,7 +132,7 @@ def main():
     # ============================================================
     print("\n[Fase 5] Verificando query SQL principal...")
 
-    with open('queries/get_todas_atenciones_24h.sql', 'r', encoding='utf-8') as f:
+    with open('queries/get_atenciones_urgencias.sql', 'r', encoding='utf-8') as f:
         query = f.read()
 
     all_tests_passed &= test_result(
@@ -148,7 +157,7 @@ def main():
 
     all_tests_passed &= test_result(
         "Ventana de 24 horas",
-        'DATE_SUB(NOW(), INTERVAL 24 HOUR)' in query
+        'DATE_SUB(NOW(), INTERVAL 24 HOUR)' in main_content
     )
 
     # ============================================================
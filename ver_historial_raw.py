@@ -4,7 +4,7 @@ Script temporal para ver el historial RAW que se envía a Claude
 import os
 import sys
 from dotenv import load_dotenv
-from main import MCPClient, formatear_atencion_para_llm
+from main import MCPClient, formatear_atencion_para_llm, configurar_logging
 
 load_dotenv()
 
@@ -72,6 +72,8 @@ def ver_historial(gestion, internacion, id_cuenta=1):
     print(f"\n💾 Historial guardado en: {output_file}")
 
 if __name__ == "__main__":
+    configurar_logging()
+
     if len(sys.argv) < 2:
         print("Uso: python ver_historial_raw.py GESTION/INTERNACION")
         print("Ejemplo: python ver_historial_raw.py 2025/141671")